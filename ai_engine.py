@@ -1,19 +1,36 @@
 # -*- coding: utf-8 -*-
 """中国象棋 AI：三种难度（普通、困难、地狱）。"""
 
+import os
 import random
-from typing import List, Tuple, Optional
+import time
+from typing import Callable, Iterable, List, Tuple, Optional
 
 from chess_engine import (
-    board_to_json_serializable,
+    Position,
+    Move,
     all_legal_moves,
     make_move,
+    unmake_move,
     is_king_attacked,
-    kings_face_each_other,
-    get_king_pos,
+    position_key,
+    move_to_iccs,
+    set_score_table,
+    PIECE_TYPES,
+    PIECE_CODES,
+    BLACK_FLAG,
+    TYPE_MASK,
+    HORSE,
+    ROOK,
+    CANNON,
     RED,
     BLACK,
 )
+from transposition import TranspositionTable, EXACT, LOWER, UPPER
+from move_ordering import MoveOrderer
+from opening_book import get_book
+from tablebase import get_tablebases
+from batch_eval import get_child_evaluator
 
 # 棋子价值（粗略）
 PIECE_VALUES = {
@@ -25,110 +42,653 @@ PIECE_VALUES = {
     'cannon': 45,
     'pawn': 10,
 }
+# 按兵种编码索引的棋子价值
+CODE_VALUES = (0,) + tuple(PIECE_VALUES[t] for t in PIECE_TYPES)
 
-# 难度对应搜索深度
-DEPTH_BY_DIFFICULTY = {
-    'normal': 1,
-    'hard': 2,
-    'hell': 3,
+# 位置分（红方视角，行 0 为黑方底线）；黑方按行上下翻转使用，未列出的兵种不加位置分
+PIECE_SQUARE_TABLES = {
+    'pawn': [
+        [0, 1, 2, 3, 4, 3, 2, 1, 0],
+        [6, 9, 12, 16, 18, 16, 12, 9, 6],
+        [6, 9, 12, 15, 16, 15, 12, 9, 6],
+        [5, 8, 10, 12, 12, 12, 10, 8, 5],
+        [4, 6, 8, 10, 10, 10, 8, 6, 4],
+        [0, 0, 0, 0, 0, 0, 0, 0, 0],
+        [0, 0, 0, 0, 2, 0, 0, 0, 0],
+        [0, 0, 0, 0, 0, 0, 0, 0, 0],
+        [0, 0, 0, 0, 0, 0, 0, 0, 0],
+        [0, 0, 0, 0, 0, 0, 0, 0, 0],
+    ],
+    'horse': [
+        [2, 2, 2, 4, 2, 4, 2, 2, 2],
+        [2, 4, 6, 5, 2, 5, 6, 4, 2],
+        [3, 5, 6, 7, 6, 7, 6, 5, 3],
+        [3, 6, 7, 8, 7, 8, 7, 6, 3],
+        [2, 5, 6, 7, 7, 7, 6, 5, 2],
+        [2, 4, 5, 6, 6, 6, 5, 4, 2],
+        [1, 3, 4, 5, 4, 5, 4, 3, 1],
+        [0, 2, 3, 3, 2, 3, 3, 2, 0],
+        [0, 1, 2, 1, -2, 1, 2, 1, 0],
+        [0, -2, 1, 0, 0, 0, 1, -2, 0],
+    ],
+    'rook': [
+        [4, 5, 4, 6, 6, 6, 4, 5, 4],
+        [5, 6, 5, 8, 10, 8, 5, 6, 5],
+        [4, 5, 4, 6, 6, 6, 4, 5, 4],
+        [4, 6, 5, 6, 6, 6, 5, 6, 4],
+        [5, 6, 6, 6, 6, 6, 6, 6, 5],
+        [5, 6, 6, 6, 6, 6, 6, 6, 5],
+        [3, 4, 4, 4, 4, 4, 4, 4, 3],
+        [2, 3, 3, 4, 3, 4, 3, 3, 2],
+        [2, 3, 3, 3, 2, 3, 3, 3, 2],
+        [-2, 3, 2, 3, 0, 3, 2, 3, -2],
+    ],
+    'cannon': [
+        [3, 3, 0, -2, -3, -2, 0, 3, 3],
+        [2, 2, 0, -2, -4, -2, 0, 2, 2],
+        [1, 1, 0, -1, -2, -1, 0, 1, 1],
+        [0, 0, 0, 0, 1, 0, 0, 0, 0],
+        [0, 0, 0, 0, 2, 0, 0, 0, 0],
+        [-1, 0, 1, 0, 2, 0, 1, 0, -1],
+        [0, 0, 0, 0, 1, 0, 0, 0, 0],
+        [1, 0, 2, 2, 3, 2, 2, 0, 1],
+        [0, 1, 1, 1, 1, 1, 1, 1, 0],
+        [0, 0, 1, 2, 2, 2, 1, 0, 0],
+    ],
 }
 
 
-def evaluate_board(board: List[List], side: str) -> float:
+def build_score_table(piece_values: dict = None, square_tables: dict = None) -> list:
+    """由棋子价值与位置分生成 chess_engine 的增量评估表（红正黑负）。"""
+    piece_values = piece_values or PIECE_VALUES
+    square_tables = square_tables if square_tables is not None else PIECE_SQUARE_TABLES
+    table = [0] * (16 * 90)
+    for name in PIECE_TYPES:
+        code = PIECE_CODES[name]
+        rows = square_tables.get(name)
+        for sq in range(90):
+            r, c = divmod(sq, 9)
+            table[code * 90 + sq] = piece_values[name] + (rows[r][c] if rows else 0)
+            table[(code | BLACK_FLAG) * 90 + sq] = -(piece_values[name] + (rows[9 - r][c] if rows else 0))
+    return table
+
+
+set_score_table(build_score_table())
+
+# 难度对应的搜索上限：迭代加深的最大深度与单步思考时间（毫秒）
+SEARCH_LIMITS_BY_DIFFICULTY = {
+    'normal': {'max_depth': 1, 'time_ms': None},
+    'hard': {'max_depth': 3, 'time_ms': 1000},
+    'hell': {'max_depth': 8, 'time_ms': 3000},
+}
+# 先查残局库与开局库的难度（普通难度保持原有的弱棋风格）
+BOOK_DIFFICULTIES = ('hard', 'hell')
+
+# 将死得分：在距根 ply 步处被将死记为 -(MATE_SCORE - ply)，越快的杀棋分越高；
+# 绝对值不低于 MATE_BOUND 的得分视为杀棋分。INF 为搜索窗口的无穷大
+MATE_SCORE = 10000
+MATE_BOUND = MATE_SCORE // 2
+INF = 1e9
+# 可单独开关的选择性搜索技术：主变例搜索、期望窗口、空着裁剪、后期着法削减
+SEARCH_FEATURES = ('pvs', 'aspiration', 'null_move', 'lmr')
+# 期望窗口：以上一层得分为中心的半宽，失败时放宽 4 倍，超过上限改用完整窗口
+ASPIRATION_WINDOW = 20
+ASPIRATION_MAX = 400
+# 空着裁剪：剩余深度至少 NULL_MOVE_MIN_DEPTH 才尝试，让一步后少搜 NULL_MOVE_REDUCTION 层；
+# 走棋方的车马炮少于 NULL_MOVE_MIN_PIECES 个时不做（残局中让一步可能真的吃亏）
+NULL_MOVE_MIN_DEPTH = 3
+NULL_MOVE_REDUCTION = 2
+NULL_MOVE_PIECES = (ROOK, HORSE, CANNON)
+NULL_MOVE_MIN_PIECES = 2
+# 后期着法削减：剩余深度至少 LMR_MIN_DEPTH、排序在前 LMR_FULL_MOVES 个之后的安静着法少搜一层
+LMR_MIN_DEPTH = 3
+LMR_FULL_MOVES = 3
+
+
+class SearchAborted(Exception):
+    """搜索超出时间或节点预算时抛出，由迭代加深循环捕获。"""
+
+
+class SearchBudget:
+    """单次 ai_choose_move 的时间/节点预算，并统计已访问节点数；should_stop 返回真时视同超时（用于取消）。"""
+
+    def __init__(
+        self,
+        time_ms: Optional[int] = None,
+        max_nodes: Optional[int] = None,
+        should_stop: Optional[Callable[[], bool]] = None,
+    ):
+        self.start = time.perf_counter()
+        self.deadline = self.start + time_ms / 1000.0 if time_ms else None
+        self.max_nodes = max_nodes
+        self.should_stop = should_stop
+        self.nodes = 0
+        # 第一轮迭代完成前不中断，保证总能给出一步棋
+        self.enforced = False
+
+    def tick(self):
+        self.nodes += 1
+        if not self.enforced:
+            return
+        if self.max_nodes is not None and self.nodes >= self.max_nodes:
+            raise SearchAborted()
+        if self.nodes & 31 == 0:
+            if self.deadline is not None and time.perf_counter() >= self.deadline:
+                raise SearchAborted()
+            if self.should_stop is not None and self.should_stop():
+                raise SearchAborted()
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.start) * 1000.0
+
+    def worth_next_iteration(self) -> bool:
+        """下一轮通常比已用时间长得多：已用掉一半以上的时间或节点预算就不再开始新一轮。"""
+        if self.max_nodes is not None and self.nodes * 2 >= self.max_nodes:
+            return False
+        if self.deadline is not None and time.perf_counter() * 2 >= self.deadline + self.start:
+            return False
+        return True
+
+
+class SearchStats:
     """
-    步骤1：己方棋子价值之和减去对方棋子价值之和。
-    步骤2：己方将/帅被将军则大幅罚分。
+    一次搜索的统计，用于排查“AI 慢”：访问节点（含静态搜索节点）、剪枝次数、置换表命中、
+    空着裁剪次数、削减的着法数与重搜次数（零窗口、削减或期望窗口失败后）、
+    每轮迭代的深度/得分/节点/耗时/主变例，以及有效分支因子（最后两轮节点数之比）。
     """
-    score = 0.0
-    opp = BLACK if side == RED else RED
-    for r in range(10):
-        for c in range(9):
-            p = board[r][c]
-            if not p:
-                continue
-            v = PIECE_VALUES.get(p['type'], 0)
-            if p['color'] == side:
-                score += v
-            else:
-                score -= v
+
+    def __init__(self):
+        self.nodes = 0
+        self.qnodes = 0
+        self.cutoffs = 0
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.null_cutoffs = 0
+        self.reductions = 0
+        self.researches = 0
+        self.depth = 0
+        self.elapsed_ms = 0.0
+        self.iterations = []
+        # 着法来源：search 为搜索所得，book 为开局库，tablebase 为残局库
+        self.source = 'search'
+
+    def branching_factor(self) -> Optional[float]:
+        if len(self.iterations) < 2 or not self.iterations[-2]['nodes']:
+            return None
+        return self.iterations[-1]['nodes'] / self.iterations[-2]['nodes']
+
+    def to_json(self) -> dict:
+        bf = self.branching_factor()
+        return {
+            'source': self.source,
+            'nodes': self.nodes,
+            'qnodes': self.qnodes,
+            'cutoffs': self.cutoffs,
+            'tt_probes': self.tt_probes,
+            'tt_hits': self.tt_hits,
+            'null_cutoffs': self.null_cutoffs,
+            'reductions': self.reductions,
+            'researches': self.researches,
+            'depth': self.depth,
+            'elapsed_ms': round(self.elapsed_ms, 1),
+            'branching_factor': round(bf, 2) if bf is not None else None,
+            'pv': self.iterations[-1]['pv'] if self.iterations else [],
+            'iterations': self.iterations,
+        }
+
+
+class SearchContext:
+    """
+    一次搜索共享的状态：置换表、预算、着法排序器与统计，任一项为 None 即不启用；
+    quiescence 为 False 时在 negamax 叶子直接返回静态评估；root_moves 为根节点已生成的合法着法，各层迭代复用；
+    progress(depth, score, move, nodes) 在迭代加深每完成一层时调用，用于向前端推送搜索进度；
+    features 为启用的选择性搜索技术（见 SEARCH_FEATURES），默认都不启用，即普通的全宽 alpha-beta。
+    """
+
+    def __init__(
+        self,
+        tt: Optional[TranspositionTable] = None,
+        budget: Optional[SearchBudget] = None,
+        orderer: Optional[MoveOrderer] = None,
+        quiescence: bool = True,
+        stats: Optional[SearchStats] = None,
+        root_moves: Optional[List[Move]] = None,
+        progress: Optional[Callable[[int, float, Move, int], None]] = None,
+        features: Iterable[str] = (),
+    ):
+        self.tt = tt
+        self.budget = budget
+        self.orderer = orderer
+        self.quiescence = quiescence
+        self.stats = stats
+        self.root_moves = root_moves
+        self.progress = progress
+        features = frozenset(features)
+        unknown = features - set(SEARCH_FEATURES)
+        if unknown:
+            raise ValueError('unknown search features: %s' % ', '.join(sorted(unknown)))
+        self.pvs = 'pvs' in features
+        self.aspiration = 'aspiration' in features
+        self.null_move = 'null_move' in features
+        self.lmr = 'lmr' in features
+
+
+def parse_features(text: str) -> Tuple[str, ...]:
+    """
+    'all' / 'none' / 'pvs,lmr' / '-lmr'（全部启用但去掉 lmr）-> 启用的技术元组。
+    """
+    text = (text or '').strip()
+    if text in ('', 'none'):
+        return ()
+    if text == 'all':
+        return SEARCH_FEATURES
+    names = [n.strip() for n in text.split(',') if n.strip()]
+    if all(n.startswith('-') for n in names):
+        removed = {n[1:] for n in names}
+        enabled = tuple(f for f in SEARCH_FEATURES if f not in removed)
+    else:
+        removed = set()
+        enabled = tuple(names)
+    unknown = (set(enabled) | removed) - set(SEARCH_FEATURES)
+    if unknown:
+        raise ValueError('unknown search features: %s' % ', '.join(sorted(unknown)))
+    return enabled
+
+
+# 困难/地狱实际使用的选择性搜索技术，AI_SEARCH_FEATURES 可覆盖（如 -null_move 关闭空着裁剪）
+DEFAULT_FEATURES = parse_features(os.environ.get('AI_SEARCH_FEATURES', 'all'))
+
+
+def evaluate_board(board: Position, side: str) -> float:
+    """side 方视角的子力+位置分，直接取走子时增量维护的 board.score，无需扫描棋盘。"""
+    return board.score if side == RED else -board.score
+
+
+def quiescence(
+    board: Position,
+    side: str,
+    alpha: float,
+    beta: float,
+    ctx: SearchContext,
+    ply: int = 0,
+) -> float:
+    """
+    静态搜索（side 为当前走棋方，返回其视角的得分）：negamax 叶子处只继续搜吃子，直到局面平静，避免在兑子途中截断评估。
+    步骤1：被将军时不能“站着不动”，搜索全部应将着法；无着法即被将死。
+    步骤2：否则以静态评估为站立分（stand pat），已不低于 beta 则直接返回。
+    步骤3：按 MVV-LVA 顺序搜索吃子着法，alpha-beta 剪枝。
+    """
+    if ctx.budget is not None:
+        ctx.budget.tick()
+    if ctx.stats is not None:
+        ctx.stats.qnodes += 1
     if is_king_attacked(board, side):
-        score -= 500
-    if is_king_attacked(board, opp):
-        score += 300
+        moves = all_legal_moves(board, side)
+        if not moves:
+            return -(MATE_SCORE - ply)
+        best_val = -INF
+    else:
+        best_val = evaluate_board(board, side)
+        if best_val >= beta:
+            return best_val
+        alpha = max(alpha, best_val)
+        moves = all_legal_moves(board, side, captures_only=True)
+    if ctx.orderer is not None:
+        moves = ctx.orderer.order(board, moves, ply)
+    opp = BLACK if side == RED else RED
+    for move in moves:
+        undo = make_move(board, move[0], move[1])
+        val = -quiescence(board, opp, -beta, -alpha, ctx, ply + 1)
+        unmake_move(board, undo)
+        if val > best_val:
+            best_val = val
+            if val > alpha:
+                alpha = val
+                if alpha >= beta:
+                    break
+    return best_val
+
+
+def _score_to_tt(score: float, ply: int) -> float:
+    """杀棋分存入置换表前改为相对当前节点的步数，同一局面在不同深度命中时杀棋距离仍然正确。"""
+    if score >= MATE_BOUND:
+        return score + ply
+    if score <= -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def _score_from_tt(score: float, ply: int) -> float:
+    """_score_to_tt 的逆操作：取出时换回相对根节点的步数。"""
+    if score >= MATE_BOUND:
+        return score - ply
+    if score <= -MATE_BOUND:
+        return score + ply
     return score
 
 
-def minimax(
-    board: List[List],
+def _null_move_material(board: Position, side: str) -> bool:
+    """side 方的车马炮不少于 NULL_MOVE_MIN_PIECES 个；子力太少时让一步可能真的吃亏（等着），不做空着裁剪。"""
+    flag = BLACK_FLAG if side == BLACK else 0
+    count = 0
+    for p in board.cells:
+        if p and p & BLACK_FLAG == flag and p & TYPE_MASK in NULL_MOVE_PIECES:
+            count += 1
+            if count >= NULL_MOVE_MIN_PIECES:
+                return True
+    return False
+
+
+def negamax(
+    board: Position,
     depth: int,
     side: str,
     alpha: float,
     beta: float,
-    is_max: bool,
-) -> Tuple[float, Optional[Tuple[Tuple[int, int], Tuple[int, int]]]]:
+    ctx: Optional[SearchContext] = None,
+    ply: int = 0,
+    allow_null: bool = True,
+) -> Tuple[float, Optional[Move]]:
     """
-    步骤1：深度为 0 时返回当前局面评估。
-    步骤2：生成当前轮走棋方的所有合法着法。
-    步骤3：若无可走则按将死/困毙返回极值，否则递归并 alpha-beta 剪枝。
+    side 为当前走棋方，返回其视角的得分（可落在窗口外）与最佳着法。
+    步骤0：计入预算，超时或超出节点数时抛出 SearchAborted。
+    步骤1：深度为 0 时进入静态搜索（或直接返回当前局面评估）。
+    步骤2：查置换表：深度足够时直接返回或收窄窗口。
+    步骤3：空着裁剪（null_move）：未被将军、子力足够且静态评估已不低于 beta 时，让对方连走一步并少搜
+           NULL_MOVE_REDUCTION 层，仍不低于 beta 即剪枝。
+    步骤4：生成并排序着法（置换表着法最先）；无着法按将死/困毙返回。
+    步骤5：逐个搜索并 alpha-beta 剪枝。主变例搜索（pvs）：第一个着法用完整窗口，其余先用零窗口证明不比它好，
+           证明失败再用完整窗口重搜；后期着法削减（lmr）：排在 LMR_FULL_MOVES 之后的安静着法先少搜一层，
+           得分超过 alpha 再按原深度重搜。结果写回置换表。
     """
+    if ctx is None:
+        ctx = SearchContext()
+    if ctx.budget is not None:
+        ctx.budget.tick()
     if depth <= 0:
+        if ctx.quiescence:
+            return quiescence(board, side, alpha, beta, ctx, ply), None
         return evaluate_board(board, side), None
-    current_side = side if is_max else (BLACK if side == RED else RED)
-    moves = all_legal_moves(board, current_side)
+    alpha_orig, beta_orig = alpha, beta
+    tt = ctx.tt
+    stats = ctx.stats
+    tt_move = None
+    if tt is not None:
+        key = position_key(board, side)
+        entry = tt.probe(key)
+        if stats is not None:
+            stats.tt_probes += 1
+            if entry is not None:
+                stats.tt_hits += 1
+        if entry is not None:
+            _, entry_depth, bound, score, tt_move, _ = entry
+            score = _score_from_tt(score, ply)
+            if entry_depth >= depth:
+                if bound == EXACT:
+                    return score, tt_move
+                if bound == LOWER:
+                    alpha = max(alpha, score)
+                else:
+                    beta = min(beta, score)
+                if beta <= alpha:
+                    return score, tt_move
+    opp = BLACK if side == RED else RED
+    in_check = (ctx.null_move or ctx.lmr) and is_king_attacked(board, side)
+    if (ctx.null_move and allow_null and ply > 0 and depth >= NULL_MOVE_MIN_DEPTH and not in_check
+            and beta < MATE_BOUND and evaluate_board(board, side) >= beta
+            and _null_move_material(board, side)):
+        val, _ = negamax(board, depth - 1 - NULL_MOVE_REDUCTION, opp, -beta, -beta + 1, ctx, ply + 1, False)
+        if -val >= beta:
+            if stats is not None:
+                stats.null_cutoffs += 1
+            return beta, None
+    if ply == 0 and ctx.root_moves is not None:
+        moves = list(ctx.root_moves)
+    else:
+        moves = all_legal_moves(board, side)
     if not moves:
-        if is_king_attacked(board, current_side):
-            return (-10000 if is_max else 10000), None
+        if is_king_attacked(board, side):
+            return -(MATE_SCORE - ply), None
         return evaluate_board(board, side), None
-    best_move = moves[0]
-    if is_max:
-        best_val = -1e9
-        for (fr, fc), (tr, tc) in moves:
-            new_board = make_move(board, (fr, fc), (tr, tc))
-            val, _ = minimax(new_board, depth - 1, side, alpha, beta, False)
-            if val > best_val:
-                best_val = val
-                best_move = ((fr, fc), (tr, tc))
-            alpha = max(alpha, best_val)
-            if beta <= alpha:
-                break
-        return best_val, best_move
-    else:
-        best_val = 1e9
-        for (fr, fc), (tr, tc) in moves:
-            new_board = make_move(board, (fr, fc), (tr, tc))
-            val, _ = minimax(new_board, depth - 1, side, alpha, beta, True)
-            if val < best_val:
-                best_val = val
-                best_move = ((fr, fc), (tr, tc))
-            beta = min(beta, best_val)
-            if beta <= alpha:
+    orderer = ctx.orderer
+    if orderer is not None:
+        moves = orderer.order(board, moves, ply, tt_move)
+    elif tt_move is not None and tt_move in moves:
+        moves.remove(tt_move)
+        moves.insert(0, tt_move)
+    best_val, best_move = -INF, moves[0]
+    cells = board.cells
+    for i, move in enumerate(moves):
+        quiet = not cells[move[1]]
+        undo = make_move(board, move[0], move[1])
+        if i == 0:
+            val = -negamax(board, depth - 1, opp, -beta, -alpha, ctx, ply + 1)[0]
+        else:
+            # 不启用 pvs 时 window 即完整窗口，下面的验证搜索就是普通搜索
+            window = alpha + 1 if ctx.pvs else beta
+            reduction = 0
+            if (ctx.lmr and i >= LMR_FULL_MOVES and depth >= LMR_MIN_DEPTH and quiet and not in_check
+                    and not is_king_attacked(board, opp)):
+                reduction = 1
+                if stats is not None:
+                    stats.reductions += 1
+            val = -negamax(board, depth - 1 - reduction, opp, -window, -alpha, ctx, ply + 1)[0]
+            if reduction and val > alpha:
+                if stats is not None:
+                    stats.researches += 1
+                val = -negamax(board, depth - 1, opp, -window, -alpha, ctx, ply + 1)[0]
+            if window != beta and alpha < val < beta:
+                if stats is not None:
+                    stats.researches += 1
+                val = -negamax(board, depth - 1, opp, -beta, -alpha, ctx, ply + 1)[0]
+        unmake_move(board, undo)
+        if val > best_val:
+            best_val = val
+            best_move = move
+            if val > alpha:
+                alpha = val
+        if alpha >= beta:
+            if orderer is not None:
+                orderer.record_cutoff(board, move, depth, ply)
+            if stats is not None:
+                stats.cutoffs += 1
+            break
+    if tt is not None:
+        if best_val <= alpha_orig:
+            bound = UPPER
+        elif best_val >= beta_orig:
+            bound = LOWER
+        else:
+            bound = EXACT
+        tt.store(key, depth, bound, _score_to_tt(best_val, ply), best_move)
+    return best_val, best_move
+
+
+def search_root_moves(
+    board: Position,
+    side: str,
+    depth: int,
+    moves: List[Move],
+    ctx: SearchContext,
+    shared_alpha: Optional[Tuple[Callable[[], float], Callable[[float], None]]] = None,
+) -> List[Tuple[float, Move]]:
+    """
+    根节点拆分：只搜索给定的根着法子集，返回每个着法的 (得分, 着法)。
+    shared_alpha 为 (读, 写) 回调，多个进程借此共享当前最好分来收窄窗口；
+    低于共享分的着法只得到上界，但最佳着法的得分总是精确的。
+    """
+    results = []
+    alpha = -INF
+    opp = BLACK if side == RED else RED
+    for move in moves:
+        if shared_alpha is not None:
+            alpha = max(alpha, shared_alpha[0]())
+        undo = make_move(board, move[0], move[1])
+        val = -negamax(board, depth - 1, opp, -INF, -alpha, ctx, 1)[0]
+        unmake_move(board, undo)
+        results.append((val, move))
+        if val > alpha:
+            alpha = val
+            if shared_alpha is not None:
+                shared_alpha[1](val)
+    return results
+
+
+def principal_variation(board: Position, side: str, tt: TranspositionTable, max_len: int) -> List[Move]:
+    """沿置换表中的最佳着法走下去得到主变例；遇到非法着法或重复局面即停止。"""
+    board = board.copy()
+    pv, seen = [], set()
+    while len(pv) < max_len:
+        key = position_key(board, side)
+        entry = tt.probe(key)
+        if entry is None or entry[4] is None or key in seen:
+            break
+        move = entry[4]
+        if move not in all_legal_moves(board, side):
+            break
+        seen.add(key)
+        pv.append(move)
+        make_move(board, move[0], move[1])
+        side = BLACK if side == RED else RED
+    return pv
+
+
+def search_root(
+    board: Position,
+    side: str,
+    depth: int,
+    ctx: SearchContext,
+    guess: Optional[float] = None,
+) -> Tuple[float, Optional[Move]]:
+    """
+    迭代加深的一层。启用 aspiration 且有上一层得分 guess 时，先用 guess ± ASPIRATION_WINDOW 的窄窗口搜索；
+    得分落在窗口外则把该侧窗口放宽 4 倍重搜，放宽到 ASPIRATION_MAX 以上即改用完整窗口。
+    """
+    if not ctx.aspiration or guess is None or depth < 2 or abs(guess) >= MATE_BOUND:
+        return negamax(board, depth, side, -INF, INF, ctx)
+    below = above = ASPIRATION_WINDOW
+    while True:
+        alpha = guess - below if below <= ASPIRATION_MAX else -INF
+        beta = guess + above if above <= ASPIRATION_MAX else INF
+        score, move = negamax(board, depth, side, alpha, beta, ctx)
+        if alpha < score < beta or (alpha == -INF and beta == INF):
+            return score, move
+        if ctx.stats is not None:
+            ctx.stats.researches += 1
+        if score <= alpha:
+            below *= 4
+        else:
+            above *= 4
+
+
+def iterative_deepening(
+    board: Position,
+    side: str,
+    max_depth: int,
+    ctx: SearchContext,
+) -> Tuple[Optional[Move], int]:
+    """
+    步骤1：从深度 1 起逐层调用 search_root，每层借助置换表先走上一层的最佳着法，并以上一层得分为期望窗口中心。
+    步骤2：预算耗尽时放弃未完成的一层，返回最后一个完整层的最佳着法及其深度。
+    启用统计时每完成一层记录得分、节点数、耗时与主变例。
+    """
+    best, completed = None, 0
+    budget = ctx.budget
+    stats = ctx.stats
+    score = None
+    for depth in range(1, max_depth + 1):
+        nodes_before = budget.nodes if budget is not None else 0
+        iteration_start = time.perf_counter()
+        try:
+            score, move = search_root(board, side, depth, ctx, score)
+        except SearchAborted:
+            break
+        best, completed = move, depth
+        if ctx.progress is not None:
+            ctx.progress(depth, score, move, budget.nodes if budget is not None else 0)
+        if stats is not None:
+            pv = principal_variation(board, side, ctx.tt, depth) if ctx.tt is not None else [move]
+            stats.iterations.append({
+                'depth': depth,
+                'score': score,
+                'nodes': (budget.nodes if budget is not None else 0) - nodes_before,
+                'ms': round((time.perf_counter() - iteration_start) * 1000.0, 1),
+                'pv': [move_to_iccs(m) for m in pv],
+            })
+        if budget is not None:
+            budget.enforced = True
+            if not budget.worth_next_iteration():
                 break
-        return best_val, best_move
+    return best, completed
 
 
 def ai_choose_move(
-    board: List[List],
+    board: Position,
     ai_color: str,
     difficulty: str,
-) -> Optional[Tuple[Tuple[int, int], Tuple[int, int]]]:
+    tt: Optional[TranspositionTable] = None,
+    time_ms: Optional[int] = None,
+    max_nodes: Optional[int] = None,
+    should_stop: Optional[Callable[[], bool]] = None,
+    stats: Optional[SearchStats] = None,
+    moves: Optional[List[Move]] = None,
+    on_progress: Optional[Callable[[int, float, Move, int], None]] = None,
+    features: Optional[Iterable[str]] = None,
+) -> Optional[Move]:
     """
-    步骤1：根据难度取搜索深度。
-    步骤2：用 minimax 找最优着法；若无则随机合法着法。
+    步骤1：根据难度取最大深度与时间预算；显式传入的 time_ms/max_nodes 优先，should_stop 用于外部取消。
+    步骤2：迭代加深搜索，返回最后完成的一层的最佳着法；若无则随机合法着法。
+    tt 为本局 AI 一方的置换表，跨多次调用保留，上一步的搜索结果可直接复用。
+    困难/地狱先查残局库与开局库，命中则直接返回库着法。传入 stats 时把本次搜索的统计写入其中。
+    moves 为调用方已生成的本方合法着法（如对局缓存），传入时不再重复生成；on_progress 见 SearchContext.progress。
+    features 为启用的选择性搜索技术，None 为 DEFAULT_FEATURES。
     """
-    depth = DEPTH_BY_DIFFICULTY.get(difficulty, 1)
-    moves = all_legal_moves(board, ai_color)
+    start = time.perf_counter()
+    limits = SEARCH_LIMITS_BY_DIFFICULTY.get(difficulty, SEARCH_LIMITS_BY_DIFFICULTY['normal'])
+    moves = list(moves) if moves is not None else all_legal_moves(board, ai_color)
     if not moves:
         return None
     if difficulty == 'normal':
-        # 普通难度：随机加一点评估，增加变化
-        scored = []
-        for m in moves:
-            new_b = make_move(board, m[0], m[1])
-            scored.append((evaluate_board(new_b, ai_color), m))
+        # 普通难度：一步评估（含机动性与将帅安全，有 NumPy 时整批计算），同分着法随机选
+        scored = list(zip(get_child_evaluator().evaluate_children(board, moves, ai_color), moves))
         scored.sort(key=lambda x: -x[0])
         top = [m for v, m in scored if v == scored[0][0]]
+        if stats is not None:
+            stats.nodes, stats.depth = len(moves), 1
+            stats.elapsed_ms = (time.perf_counter() - start) * 1000.0
         return random.choice(top)
-    _, best = minimax(board, depth, ai_color, -1e9, 1e9, True)
-    if best is not None:
+    if difficulty in BOOK_DIFFICULTIES:
+        known = get_tablebases().best_move(board, ai_color)
+        if known is not None:
+            if stats is not None:
+                stats.source = 'tablebase'
+                stats.elapsed_ms = (time.perf_counter() - start) * 1000.0
+            return known[0]
+        book = get_book()
+        book_move = book.choose(board, ai_color) if book is not None else None
+        if book_move is not None:
+            if stats is not None:
+                stats.source = 'book'
+                stats.elapsed_ms = (time.perf_counter() - start) * 1000.0
+            return book_move
+    if tt is None:
+        tt = TranspositionTable()
+    tt.new_search()
+    ctx = SearchContext(
+        tt=tt,
+        budget=SearchBudget(time_ms if time_ms is not None else limits['time_ms'], max_nodes, should_stop),
+        orderer=MoveOrderer(CODE_VALUES),
+        stats=stats,
+        root_moves=moves,
+        progress=on_progress,
+        features=DEFAULT_FEATURES if features is None else features,
+    )
+    # 在副本上搜索：预算耗尽时 SearchAborted 会跳过 unmake_move
+    best, completed = iterative_deepening(board.copy(), ai_color, limits['max_depth'], ctx)
+    if stats is not None:
+        stats.nodes = ctx.budget.nodes
+        stats.depth = completed
+        stats.elapsed_ms = (time.perf_counter() - start) * 1000.0
+    if best is not None and best in moves:
         return best
     return random.choice(moves)
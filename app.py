@@ -1,27 +1,155 @@
 # -*- coding: utf-8 -*-
-"""中国象棋后端 API：新局、走子、AI 应答、历史记录。"""
+"""中国象棋后端 API：新局、走子、AI 应答（同步、轮询或 SSE 推送）、历史记录。
 
-from flask import Flask, request, jsonify
+对局状态有两种表示：默认的 JSON（每次带完整 10x9 棋盘），以及 Accept 为 COMPACT_MEDIA_TYPE
+或 ?format=compact 时的紧凑线格式（FEN 全量 + 每步增量，见 wire_format.py）。
+
+同一个 app 既可由 gunicorn 同步部署，也可经 asgi.py 异步服务：后者在 environ 中放入 ASYNC_ENVIRON_KEY 钩子，
+等待 AI 任务与事件流时交给事件循环，连接等待期间不占用线程。
+"""
+
+import os
+import threading
+import time
+from typing import Optional
+
+from flask import Flask, Response, request, jsonify
+from flask import g as request_state
 from flask_cors import CORS
 
 from chess_engine import (
     initial_board,
     all_legal_moves,
     make_move,
-    is_checkmate_or_stalemate,
-    get_king_pos,
+    is_king_attacked,
+    position_key,
     board_to_json_serializable,
+    move_to_json,
+    move_from_json,
+    move_to_iccs,
+    move_from_iccs,
+    board_from_fen,
+    board_to_fen,
+    position_error,
     RED,
     BLACK,
 )
-from ai_engine import ai_choose_move
-from history_store import add_record, list_records, get_record
+from search_pool import get_pool, PoolBusy, PENDING, DONE, CANCELLED
+from history_store import add_record, list_records, get_record, get_replay
+from session_store import create_store, SessionConflict
+from game_events import hub, format_event
+from wire_format import state_message, state_etag, COMPACT_MEDIA_TYPE
+from opening_book import get_book
+from tablebase import get_tablebases
+import metrics
 
 app = Flask(__name__, static_folder='static', static_url_path='')
 CORS(app)
 
-# 内存中的对局：game_id -> { board, turn, difficulty, red_is_ai, moves_count, board_history }
-games = {}
+# AI 单步思考时间（毫秒）；设置后覆盖各难度的默认预算，用于约束 /move 与 /ai_move 的延迟
+AI_TIME_BUDGET_MS = int(os.environ.get('AI_TIME_BUDGET_MS', '0')) or None
+
+# 长轮询 AI 任务时单次最多等待的时间（毫秒）
+MAX_POLL_WAIT_MS = 30000
+
+# 异步服务（asgi.py）在 WSGI environ 中放入的钩子，见 _after_job 与 api_game_events
+ASYNC_ENVIRON_KEY = 'xiangqi.async'
+
+# 对局会话存储：game_id -> { board, turn, difficulty, red_is_ai, moves_count, start, move_list, captures, ai_job, legal }
+# （共享后端另有 rev：读到的版本，写回时据此检测并发修改）
+# start 为起始局面，move_list 为已走着法；终局时二者一起写入历史记录。
+# captures 为每步被吃的棋子编码（0 为未吃子），紧凑格式据此从当前局面倒推出各步增量。
+# legal 为当前走棋方的合法着法、是否被将军与局面键，每步只算一次（见 _side_state）。
+# 后端由 GAME_STORE 选择（见 session_store.py）；修改对局后须 games.put 写回
+games = create_store()
+# 保护对局状态：请求线程与搜索完成回调线程都会修改；
+# 搜索很快结束时回调可能在提交任务的线程里同步执行，因此用可重入锁
+games_lock = threading.RLock()
+
+
+def _pool_active():
+    pool = get_pool()
+    return {(d,): pool.active_count(d) for d in pool.limits}
+
+
+def _session_metric(key):
+    return lambda: {(): games.metrics()[key]}
+
+
+metrics.Gauge('xiangqi_ai_jobs_active', 'AI search jobs queued or running.', _pool_active, ('difficulty',))
+metrics.Gauge('xiangqi_sessions_live', 'Game sessions held by the session store.', _session_metric('live_sessions'))
+metrics.Gauge('xiangqi_session_bytes', 'Serialized bytes of live game sessions.', _session_metric('bytes_held'))
+metrics.Gauge('xiangqi_ai_ponder_active', 'Background searches on the opponent\'s time.',
+              lambda: {(): get_pool().ponder_count()})
+metrics.Gauge('xiangqi_event_streams', 'Open server-sent event streams.', lambda: {(): hub.subscriber_count()})
+metrics.Gauge('xiangqi_session_evictions_total', 'Game sessions evicted by TTL or capacity.',
+              _session_metric('evictions'), kind='counter')
+
+
+@app.before_request
+def _start_timer():
+    request_state.started = time.perf_counter()
+    request_state.difficulty = ''
+
+
+@app.after_request
+def _record_latency(response):
+    """按路由模板（而非具体 id）与对局难度记录请求时延。"""
+    started = getattr(request_state, 'started', None)
+    server = request.environ.get(ASYNC_ENVIRON_KEY)
+    if server is not None and server.deferred:
+        # 异步服务在任务结束、真正发出响应时再经过这里记录
+        return response
+    if started is not None and request.url_rule is not None:
+        endpoint = request.url_rule.rule
+        metrics.HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=str(response.status_code))
+        metrics.HTTP_LATENCY.observe(time.perf_counter() - started, endpoint=endpoint, method=request.method,
+                                     difficulty=request_state.difficulty)
+    return response
+
+
+@app.errorhandler(SessionConflict)
+def _session_conflict(e):
+    """共享会话后端上对局已被其他进程改过：本次修改未写入，客户端重新取对局后再试。"""
+    return jsonify({'error': 'game changed by another request, reload and retry'}), 409
+
+
+def _debug_requested(data: Optional[dict] = None) -> bool:
+    """请求体 "debug": true 或查询参数 ?debug=1 时在响应中附带搜索统计。"""
+    if data and data.get('debug'):
+        return True
+    return request.args.get('debug', '') not in ('', '0', 'false')
+
+
+def _wants_compact() -> bool:
+    """?format=compact 或 Accept 中明确列出紧凑格式的媒体类型时用紧凑线格式（*/* 不算）。"""
+    if request.args.get('format') == 'compact':
+        return True
+    return any(value == COMPACT_MEDIA_TYPE and quality > 0 for value, quality in request.accept_mimetypes)
+
+
+def _since(data: Optional[dict] = None) -> Optional[int]:
+    """客户端已有的步数：请求体 "since" 或查询参数 ?since=，紧凑格式只发这之后的增量。"""
+    if data and isinstance(data.get('since'), int):
+        return data['since']
+    return request.args.get('since', type=int)
+
+
+def _negotiated(out: dict, compact: bool, status: int = 200):
+    """按协商的格式设置响应类型；两种格式共用 URL，缓存须按 Accept 区分。"""
+    resp = jsonify(out)
+    resp.status_code = status
+    if compact:
+        resp.mimetype = COMPACT_MEDIA_TYPE
+    resp.vary.add('Accept')
+    return resp
+
+
+def _load_game(game_id: str) -> Optional[dict]:
+    g = games.get(game_id)
+    if g is not None:
+        request_state.difficulty = g['difficulty']
+    return g
 
 
 def new_game_id():
@@ -36,188 +164,509 @@ def index():
 
 @app.route('/api/game/new', methods=['POST'])
 def api_new_game():
-    """步骤1：解析难度与是否红方为 AI。步骤2：创建新棋盘并写入 games。"""
+    """
+    步骤1：解析难度与是否红方为 AI；带 fen 时从该局面开局（残局、排局），走棋方取自 FEN。
+    步骤2：创建棋盘并写入 games。
+    """
     data = request.get_json() or {}
     difficulty = data.get('difficulty', 'normal')
     red_is_ai = data.get('red_is_ai', False)
-    board = initial_board()
+    request_state.difficulty = difficulty
+    if data.get('fen'):
+        try:
+            board, turn = board_from_fen(data['fen'])
+        except ValueError as e:
+            return jsonify({'error': 'invalid fen: %s' % e}), 400
+        error = position_error(board, turn)
+        if error:
+            return jsonify({'error': 'invalid position: %s' % error}), 400
+    else:
+        board, turn = initial_board(), RED
     gid = new_game_id()
-    board_history = [board_to_json_serializable(board)]
-    games[gid] = {
+    games.put(gid, {
         'board': board,
-        'turn': RED,
+        'turn': turn,
         'difficulty': difficulty,
         'red_is_ai': red_is_ai,
         'moves_count': 0,
-        'board_history': board_history,
-    }
-    return jsonify({
+        'start': board.copy(),
+        'move_list': [],
+        'captures': [],
+        'ai_job': None,
+    })
+    if _wants_compact():
+        out = state_message(board, turn, [], [])
+        out.update(game_id=gid, red_is_ai=red_is_ai, difficulty=difficulty)
+        return _negotiated(out, True)
+    return _negotiated({
         'game_id': gid,
         'board': board_to_json_serializable(board),
-        'turn': RED,
+        'fen': board_to_fen(board, turn),
+        'turn': turn,
         'red_is_ai': red_is_ai,
         'difficulty': difficulty,
-    })
+    }, False)
 
 
 @app.route('/api/game/<game_id>', methods=['GET'])
 def api_get_game(game_id):
-    g = games.get(game_id)
+    """
+    当前对局状态。带 ETag（步数 + 局面键）：If-None-Match 命中时返回 304，不重新编码棋盘。
+    紧凑格式下带 ?since=步数 时只返回之后的增量。
+    """
+    g = _load_game(game_id)
     if not g:
         return jsonify({'error': 'game not found'}), 404
-    return jsonify({
-        'board': board_to_json_serializable(g['board']),
-        'turn': g['turn'],
-        'difficulty': g['difficulty'],
-        'red_is_ai': g['red_is_ai'],
-        'moves_count': g['moves_count'],
-    })
+    compact = _wants_compact()
+    since = _since() if compact else None
+    etag = state_etag(g['board'], g['turn'], g['moves_count'], compact)
+    if since is not None:
+        etag += '-%d' % since
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    elif compact:
+        out = _compact_state(g, since)
+        out.update(difficulty=g['difficulty'], red_is_ai=g['red_is_ai'])
+        resp = _negotiated(out, True)
+    else:
+        resp = _negotiated({
+            'board': board_to_json_serializable(g['board']),
+            'fen': board_to_fen(g['board'], g['turn']),
+            'turn': g['turn'],
+            'difficulty': g['difficulty'],
+            'red_is_ai': g['red_is_ai'],
+            'moves_count': g['moves_count'],
+        }, False)
+    resp.set_etag(etag)
+    resp.vary.add('Accept')
+    return resp
 
 
-@app.route('/api/game/<game_id>/ai_move', methods=['POST'])
-def api_ai_move(game_id):
-    """步骤1：若当前轮为 AI，则计算并执行一步。步骤2：返回新棋盘与胜负。"""
-    g = games.get(game_id)
-    if not g:
-        return jsonify({'error': 'game not found'}), 404
-    ai_color = RED if g['red_is_ai'] else BLACK
-    if g['turn'] != ai_color:
-        return jsonify({'error': 'not ai turn'}), 400
+def _ai_color(g: dict) -> str:
+    return RED if g['red_is_ai'] else BLACK
+
+
+def _side_state(g: dict) -> dict:
+    """
+    当前走棋方的合法着法、是否被将军与局面键；按步数缓存在对局里，
+    走子校验、终局判断与 AI 根节点共用同一份结果，每步只生成一次合法着法。
+    """
+    state = g.get('legal')
+    if state is None or state['ply'] != g['moves_count']:
+        board, side = g['board'], g['turn']
+        state = g['legal'] = {
+            'ply': g['moves_count'],
+            'moves': all_legal_moves(board, side),
+            'in_check': is_king_attacked(board, side),
+            'key': position_key(board, side),
+        }
+    return state
+
+
+def _play_move(g: dict, move) -> Optional[str]:
+    """执行一步并轮换走棋方；终局时写入历史记录，返回胜方（'draw' 为和棋，未终局为 None）。"""
+    mover = g['turn']
     board = g['board']
-    ai_move = ai_choose_move(board, ai_color, g['difficulty'])
-    if not ai_move:
-        return jsonify({'error': 'no move'}), 400
-    from_a, to_a = ai_move
-    board = make_move(board, from_a, to_a)
-    g['board'] = board
+    g['captures'].append(board.cells[move[1]])
+    make_move(board, move[0], move[1])
     g['moves_count'] += 1
-    g['board_history'].append(board_to_json_serializable(board))
-    g['turn'] = RED if g['turn'] == BLACK else BLACK
-    result = is_checkmate_or_stalemate(board, g['turn'])
+    g['move_list'].append(move)
+    g['turn'] = BLACK if mover == RED else RED
+    state = _side_state(g)
     winner = None
-    if result == 'checkmate':
-        winner = ai_color
-    elif result == 'stalemate':
-        winner = 'draw'
+    if not state['moves']:
+        # 无着可走：被将军为将死，否则为困毙（按和棋处理）
+        winner = mover if state['in_check'] else 'draw'
     if winner:
         add_record(
             winner=winner,
             difficulty=g['difficulty'],
             moves_count=g['moves_count'],
-            board_snapshots=g['board_history'],
+            start=g['start'],
+            moves=g['move_list'],
             red_is_ai=g['red_is_ai'],
         )
+    return winner
+
+
+def _state_response(g: dict, ai_move=None, winner: Optional[str] = None) -> dict:
+    out = {
+        'board': board_to_json_serializable(g['board']),
+        'turn': g['turn'],
+        'moves_count': g['moves_count'],
+    }
+    if ai_move:
+        out['ai_move'] = move_to_json(ai_move)
+    if winner:
+        out['winner'] = winner
+        out['game_over'] = True
+    return out
+
+
+def _compact_state(g: dict, since: Optional[int] = None, winner: Optional[str] = None) -> dict:
+    """紧凑格式的对局状态：since 之后的增量，since 无效时为 FEN 全量。"""
+    out = state_message(g['board'], g['turn'], g['move_list'], g['captures'], since)
+    if winner:
+        out['winner'] = winner
+        out['game_over'] = True
+    return out
+
+
+def _compact_result(job, since: Optional[int] = None) -> Optional[dict]:
+    """已完成 AI 任务的紧凑结果：本局当前状态，默认只含 AI 这一步的增量；对局已不在时返回 None。"""
+    with games_lock:
+        g = games.get(job.game_id)
+        if g is None:
+            return None
+        if since is None:
+            since = job.result['moves_count'] - 1
+        return _compact_state(g, since, job.result.get('winner'))
+
+
+def _job_json(job, compact: bool = False, since: Optional[int] = None, debug: bool = False) -> dict:
+    """任务状态；紧凑格式下已完成任务的结果（完整棋盘）换成紧凑结果。"""
+    out = job.to_json(debug=debug)
+    if compact and job.status == DONE and job.result:
+        result = _compact_result(job, since)
+        if result is not None:
+            for key in job.result:
+                out.pop(key, None)
+            out.update(result)
+    return out
+
+
+def _pending_ai_job(g: dict):
+    """本局正在搜索中的 AI 任务，没有则返回 None。"""
+    job_id = g.get('ai_job')
+    if not job_id:
+        return None
+    job = get_pool().get(job_id)
+    if job is None or job.status != PENDING:
+        return None
+    return job
+
+
+def _predicted_reply(g: dict, stats: Optional[dict]):
+    """AI 走完后对方最可能的应着：搜索主变例的第二步；没有主变例（库着法、缓存命中）时取残局库或开局库的着法。"""
+    pv = (stats or {}).get('pv') or []
+    if len(pv) > 1:
+        return move_from_iccs(pv[1])
+    known = get_tablebases().best_move(g['board'], g['turn'])
+    if known is not None:
+        return known[0]
+    book = get_book()
+    return book.choose(g['board'], g['turn']) if book is not None else None
+
+
+def _start_ponder(game_id: str, g: dict, stats: Optional[dict]):
+    """对方思考时在后台预搜索其最可能应着之后的局面；预搜索只是加速，任何失败都忽略。"""
+    reply = _predicted_reply(g, stats)
+    if reply is None:
+        return
+    try:
+        get_pool().ponder(game_id, g['board'], reply, _ai_color(g), g['difficulty'], AI_TIME_BUDGET_MS)
+    except Exception:
+        pass
+
+
+def _start_ai_job(game_id: str, g: dict):
+    """
+    步骤1：把当前局面交给搜索池并把任务 id 写回会话。
+    步骤2：搜索完成后在回调线程里重新取出对局，执行 AI 着法、写回并生成响应；未终局则开始预搜索对方的应着。
+    步骤3：搜索进度与最终结果同时推送到本局的事件流（ai_progress / ai_move / ai_error）。
+    """
+    expected_ply = g['moves_count']
+
+    def on_done(job):
+        with games_lock:
+            cur = games.get(game_id)
+            if cur is None or cur['moves_count'] != expected_ply:
+                raise RuntimeError('game changed during search')
+            if not job.move:
+                raise RuntimeError('no move')
+            winner = _play_move(cur, job.move)
+            games.put(game_id, cur)
+            if not winner:
+                _start_ponder(game_id, cur, job.stats)
+            return _state_response(cur, job.move, winner)
+
+    def on_progress(job, progress):
+        hub.publish(game_id, 'ai_progress', dict(progress, job_id=job.id))
+
+    def on_finished(job):
+        if job.status == DONE:
+            compact = _compact_result(job)
+            hub.publish(game_id, 'ai_move', dict(job.result, job_id=job.id),
+                        compact=dict(compact, job_id=job.id) if compact is not None else None)
+        else:
+            hub.publish(game_id, 'ai_error', {'job_id': job.id, 'status': job.status, 'error': job.error})
+
+    job = get_pool().submit(game_id, g['board'], _ai_color(g), g['difficulty'], AI_TIME_BUDGET_MS, on_done,
+                            moves=_side_state(g)['moves'], on_progress=on_progress)
+    if job.status == PENDING:
+        g['ai_job'] = job.id
+        games.put(game_id, g)
+        hub.publish(game_id, 'ai_thinking', {'job_id': job.id, 'moves_count': expected_ply})
+    job.add_finished_callback(on_finished)
+    return job
+
+
+def _busy_response():
+    resp = jsonify({'error': 'ai busy, retry later'})
+    resp.status_code = 429
+    resp.headers['Retry-After'] = '1'
+    return resp
+
+
+def _after_job(job, respond, timeout: Optional[float] = None):
+    """
+    任务结束（或等满 timeout 秒）后返回 respond() 生成的响应。
+    同步部署在当前线程里等；异步服务把 job 与 respond 交给事件循环，结束后在请求上下文中调用 respond，不占线程。
+    """
+    server = request.environ.get(ASYNC_ENVIRON_KEY)
+    if server is not None and job.status == PENDING:
+        return server.wait(job, respond, timeout)
+    job.wait(timeout)
+    return respond()
+
+
+def _wait_for_ai(job, debug: bool = False, compact: bool = False, since: Optional[int] = None):
+    """同步接口：等待搜索任务结束并返回其结果（紧凑格式为 since 之后的增量）；debug 时附带搜索统计。"""
+    return _after_job(job, lambda: _ai_result_response(job, debug, compact, since))
+
+
+def _ai_result_response(job, debug: bool, compact: bool, since: Optional[int]):
+    if job.status == DONE:
+        out = (_compact_result(job, since) if compact else None) or dict(job.result)
+        if debug:
+            out['debug'] = job.to_json(debug=True).get('debug')
+        return _negotiated(out, compact and 'v' in out)
+    if job.status == CANCELLED:
+        return jsonify({'error': 'ai search cancelled'}), 409
+    return jsonify({'error': job.error or 'no move'}), 400
+
+
+@app.route('/api/game/<game_id>/ai_move', methods=['POST'])
+def api_ai_move(game_id):
+    """步骤1：若当前轮为 AI，则提交搜索并等待结果。步骤2：返回新棋盘与胜负（debug 时附带搜索统计）。"""
+    data = request.get_json(silent=True)
+    with games_lock:
+        g = _load_game(game_id)
+        if not g:
+            return jsonify({'error': 'game not found'}), 404
+        if g['turn'] != _ai_color(g):
+            return jsonify({'error': 'not ai turn'}), 400
+        job = _pending_ai_job(g)
+        if job is None:
+            try:
+                job = _start_ai_job(game_id, g)
+            except PoolBusy:
+                return _busy_response()
+        since = _since(data)
+        if since is None:
+            since = g['moves_count']
+    return _wait_for_ai(job, _debug_requested(data), _wants_compact(), since)
+
+
+@app.route('/api/game/<game_id>/ai_job', methods=['POST'])
+def api_start_ai_job(game_id):
+    """异步接口：提交 AI 搜索任务并立即返回任务 id，之后用 GET 轮询结果。"""
+    with games_lock:
+        g = _load_game(game_id)
+        if not g:
+            return jsonify({'error': 'game not found'}), 404
+        if g['turn'] != _ai_color(g):
+            return jsonify({'error': 'not ai turn'}), 400
+        job = _pending_ai_job(g)
+        if job is None:
+            try:
+                job = _start_ai_job(game_id, g)
+            except PoolBusy:
+                return _busy_response()
+    compact = _wants_compact()
+    return _negotiated(_job_json(job, compact, _since()), compact, 202)
+
+
+@app.route('/api/game/<game_id>/ai_job/<job_id>', methods=['GET', 'DELETE'])
+def api_ai_job(game_id, job_id):
+    """
+    GET：查询任务，?wait=毫秒 时最多等待这么久再返回（长轮询），?debug=1 附带搜索统计；
+    紧凑格式下完成的结果为 ?since= 之后（默认 AI 这一步）的增量。DELETE：取消任务。
+    """
+    job = get_pool().get(job_id)
+    if job is None or job.game_id != game_id:
+        if games.shared and job is None:
+            g = games.get(game_id)
+            if g is not None and g.get('ai_job') == job_id and g['turn'] == _ai_color(g):
+                # 仍轮到 AI 且任务在另一个服务进程里：共享会话后端需要按对局 id 粘性路由
+                return jsonify({'error': 'job is owned by another server process; '
+                                         'route all requests of a game to the same process'}), 409
+        return jsonify({'error': 'job not found'}), 404
+    request_state.difficulty = job.difficulty
+    if request.method == 'DELETE':
+        get_pool().cancel(job_id)
+        return jsonify(job.to_json())
+    wait_ms = min(max(request.args.get('wait', 0, type=int), 0), MAX_POLL_WAIT_MS)
+    compact, since, debug = _wants_compact(), _since(), _debug_requested()
+
+    def respond():
+        return _negotiated(_job_json(job, compact, since, debug), compact)
+
+    if wait_ms:
+        return _after_job(job, respond, wait_ms / 1000.0)
+    return respond()
+
+
+@app.route('/api/game/<game_id>/events', methods=['GET'])
+def api_game_events(game_id):
+    """
+    Server-Sent Events 事件流：连接后先发一条 state（当前棋盘与进行中的 AI 任务），之后推送
+    ai_thinking、ai_progress（完成深度、当前最佳着法）、ai_move（与 /ai_move 相同的响应）与 ai_error。
+    客户端据 moves_count 丢弃过期事件；断线重连时重新收到 state 即可对齐。
+    ?format=compact（EventSource 不能设置 Accept）时 state 与 ai_move 用紧凑线格式：
+    state 为 ?since= 之后的增量或全量，ai_move 为 AI 这一步的增量。
+    """
+    compact = request.args.get('format') == 'compact'
+    with games_lock:
+        g = _load_game(game_id)
+        if not g:
+            return jsonify({'error': 'game not found'}), 404
+        # 先订阅再取快照：快照之后发生的事件都不会漏掉
+        sub = hub.subscribe(game_id, compact)
+        snapshot = _compact_state(g, _since()) if compact else _state_response(g)
+        job = _pending_ai_job(g)
+        if job is not None:
+            snapshot['ai_job'] = job.to_json()
+
+    def stream():
+        try:
+            yield format_event('state', snapshot)
+            while True:
+                item = sub.get()
+                # 无事件时发送注释行作为心跳，连接已断开时写入会失败并结束生成器
+                yield item if item is not None else ': keepalive\n\n'
+        finally:
+            hub.unsubscribe(sub)
+
+    server = request.environ.get(ASYNC_ENVIRON_KEY)
+    # 异步服务由事件循环从订阅中取事件（同样发心跳、断开时退订），连接等待期间不占线程
+    body = server.stream(sub, format_event('state', snapshot)) if server is not None else stream()
+    resp = Response(body, mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
+
+
+@app.route('/api/game/<game_id>/legal_moves', methods=['GET'])
+def api_legal_moves(game_id):
+    """当前走棋方的全部合法着法与将军状态，供前端高亮可走位置；直接取自对局缓存。"""
+    with games_lock:
+        g = _load_game(game_id)
+        if not g:
+            return jsonify({'error': 'game not found'}), 404
+        cached = g.get('legal')
+        state = _side_state(g)
+        if state is not cached:
+            games.put(game_id, g)
         return jsonify({
-            'board': board_to_json_serializable(board),
             'turn': g['turn'],
-            'ai_move': {'from': list(from_a), 'to': list(to_a)},
-            'winner': winner,
-            'game_over': True,
+            'ply': state['ply'],
+            'in_check': state['in_check'],
+            'key': '%016x' % state['key'],
+            'moves': [move_to_json(m) for m in state['moves']],
         })
-    return jsonify({
-        'board': board_to_json_serializable(board),
-        'turn': g['turn'],
-        'ai_move': {'from': list(from_a), 'to': list(to_a)},
-    })
 
 
 @app.route('/api/game/<game_id>/move', methods=['POST'])
 def api_move(game_id):
-    """步骤1：解析 from/to。步骤2：校验轮次与合法性。步骤3：执行走子并更新胜负。步骤4：若轮到 AI 则计算并执行 AI 着法。"""
-    g = games.get(game_id)
-    if not g:
-        return jsonify({'error': 'game not found'}), 404
+    """
+    步骤1：解析 from/to。步骤2：校验轮次与合法性。步骤3：执行走子并更新胜负。
+    步骤4：若轮到 AI 则提交搜索；请求带 async_ai 时立即返回任务 id，否则等待 AI 着法（debug 时附带搜索统计）。
+    搜索池已满时这步棋已经走了，返回 202、新局面与 ai_pending（不带任务），客户端稍后调 /ai_job 补提交。
+    对方思考期间的预搜索猜中这步时，AI 着法直接取自预搜索结果或接着等那次搜索（debug 中 ponder 为 hit/continued）。
+    """
     data = request.get_json() or {}
-    from_pos = tuple(data.get('from', []))
-    to_pos = tuple(data.get('to', []))
-    if len(from_pos) != 2 or len(to_pos) != 2:
+    move = move_from_json(data.get('from'), data.get('to'))
+    if move is None:
         return jsonify({'error': 'invalid from/to'}), 400
-    board = g['board']
-    turn = g['turn']
-    moves = all_legal_moves(board, turn)
-    if (from_pos, to_pos) not in moves:
-        return jsonify({'error': 'illegal move'}), 400
-    board = make_move(board, from_pos, to_pos)
-    g['board'] = board
-    g['moves_count'] += 1
-    g['board_history'].append(board_to_json_serializable(board))
-    g['turn'] = BLACK if turn == RED else RED
-    result = is_checkmate_or_stalemate(board, g['turn'])
-    winner = None
-    if result == 'checkmate':
-        winner = turn
-    elif result == 'stalemate':
-        winner = 'draw'
-    if winner:
-        add_record(
-            winner=winner,
-            difficulty=g['difficulty'],
-            moves_count=g['moves_count'],
-            board_snapshots=g['board_history'],
-            red_is_ai=g['red_is_ai'],
-        )
-        return jsonify({
-            'board': board_to_json_serializable(board),
-            'turn': g['turn'],
-            'winner': winner,
-            'game_over': True,
-        })
-    # 若轮到 AI，计算并执行 AI 着法
-    ai_color = RED if g['red_is_ai'] else BLACK
-    if g['turn'] == ai_color:
-        ai_move = ai_choose_move(board, ai_color, g['difficulty'])
-        if ai_move:
-            from_a, to_a = ai_move
-            board = make_move(board, from_a, to_a)
-            g['board'] = board
-            g['moves_count'] += 1
-            g['board_history'].append(board_to_json_serializable(board))
-            g['turn'] = RED if g['turn'] == BLACK else BLACK
-            result = is_checkmate_or_stalemate(board, g['turn'])
-            winner = None
-            if result == 'checkmate':
-                winner = ai_color
-            elif result == 'stalemate':
-                winner = 'draw'
-            if winner:
-                add_record(
-                    winner=winner,
-                    difficulty=g['difficulty'],
-                    moves_count=g['moves_count'],
-                    board_snapshots=g['board_history'],
-                    red_is_ai=g['red_is_ai'],
-                )
-                return jsonify({
-                    'board': board_to_json_serializable(board),
-                    'turn': g['turn'],
-                    'ai_move': {'from': list(from_a), 'to': list(to_a)},
-                    'winner': winner,
-                    'game_over': True,
-                })
-            return jsonify({
-                'board': board_to_json_serializable(board),
-                'turn': g['turn'],
-                'ai_move': {'from': list(from_a), 'to': list(to_a)},
-            })
-    return jsonify({
-        'board': board_to_json_serializable(board),
-        'turn': g['turn'],
-    })
+    compact = _wants_compact()
+    with games_lock:
+        g = _load_game(game_id)
+        if not g:
+            return jsonify({'error': 'game not found'}), 404
+        if _pending_ai_job(g) is not None:
+            return jsonify({'error': 'ai is thinking'}), 409
+        if move not in _side_state(g)['moves']:
+            return jsonify({'error': 'illegal move'}), 400
+        # 紧凑格式默认从走这步之前的局面起发增量
+        since = _since(data)
+        if since is None:
+            since = g['moves_count']
+        winner = _play_move(g, move)
+        games.put(game_id, g)
+        if winner or g['turn'] != _ai_color(g):
+            get_pool().cancel_ponder(game_id)
+            return _negotiated(_compact_state(g, since, winner) if compact else _state_response(g, winner=winner),
+                               compact)
+        # 轮到 AI：交给搜索池
+        try:
+            job = _start_ai_job(game_id, g)
+        except PoolBusy:
+            out = _compact_state(g, since) if compact else _state_response(g)
+            out['ai_pending'] = True
+            resp = _negotiated(out, compact, 202)
+            resp.headers['Retry-After'] = '1'
+            return resp
+        if data.get('async_ai'):
+            out = _compact_state(g, since) if compact else _state_response(g)
+            out['ai_job'] = _job_json(job, compact)
+            return _negotiated(out, compact, 202)
+    return _wait_for_ai(job, _debug_requested(data), compact, since)
+
+
+@app.route('/api/metrics', methods=['GET'])
+def api_metrics():
+    """Prometheus 文本格式的进程内指标：请求时延、AI 搜索统计、会话与任务数。"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/api/history', methods=['GET'])
 def api_history():
+    """?limit= 每页条数，?before= 上一页最后一条的 created_at（翻页游标）。"""
     limit = request.args.get('limit', 50, type=int)
-    return jsonify({'records': list_records(limit=limit)})
+    records = list_records(limit=limit, before=request.args.get('before'))
+    out = {'records': records}
+    if records and len(records) == limit:
+        out['next_before'] = records[-1]['created_at']
+    return jsonify(out)
 
 
 @app.route('/api/history/<record_id>', methods=['GET'])
 def api_history_detail(record_id):
+    """
+    不带参数：返回记录摘要、起始局面与 ICCS 着法列表。
+    ?ply=k：另返回第 k 步走完后的棋盘（0 为起始局面，负数从末尾倒数，-1 为终局）。
+    """
     r = get_record(record_id)
     if not r:
         return jsonify({'error': 'not found'}), 404
-    return jsonify(r)
+    out = {k: v for k, v in r.items() if k not in ('start', 'moves')}
+    out['start_board'] = board_to_json_serializable(r['start'])
+    out['moves'] = [move_to_iccs(m) for m in r['moves']]
+    ply = request.args.get('ply', type=int)
+    if ply is not None:
+        total = len(r['moves'])
+        if ply < 0:
+            ply += total + 1
+        if not 0 <= ply <= total:
+            return jsonify({'error': 'ply out of range'}), 400
+        out['ply'] = ply
+        out['board'] = board_to_json_serializable(get_replay(record_id).board_at(ply))
+    return jsonify(out)
 
 
 if __name__ == '__main__':
+    # debug 模式下重载器的父进程不处理请求，只在实际服务的子进程里拉起搜索进程
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        get_pool().warm_up()
     app.run(host='0.0.0.0', port=5000, debug=True)
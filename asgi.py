@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+"""异步服务：ASGI 入口，连接多、等待长（同步等 AI 着法、长轮询、事件流）时代替 gunicorn 的同步 worker。
+
+路由与处理逻辑仍是 app.py 的 Flask 应用：每个请求在线程池里走一遍 WSGI，会话与历史记录的读写都在线程池中，
+不阻塞事件循环；视图要等 AI 任务或事件流时经 environ 钩子（app.ASYNC_ENVIRON_KEY）把等待交回事件循环，
+搜索本身在 search_pool 的进程池中进行。等待中的连接只是一个协程，一个进程可以挂住成千上万个连接。
+
+部署：uvicorn asgi:app --port 8000        （或其他 ASGI 服务器）
+      python asgi.py --port 8000          （内置的 HTTP/1.1 服务，只用标准库，本地试用与压测用）
+对局事件与搜索任务都在进程内，多进程部署时的限制与同步部署相同（见 app.py）。
+"""
+
+import argparse
+import asyncio
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from http.client import responses
+from typing import List, Tuple
+from urllib.parse import unquote
+
+from flask import Response
+from flask import g as request_state
+
+import app as app_module
+from game_events import hub, HEARTBEAT_SECONDS
+
+# 执行 WSGI 请求的线程数：只承担短请求（校验、走子、读写会话与历史），等待不占线程
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', '32'))
+
+_executor = ThreadPoolExecutor(ASGI_THREADS, thread_name_prefix='asgi')
+
+
+class AsyncHook:
+    """
+    放进 environ 的钩子（见 app._after_job、app.api_game_events）。
+    视图调用 wait/stream 时只记下要等的任务或订阅并返回占位响应，由事件循环接着等待，结束后再生成真正的响应。
+    """
+
+    def __init__(self):
+        self.job = None
+        self.respond = None
+        self.timeout = None
+        self.sub = None
+        self.first = ''
+        self.started = None
+        self.difficulty = ''
+
+    @property
+    def deferred(self) -> bool:
+        return self.job is not None
+
+    def wait(self, job, respond, timeout=None):
+        self.job, self.respond, self.timeout = job, respond, timeout
+        self.started = getattr(request_state, 'started', None)
+        self.difficulty = getattr(request_state, 'difficulty', '')
+        return Response(status=202)
+
+    def stream(self, sub, first: str):
+        self.sub, self.first = sub, first
+        # 迭代器而非序列：werkzeug 不会据此补上 Content-Length: 0
+        return iter(())
+
+
+def _environ(scope: dict, body: bytes, hook: AsyncHook) -> dict:
+    """ASGI scope 转为 WSGI environ（PEP 3333：字符串一律按 latin-1 承载字节）。"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'REMOTE_ADDR': client[0],
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+        app_module.ASYNC_ENVIRON_KEY: hook,
+    }
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_LENGTH':
+            continue
+        key = name if name == 'CONTENT_TYPE' else 'HTTP_' + name
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+def _run_wsgi(wsgi_app, environ: dict) -> Tuple[int, List[Tuple[bytes, bytes]], bytes]:
+    """在线程池中调用 WSGI 应用，返回 (状态码, 头, 完整响应体)。"""
+    started = []
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [int(status.split(' ', 1)[0]),
+                      [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]]
+
+    result = wsgi_app(environ, start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return started[0], started[1], body
+
+
+def _finish(environ: dict, hook: AsyncHook) -> Tuple[int, List[Tuple[bytes, bytes]], bytes]:
+    """任务结束后在请求上下文中生成真正的响应，照常经过 after_request（CORS、时延指标从请求开始算起）。"""
+    flask_app = app_module.app
+    with flask_app.request_context(environ):
+        request_state.started = hook.started
+        request_state.difficulty = hook.difficulty
+        respond, hook.job = hook.respond, None
+        response = flask_app.process_response(flask_app.make_response(respond()))
+        return _run_wsgi(response, environ)
+
+
+async def _wait_job(job, timeout):
+    """不占线程地等待搜索任务结束，最多 timeout 秒（None 为一直等）。"""
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+
+    def set_done():
+        if not done.done():
+            done.set_result(None)
+
+    job.add_finished_callback(lambda _job: loop.call_soon_threadsafe(set_done))
+    try:
+        await asyncio.wait_for(done, timeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def _wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def _stream_events(sub, first: str, receive, send):
+    """
+    事件流：先发 state，之后每有事件由发布线程经 sub.waker 唤醒事件循环再发出，
+    HEARTBEAT_SECONDS 内没有事件时发心跳注释，客户端断开时返回（退订由 app 负责）。
+    """
+    loop = asyncio.get_running_loop()
+    wake = asyncio.Event()
+
+    def waker():
+        try:
+            loop.call_soon_threadsafe(wake.set)
+        except RuntimeError:  # 事件循环已关闭
+            pass
+
+    sub.waker = waker
+    disconnect = asyncio.ensure_future(_wait_disconnect(receive))
+    try:
+        await send({'type': 'http.response.body', 'body': first.encode('utf-8'), 'more_body': True})
+        while True:
+            wake.clear()
+            item = sub.get(None)
+            if item is None:
+                waiter = asyncio.ensure_future(wake.wait())
+                done, _ = await asyncio.wait((waiter, disconnect), timeout=HEARTBEAT_SECONDS,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                waiter.cancel()
+                if disconnect in done:
+                    break
+                if waiter in done:
+                    continue
+                item = ': keepalive\n\n'
+            await send({'type': 'http.response.body', 'body': item.encode('utf-8'), 'more_body': True})
+    finally:
+        sub.waker = None
+        disconnect.cancel()
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await asyncio.get_running_loop().run_in_executor(None, app_module.get_pool().warm_up)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """
+    ASGI 3 入口。
+    步骤1：读完请求体，连同钩子转成 WSGI environ，在线程池里交给 Flask 应用处理。
+    步骤2：视图交回了要等的任务时在事件循环里等它结束，再到线程池生成真正的响应。
+    步骤3：事件流在发出响应头后由 _stream_events 持续推送，其余响应一次发出。
+    视图订阅了事件但最终没有推流（非 200、出错或客户端提前断开）时，也在 finally 里退订。
+    """
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    loop = asyncio.get_running_loop()
+    hook = AsyncHook()
+    environ = _environ(scope, body, hook)
+    try:
+        status, headers, content = await loop.run_in_executor(_executor, _run_wsgi, app_module.app.wsgi_app, environ)
+        if hook.job is not None:
+            await _wait_job(hook.job, hook.timeout)
+            status, headers, content = await loop.run_in_executor(_executor, _finish, environ, hook)
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        if hook.sub is not None and status == 200:
+            await _stream_events(hook.sub, hook.first, receive, send)
+        else:
+            await send({'type': 'http.response.body', 'body': content})
+    finally:
+        if hook.sub is not None:
+            hub.unsubscribe(hook.sub)
+
+
+# ---------- 内置 HTTP/1.1 服务 ----------
+
+async def _handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """
+    一个连接上依次处理请求（支持 keep-alive）。请求体只支持 Content-Length；
+    没有 Content-Length 的流式响应（事件流）用分块传输编码发出。
+    """
+    peer = writer.get_extra_info('peername') or ('', 0)
+    sock = writer.get_extra_info('sockname') or ('', 0)
+    try:
+        while True:
+            head = await reader.readuntil(b'\r\n\r\n')
+            lines = head.decode('latin-1').split('\r\n')
+            method, target, version = lines[0].split(' ', 2)
+            headers = []
+            for line in lines[1:]:
+                if line:
+                    name, _, value = line.partition(':')
+                    headers.append((name.strip().lower().encode('latin-1'), value.strip().encode('latin-1')))
+            fields = dict(headers)
+            body = await reader.readexactly(int(fields.get(b'content-length', b'0')))
+            keep_alive = version == 'HTTP/1.1' and fields.get(b'connection', b'').lower() != b'close'
+            path, _, query = target.partition('?')
+            scope = {
+                'type': 'http',
+                'asgi': {'version': '3.0'},
+                'http_version': version[5:],
+                'method': method,
+                'scheme': 'http',
+                'path': unquote(path),
+                'raw_path': path.encode('latin-1'),
+                'query_string': query.encode('latin-1'),
+                'root_path': '',
+                'headers': headers,
+                'client': peer[:2],
+                'server': sock[:2],
+            }
+            state = {'received': False, 'started': False, 'chunked': False}
+
+            async def receive():
+                if not state['received']:
+                    state['received'] = True
+                    return {'type': 'http.request', 'body': body, 'more_body': False}
+                # 请求体已交出：之后只等连接断开（事件流据此退订）
+                while await reader.read(4096):
+                    pass
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    state['status'], state['headers'] = message['status'], list(message.get('headers', ()))
+                    return
+                chunk, more = message.get('body', b''), message.get('more_body', False)
+                if not state['started']:
+                    state['started'] = True
+                    out = state['headers']
+                    if not any(name.lower() == b'content-length' for name, _ in out):
+                        if more:
+                            state['chunked'] = True
+                            out.append((b'transfer-encoding', b'chunked'))
+                        else:
+                            out.append((b'content-length', str(len(chunk)).encode('latin-1')))
+                    if not keep_alive:
+                        out.append((b'connection', b'close'))
+                    writer.write(('HTTP/1.1 %d %s\r\n' % (state['status'], responses.get(state['status'], '')))
+                                 .encode('latin-1') + b''.join(k + b': ' + v + b'\r\n' for k, v in out) + b'\r\n')
+                if state['chunked']:
+                    if chunk:
+                        writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                    if not more:
+                        writer.write(b'0\r\n\r\n')
+                else:
+                    writer.write(chunk)
+                await writer.drain()
+
+            await app(scope, receive, send)
+            if not keep_alive or state['chunked']:
+                break
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host: str, port: int):
+    await asyncio.get_running_loop().run_in_executor(None, app_module.get_pool().warm_up)
+    server = await asyncio.start_server(_handle_connection, host, port, backlog=4096)
+    print('serving on http://%s:%d' % (host, port), flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='xiangqi async server (built-in HTTP/1.1, ASGI app)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', '8000')))
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
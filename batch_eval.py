@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""批量局面评估：子力与位置分之外加入机动性与将帅安全，NumPy 一次评估一批子局面。
+
+evaluate_rich 是逐格循环的标量参考实现；BatchEvaluator 把局面编码为 int8 数组（红正黑负的兵种编码），
+对整批局面做向量化计算，结果与标量实现逐分一致（python batch_eval.py check 对照）。
+引擎中只有普通难度给全部根着法打分时用它；困难/地狱在静态搜索里逐个节点取站立分，无法成批，仍用增量的 board.score。
+NumPy 为可选依赖：未安装时 get_batch_evaluator() 返回 None，调用方退回标量实现。
+"""
+
+import argparse
+import random
+import time
+from typing import List, Optional
+
+from chess_engine import (
+    Position,
+    Move,
+    GENERATORS,
+    HORSE_STEPS,
+    initial_board,
+    all_legal_moves,
+    make_move,
+    unmake_move,
+    get_score_table,
+    set_score_table,
+    opponent,
+    KING,
+    HORSE,
+    ROOK,
+    CANNON,
+    PAWN,
+    BLACK_FLAG,
+    TYPE_MASK,
+    RED,
+    BLACK,
+)
+
+try:
+    import numpy as np
+except ImportError:  # 可选依赖
+    np = None
+
+# 机动性：每个伪合法着法（含吃子，不考虑被将军）的加分，按兵种编码
+MOBILITY_WEIGHTS = {ROOK: 1, HORSE: 2, CANNON: 1}
+# 将帅安全：对方进攻子力进入本方九宫及宫前一行时的扣分
+KING_ZONE_ATTACKERS = {ROOK: 12, HORSE: 10, CANNON: 8, PAWN: 6}
+# 将帅所在列上没有任何其他棋子（空头）时的扣分
+OPEN_FILE_PENALTY = 8
+
+KING_ZONES = {
+    RED: tuple(r * 9 + c for r in (6, 7, 8, 9) for c in (3, 4, 5)),
+    BLACK: tuple(r * 9 + c for r in (0, 1, 2, 3) for c in (3, 4, 5)),
+}
+
+
+def _king_danger(board: Position, color: str) -> int:
+    cells = board.cells
+    enemy_flag = 0 if color == BLACK else BLACK_FLAG
+    danger = 0
+    for sq in KING_ZONES[color]:
+        p = cells[sq]
+        if p and p & BLACK_FLAG == enemy_flag:
+            danger += KING_ZONE_ATTACKERS.get(p & TYPE_MASK, 0)
+    ksq = board.king_sq[color]
+    if ksq >= 0 and not any(cells[t] for t in range(ksq % 9, 90, 9) if t != ksq):
+        danger += OPEN_FILE_PENALTY
+    return danger
+
+
+def evaluate_rich(board: Position, side: str) -> int:
+    """
+    标量参考实现（side 方视角）。
+    步骤1：子力+位置分直接取增量维护的 board.score。
+    步骤2：车、马、炮按伪合法着法数加机动分（复用走法生成器，定义与走子规则完全一致）。
+    步骤3：减去本方将帅的危险分（宫区内的对方进攻子力、空头），加上对方的。
+    """
+    cells = board.cells
+    score = board.score
+    for sq, p in enumerate(cells):
+        if not p:
+            continue
+        weight = MOBILITY_WEIGHTS.get(p & TYPE_MASK)
+        if weight:
+            flag = p & BLACK_FLAG
+            n = len(GENERATORS[p & TYPE_MASK](board, sq, flag))
+            score += -weight * n if flag else weight * n
+    score += _king_danger(board, BLACK) - _king_danger(board, RED)
+    return score if side == RED else -score
+
+
+# ---------- 向量化实现 ----------
+
+# 棋盘外的哨兵格（编号 90）的取值：既非空也不属于任何一方
+_WALL = 16
+
+
+def _ray_table():
+    """每格四个方向的射线格号，按远近排列，末尾用哨兵格 90 补齐到 10 格。"""
+    rays = []
+    for sq in range(90):
+        r, c = divmod(sq, 9)
+        dirs = (
+            range(sq - 9, -1, -9),
+            range(sq + 9, 90, 9),
+            range(sq - 1, r * 9 - 1, -1),
+            range(sq + 1, r * 9 + 9),
+        )
+        rays.append([list(d) + [90] * (10 - len(d)) for d in dirs])
+    return rays
+
+
+def _horse_table():
+    """每格八个马步的 (马腿格, 落点格)；落点出界时两者都用哨兵格 90。"""
+    legs, targets = [], []
+    for sq in range(90):
+        r, c = divmod(sq, 9)
+        row_legs, row_targets = [], []
+        for dr, dc, leg_dr, leg_dc in HORSE_STEPS:
+            nr, nc = r + dr, c + dc
+            if 0 <= nr < 10 and 0 <= nc < 9:
+                row_legs.append((r + leg_dr) * 9 + c + leg_dc)
+                row_targets.append(nr * 9 + nc)
+            else:
+                row_legs.append(90)
+                row_targets.append(90)
+        legs.append(row_legs)
+        targets.append(row_targets)
+    return legs, targets
+
+
+class BatchEvaluator:
+    """
+    向量化评估器：evaluate 对 (N, 90) 的 int8 局面数组一次算出 N 个分数。
+    步骤1：子力+位置分用 (15, 90) 查表求和（表取自当前安装的增量评估表，表更换后自动重建）。
+    步骤2：车/炮沿预先展开的射线数空格并判断第一个（炮为第二个）阻挡子；马按马腿与落点表判断。
+    步骤3：宫区内的对方进攻子力按兵种查表扣分；取将帅所在列统计其他棋子数判断空头。
+    """
+
+    def __init__(self):
+        self._rays = np.array(_ray_table(), dtype=np.intp)              # (90, 4, 10)
+        legs, targets = _horse_table()
+        self._horse_legs = np.array(legs, dtype=np.intp)                # (90, 8)
+        self._horse_targets = np.array(targets, dtype=np.intp)          # (90, 8)
+        self._squares = np.arange(90)
+        self._positions = np.arange(10)
+        # 单元格字节（含 BLACK_FLAG）-> 红正黑负的兵种编码
+        lut = np.zeros(16, dtype=np.int8)
+        for code in range(1, 8):
+            lut[code] = code
+            lut[code | BLACK_FLAG] = -code
+        self._signed = lut
+        mobility = np.zeros(15, dtype=np.int64)
+        danger_red = np.zeros(15, dtype=np.int64)   # 红方宫区内的黑子
+        danger_black = np.zeros(15, dtype=np.int64)
+        for code, w in MOBILITY_WEIGHTS.items():
+            mobility[code + 7], mobility[-code + 7] = w, -w
+        for code, w in KING_ZONE_ATTACKERS.items():
+            danger_red[-code + 7] = w
+            danger_black[code + 7] = w
+        self._mobility = mobility
+        self._danger_red = danger_red
+        self._danger_black = danger_black
+        self._zone_red = np.array(KING_ZONES[RED], dtype=np.intp)
+        self._zone_black = np.array(KING_ZONES[BLACK], dtype=np.intp)
+        self._table_source = None
+        self._material = None
+
+    def _material_table(self):
+        table = get_score_table()
+        if table is not self._table_source:
+            flat = np.array(table, dtype=np.int64).reshape(16, 90)
+            material = np.zeros((15, 90), dtype=np.int64)
+            for code in range(1, 8):
+                material[code + 7] = flat[code]
+                material[-code + 7] = flat[code | BLACK_FLAG]
+            self._table_source, self._material = table, material
+        return self._material
+
+    def encode(self, board: Position):
+        """单个局面 -> (90,) int8。"""
+        return self._signed[np.frombuffer(bytes(board.cells), dtype=np.uint8)]
+
+    def children(self, board: Position, moves: List[Move]):
+        """board 走 moves 中每一步之后的局面 -> (len(moves), 90)，不必逐个走子/撤销。"""
+        n = len(moves)
+        arr = np.repeat(self.encode(board)[None, :], n, axis=0)
+        idx = np.arange(n)
+        mv = np.array(moves, dtype=np.intp).reshape(n, 2)
+        arr[idx, mv[:, 1]] = arr[idx, mv[:, 0]]
+        arr[idx, mv[:, 0]] = 0
+        return arr
+
+    def evaluate(self, arr, side: str):
+        """(N, 90) int8 局面数组 -> (N,) int64 分数（side 方视角），与 evaluate_rich 一致。"""
+        n = arr.shape[0]
+        codes = arr.astype(np.intp)
+        score = self._material_table()[codes + 7, self._squares].sum(axis=1)
+        ext = np.concatenate([codes, np.full((n, 1), _WALL, dtype=np.intp)], axis=1)
+        kind = np.abs(codes)
+
+        def enemy(targets, black):
+            return (targets != 0) & (targets != _WALL) & ((targets < 0) != black)
+
+        # 车与炮：只取有车、炮的格子，沿射线找第一个阻挡子（射线末尾的哨兵保证一定存在）
+        bi, si = np.nonzero((kind == ROOK) | (kind == CANNON))
+        piece = codes[bi, si]
+        black = (piece < 0)[:, None]
+        along = ext[bi[:, None, None], self._rays[si]]                  # (K, 4, 10)
+        occupied = along != 0
+        first = occupied.argmax(axis=-1)                                # 阻挡子之前的空格数
+        blocker = np.take_along_axis(along, first[..., None], axis=-1)[..., 0]
+        beyond = occupied & (self._positions > first[..., None])
+        second = np.take_along_axis(along, beyond.argmax(axis=-1)[..., None], axis=-1)[..., 0]
+        capture = np.where((np.abs(piece) == ROOK)[:, None], enemy(blocker, black), enemy(second, black))
+        mob = (first + capture).sum(axis=1)
+        score += np.bincount(bi, self._mobility[piece + 7] * mob, minlength=n).astype(np.int64)
+
+        # 马：马腿为空、落点在界内且不是本方棋子
+        bi, si = np.nonzero(kind == HORSE)
+        piece = codes[bi, si]
+        black = (piece < 0)[:, None]
+        legs = ext[bi[:, None], self._horse_legs[si]]                   # (K, 8)
+        targets = ext[bi[:, None], self._horse_targets[si]]
+        mob = ((legs == 0) & (targets != _WALL) & ((targets == 0) | enemy(targets, black))).sum(axis=1)
+        score += np.bincount(bi, self._mobility[piece + 7] * mob, minlength=n).astype(np.int64)
+
+        # 将帅安全
+        score -= self._danger_red[codes[:, self._zone_red] + 7].sum(axis=1)
+        score += self._danger_black[codes[:, self._zone_black] + 7].sum(axis=1)
+        grid = codes.reshape(n, 10, 9)
+        rows = np.arange(n)
+        for king, sign in ((KING, -1), (-KING, 1)):
+            is_king = codes == king
+            column = grid[rows, :, is_king.argmax(axis=1) % 9]
+            open_file = is_king.any(axis=1) & ((column != 0).sum(axis=1) == 1)
+            score += sign * OPEN_FILE_PENALTY * open_file
+        return score if side == RED else -score
+
+    def evaluate_children(self, board: Position, moves: List[Move], side: str) -> List[int]:
+        return self.evaluate(self.children(board, moves), side).tolist()
+
+
+class ScalarEvaluator:
+    """与 BatchEvaluator 接口相同的标量实现：逐个走子、evaluate_rich、撤销。"""
+
+    def evaluate_children(self, board: Position, moves: List[Move], side: str) -> List[int]:
+        values = []
+        for move in moves:
+            undo = make_move(board, move[0], move[1])
+            values.append(evaluate_rich(board, side))
+            unmake_move(board, undo)
+        return values
+
+
+_evaluator = None
+
+
+def get_batch_evaluator() -> Optional[BatchEvaluator]:
+    """进程内共享的批量评估器；未安装 NumPy 时返回 None。"""
+    global _evaluator
+    if np is None:
+        return None
+    if _evaluator is None:
+        _evaluator = BatchEvaluator()
+    return _evaluator
+
+
+def get_child_evaluator():
+    """有 NumPy 时返回批量评估器，否则返回标量实现；两者结果一致。"""
+    return get_batch_evaluator() or ScalarEvaluator()
+
+
+def _random_positions(count: int, seed: int, max_plies: int = 80) -> List[Position]:
+    """随机对局途中的局面，用于对照检查。"""
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        board, side = initial_board(), RED
+        for _ in range(rng.randrange(max_plies)):
+            moves = all_legal_moves(board, side)
+            if not moves:
+                break
+            move = rng.choice(moves)
+            make_move(board, move[0], move[1])
+            side = opponent(side)
+        positions.append((board, side))
+    return positions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='batch evaluator check')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('check', help='与标量实现逐局面对照，并比较给全部根着法打分的耗时')
+    p.add_argument('--positions', type=int, default=300)
+    p.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    from ai_engine import build_score_table
+    set_score_table(build_score_table())  # 默认评估表须在生成局面之前安装
+    batch = get_batch_evaluator()
+    if batch is None:
+        raise SystemExit('numpy is not installed (optional: pip install numpy); '
+                         'the engine falls back to the scalar evaluator without it')
+    scalar = ScalarEvaluator()
+    mismatches = children = 0
+    scalar_s = batch_s = 0.0
+    positions = _random_positions(args.positions, args.seed)
+    for board, side in positions:
+        moves = all_legal_moves(board, side)
+        if not moves:
+            continue
+        start = time.perf_counter()
+        expected = scalar.evaluate_children(board, moves, side)
+        scalar_s += time.perf_counter() - start
+        start = time.perf_counter()
+        got = batch.evaluate_children(board, moves, side)
+        batch_s += time.perf_counter() - start
+        children += len(moves)
+        mismatches += sum(1 for a, b in zip(expected, got) if a != b)
+    print('%d child positions, %d mismatches' % (children, mismatches))
+    print('scalar %.1fus/position, batch %.1fus/position' % (scalar_s / children * 1e6, batch_s / children * 1e6))
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
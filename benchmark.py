@@ -0,0 +1,564 @@
+# -*- coding: utf-8 -*-
+"""性能基准：走法生成（perft）、固定深度搜索、HTTP 走子延迟，以及搜索配置之间的对照。
+
+用法：python benchmark.py suite --json bench.json [--baseline baseline.json]
+      python benchmark.py ordering --depth 4
+      python benchmark.py parallel --depth 5 --workers 1 2 4
+      python benchmark.py selective --depth 5
+      python benchmark.py load --players 50 --idle 1000 --seconds 20
+
+suite 的结果为 JSON；给定 --baseline 时逐项比较耗时，变慢超过 --tolerance 或 perft 计数不符时以非零状态退出。
+suite 的搜索项（search/depth<d>/<局面>）是与难度无关的固定深度搜索，只反映搜索核心的速度；
+各难度用户实际的等待时间看走子接口延迟项（经由应用，按难度的真实配置）。
+load 在本机分别启动同步部署（gunicorn 同步 worker）与异步服务（asgi.py），比较吞吐与尾延迟。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shlex
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from chess_engine import (
+    Position,
+    initial_board,
+    all_legal_moves,
+    make_move,
+    move_from_iccs,
+    opponent,
+    board_from_fen,
+    board_from_json_serializable,
+    move_to_json,
+    move_to_iccs,
+    RED,
+)
+from ai_engine import (
+    SearchContext, SearchBudget, CODE_VALUES, SEARCH_FEATURES, DEFAULT_FEATURES, negamax, iterative_deepening,
+)
+from perft import perft
+from move_ordering import MoveOrderer
+from transposition import TranspositionTable
+from search_pool import SearchPool
+
+# 固定局面集：(名称, 从初始局面起的 ICCS 着法序列)
+POSITION_SUITE = [
+    ('opening', ''),
+    ('central_cannon', 'h2e2 h9g7'),
+    ('screen_horse', 'h2e2 h9g7 h0g2 i9h9 i0h0 b9c7'),
+    ('cannon_exchange', 'h2e2 h7e7 e2e6 e7e3'),
+    ('middlegame', 'h2e2 h9g7 h0g2 i9h9 i0h0 b9c7 b2b6 c6c5 b0c2 b7a7 c3c4 a9b9 a0b0 h7h3 g3g4 h3g3'),
+]
+
+# perft 局面集：(名称, FEN, {深度: 节点数})。节点数由 perft.py 的参考实现逐节点对照得到，
+# 初始局面的结果与公认值一致
+PERFT_SUITE = [
+    ('opening', 'rnbakabnr/9/1c5c1/p1p1p1p1p/9/9/P1P1P1P1P/1C5C1/9/RNBAKABNR w', {1: 44, 2: 1920, 3: 79666}),
+    ('central_cannon', 'rnbakab1r/9/1c4nc1/p1p1p1p1p/9/9/P1P1P1P1P/1C2C4/9/RNBAKABNR w', {1: 35, 2: 1419, 3: 51045}),
+    ('screen_horse', 'r1bakabr1/9/1cn3nc1/p1p1p1p1p/9/9/P1P1P1P1P/1C2C1N2/9/RNBAKABR1 w', {1: 37, 2: 1292, 3: 49161}),
+    ('cannon_exchange', 'rnbakabnr/9/1c7/p1p1C1p1p/9/9/P1P1c1P1P/1C7/9/RNBAKABNR w', {1: 36, 2: 1309, 3: 46367}),
+    ('middlegame', '1rbakabr1/9/c1n3n2/pC2p1p1p/2p6/2P3P2/P3P1c1P/2N1C1N2/9/1RBAKABR1 w', {1: 46, 2: 1771, 3: 77756}),
+    ('rook_endgame', '3ak4/4a4/4b4/9/9/9/9/4B4/4A4/3AKR3 w', {3: 2317, 4: 13463, 5: 261658}),
+    ('cannon_horse_endgame', '4k4/4a4/3a5/9/2n6/9/9/4C4/4N4/4K4 b', {3: 1198, 4: 24602, 5: 244470}),
+    ('pawns_endgame', '3k5/9/9/4P4/2P6/9/6p2/9/9/5K3 w', {3: 320, 4: 1602, 5: 12168}),
+]
+
+# 固定深度搜索基准的各档深度。只测搜索核心的速度，与难度无关：没有时间预算、开局库与残局库、
+# 普通难度的批量根着法打分、地狱的根节点拆分与选择性搜索技术，不代表各难度实际的思考耗时
+SEARCH_BENCH_DEPTHS = [1, 3, 5]
+
+# 与基线比较时忽略耗时不足此值（秒）的项，计时噪声会淹没它们
+MIN_COMPARE_SECONDS = 0.05
+
+# 压测的服务启动命令，{port} 替换为端口：sync 与 Procfile 相同（gunicorn 默认单个同步 worker），
+# async 为内置 HTTP 服务上的 ASGI 应用（装了 uvicorn 时可用 --async-cmd "uvicorn asgi:app --port {port}"）
+LOAD_SERVERS = {
+    'sync': 'gunicorn app:app --bind 127.0.0.1:{port}',
+    'async': shlex.quote(sys.executable) + ' asgi.py --port {port}',
+}
+# 压测中单个请求的超时（秒）；超时记为错误
+LOAD_REQUEST_TIMEOUT = 10.0
+
+# 着法排序对照：scan = 棋盘扫描顺序的单次 alpha-beta；tt = 迭代加深 + 置换表着法优先；
+# ordered = 再加上 MVV-LVA、杀手着法与历史表
+ORDERING_MODES = ('scan', 'tt', 'ordered')
+
+
+def load_position(iccs_moves: str) -> Tuple[Position, str]:
+    """从初始局面依次走 ICCS 着法，返回棋盘与走棋方；遇到非法着法抛出 ValueError。"""
+    board = initial_board()
+    side = RED
+    for text in iccs_moves.split():
+        move = move_from_iccs(text)
+        if move not in all_legal_moves(board, side):
+            raise ValueError('illegal move in suite: %s' % text)
+        make_move(board, move[0], move[1])
+        side = opponent(side)
+    return board, side
+
+
+def search_nodes(board: Position, side: str, depth: int, mode: str) -> Tuple[int, float]:
+    """按指定排序方式搜索到固定深度，返回访问节点数与耗时（秒）。"""
+    budget = SearchBudget()
+    start = time.perf_counter()
+    if mode == 'scan':
+        negamax(board, depth, side, -1e9, 1e9, SearchContext(budget=budget))
+    else:
+        orderer = MoveOrderer(CODE_VALUES) if mode == 'ordered' else None
+        ctx = SearchContext(tt=TranspositionTable(), budget=budget, orderer=orderer)
+        iterative_deepening(board, side, depth, ctx)
+    return budget.nodes, time.perf_counter() - start
+
+
+def selective_nodes(board: Position, side: str, depth: int, features) -> Tuple[int, float, Optional[tuple]]:
+    """完整配置（迭代加深 + 置换表 + 着法排序 + 静态搜索）加上 features 搜到固定深度，返回节点数、耗时与最佳着法。"""
+    budget = SearchBudget()
+    ctx = SearchContext(tt=TranspositionTable(), budget=budget, orderer=MoveOrderer(CODE_VALUES), features=features)
+    start = time.perf_counter()
+    move, _ = iterative_deepening(board, side, depth, ctx)
+    return budget.nodes, time.perf_counter() - start, move
+
+
+def selective_report(depth: int) -> List[dict]:
+    """
+    选择性搜索技术各自的节点节省：none 为全宽 alpha-beta，其后每列只开一项，all 为全部开启。
+    步骤1：对局面集中每个局面按各配置搜到固定深度。步骤2：打印节点数，* 标出最佳着法与 none 不同的配置
+    （对棋力的影响需用 selfplay.py --a-features 对弈测量）。
+    """
+    configs = [('none', ())] + [(f, (f,)) for f in SEARCH_FEATURES] + [('all', SEARCH_FEATURES)]
+    rows = []
+    totals = {name: [0, 0.0] for name, _ in configs}
+    print('%-16s' % 'position' + ''.join('%12s' % name for name, _ in configs))
+    for name, moves in POSITION_SUITE:
+        board, side = load_position(moves)
+        row = {'position': name}
+        for config, features in configs:
+            nodes, seconds, move = selective_nodes(board, side, depth, features)
+            row[config] = {'nodes': nodes, 'seconds': round(seconds, 3), 'move': move_to_iccs(move) if move else None}
+            totals[config][0] += nodes
+            totals[config][1] += seconds
+        rows.append(row)
+        print('%-16s' % name + ''.join(
+            '%11d%s' % (row[c]['nodes'], '*' if row[c]['move'] != row['none']['move'] else ' ') for c, _ in configs))
+    print('%-16s' % 'total' + ''.join('%11d ' % totals[c][0] for c, _ in configs))
+    print('%-16s' % 'seconds' + ''.join('%11.2fs' % totals[c][1] for c, _ in configs))
+    print('%-16s' % 'saved' + ''.join(
+        '%10.1f%% ' % (100.0 * (1 - totals[c][0] / totals['none'][0])) for c, _ in configs))
+    return rows
+
+
+def ordering_report(depth: int) -> List[dict]:
+    """步骤1：对局面集中每个局面分别用三种排序方式搜索。步骤2：打印节点数与相对 scan 的节省比例。"""
+    rows = []
+    totals = {mode: 0 for mode in ORDERING_MODES}
+    print('%-16s' % 'position' + ''.join('%16s' % m for m in ORDERING_MODES) + '%10s' % 'saved')
+    for name, moves in POSITION_SUITE:
+        board, side = load_position(moves)
+        row = {'position': name}
+        for mode in ORDERING_MODES:
+            nodes, seconds = search_nodes(board, side, depth, mode)
+            row[mode] = {'nodes': nodes, 'seconds': round(seconds, 3)}
+            totals[mode] += nodes
+        rows.append(row)
+        print('%-16s' % name + ''.join('%16d' % row[m]['nodes'] for m in ORDERING_MODES)
+              + '%9.1f%%' % (100.0 * (1 - row['ordered']['nodes'] / row['scan']['nodes'])))
+    print('%-16s' % 'total' + ''.join('%16d' % totals[m] for m in ORDERING_MODES)
+          + '%9.1f%%' % (100.0 * (1 - totals['ordered'] / totals['scan'])))
+    return rows
+
+
+def perft_bench() -> List[dict]:
+    """步骤1：对 PERFT_SUITE 每个局面跑各深度 perft。步骤2：记录节点数、耗时与 nodes/s，并与期望计数比对。"""
+    rows = []
+    for name, fen, expected in PERFT_SUITE:
+        board, side = board_from_fen(fen)
+        for depth, count in sorted(expected.items()):
+            start = time.perf_counter()
+            nodes = perft(board, side, depth)
+            seconds = time.perf_counter() - start
+            rows.append({
+                'name': 'perft/%s/%d' % (name, depth),
+                'nodes': nodes,
+                'expected': count,
+                'ok': nodes == count,
+                'seconds': round(seconds, 4),
+                'nps': round(nodes / seconds) if seconds else None,
+            })
+            print('%-36s %9d %8.3fs %10.0f n/s  %s' % (
+                rows[-1]['name'], nodes, seconds, nodes / seconds if seconds else 0,
+                'ok' if nodes == count else 'MISMATCH (expected %d)' % count))
+    return rows
+
+
+def search_bench(depths: Optional[List[int]] = None) -> List[dict]:
+    """
+    在 POSITION_SUITE 上按 SEARCH_BENCH_DEPTHS 各档做固定深度搜索（迭代加深 + 置换表 + 着法排序 + 静态搜索，不限时），
+    衡量搜索核心的速度；各难度的实际配置见 SEARCH_BENCH_DEPTHS 的说明，这里不测。
+    """
+    rows = []
+    for depth in depths or SEARCH_BENCH_DEPTHS:
+        for name, moves in POSITION_SUITE:
+            board, side = load_position(moves)
+            nodes, seconds = search_nodes(board, side, depth, 'ordered')
+            rows.append({
+                'name': 'search/depth%d/%s' % (depth, name),
+                'depth': depth,
+                'nodes': nodes,
+                'seconds': round(seconds, 4),
+                'nps': round(nodes / seconds) if seconds else None,
+            })
+            print('%-36s d%-2d %9d %8.3fs %10.0f n/s' % (
+                rows[-1]['name'], depth, nodes, seconds, nodes / seconds if seconds else 0))
+    return rows
+
+
+def api_bench(moves: int = 20, difficulty: str = 'normal') -> List[dict]:
+    """
+    通过 Flask 测试客户端测量 POST /api/game/<id>/move 的端到端延迟（含 AI 应答）。
+    步骤1：先走一步预热搜索进程池。步骤2：人类一方每次走第一个合法着法，终局则新开一局。步骤3：统计分位数。
+    """
+    import app as app_module
+    client = app_module.app.test_client()
+
+    def new_game():
+        return client.post('/api/game/new', json={'difficulty': difficulty}).get_json()['game_id']
+
+    def play(game_id, board_rows):
+        board = board_from_json_serializable(board_rows)
+        move = sorted(all_legal_moves(board, RED))[0]
+        j = move_to_json(move)
+        start = time.perf_counter()
+        resp = client.post('/api/game/%s/move' % game_id, json={'from': j['from'], 'to': j['to']})
+        return time.perf_counter() - start, resp.get_json()
+
+    game_id = new_game()
+    _, state = play(game_id, client.get('/api/game/%s' % game_id).get_json()['board'])
+    samples = []
+    try:
+        while len(samples) < moves:
+            if state.get('game_over') or 'board' not in state:
+                game_id = new_game()
+                state = client.get('/api/game/%s' % game_id).get_json()
+            seconds, state = play(game_id, state['board'])
+            samples.append(seconds)
+    finally:
+        app_module.get_pool().shutdown()
+    samples.sort()
+
+    def pct(q):
+        return round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 2)
+
+    row = {'name': 'api/move/%s' % difficulty, 'requests': len(samples),
+           'p50_ms': pct(0.5), 'p95_ms': pct(0.95), 'max_ms': pct(1.0),
+           'seconds': round(sum(samples), 4)}
+    print('%-36s p50 %.1fms  p95 %.1fms  max %.1fms' % (row['name'], row['p50_ms'], row['p95_ms'], row['max_ms']))
+    return [row]
+
+
+async def _http(port: int, method: str, path: str, payload: Optional[dict] = None) -> Tuple[int, dict]:
+    """新开一个连接发一个请求（同步 worker 不保持连接，两种服务同样对待），返回 (状态码, JSON)。"""
+    body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write(('%s %s HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n'
+                      'Content-Type: application/json\r\nContent-Length: %d\r\n\r\n' % (method, path, len(body)))
+                     .encode('latin-1') + body)
+        raw = await reader.read()
+    finally:
+        writer.close()
+    head, _, data = raw.partition(b'\r\n\r\n')
+    status = int(head.split(b' ', 2)[1])
+    return status, json.loads(data) if data.startswith(b'{') else {}
+
+
+async def _load_player(port: int, difficulty: str, deadline: float, seed: int, samples: List[float], errors: dict):
+    """一个玩家：开局后每次随机走一步并同步等 AI 应着（POST /move），直到 deadline；出错或终局则新开一局。"""
+    rng = random.Random(seed)
+    state = None
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            if state is None or state.get('game_over') or 'board' not in state:
+                status, state = await asyncio.wait_for(
+                    _http(port, 'POST', '/api/game/new', {'difficulty': difficulty}), LOAD_REQUEST_TIMEOUT)
+                game_id = state.get('game_id')
+                if status != 200:
+                    errors[status] = errors.get(status, 0) + 1
+                    state = None
+                continue
+            move = move_to_json(rng.choice(all_legal_moves(board_from_json_serializable(state['board']), RED)))
+            status, out = await asyncio.wait_for(
+                _http(port, 'POST', '/api/game/%s/move' % game_id, move), LOAD_REQUEST_TIMEOUT)
+        except (OSError, ValueError, asyncio.TimeoutError) as e:
+            errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            state = None
+            continue
+        if status == 200:
+            samples.append(time.perf_counter() - start)
+            state = out
+        else:
+            errors[status] = errors.get(status, 0) + 1
+            if status == 429:
+                await asyncio.sleep(0.2)
+            else:
+                state = None
+
+
+async def _idle_stream(port: int, game_id: str, ready: asyncio.Event, stop: asyncio.Event, opened: List[int]):
+    """一个挂住的事件流连接：收到首条 state 事件记为已建立，之后一直挂到 stop。"""
+    writer = None
+    try:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(('GET /api/game/%s/events HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n' % game_id).encode('latin-1'))
+        await reader.readuntil(b'event: state')
+        opened.append(1)
+    except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+        pass
+    finally:
+        ready.set()
+    try:
+        await stop.wait()
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+async def _load_run(port: int, players: int, idle: int, seconds: float, difficulty: str) -> dict:
+    """
+    步骤1：开 idle 个事件流连接并挂住（每个最多等 LOAD_REQUEST_TIMEOUT 秒收到首条事件）。
+    步骤2：players 个玩家并发走子 seconds 秒，统计完成的请求数、吞吐与延迟分位数。
+    """
+    stop = asyncio.Event()
+    opened, streams = [], []
+    if idle:
+        _, game = await _http(port, 'POST', '/api/game/new', {'difficulty': difficulty})
+        for _ in range(idle):
+            ready = asyncio.Event()
+            streams.append((asyncio.ensure_future(_idle_stream(port, game['game_id'], ready, stop, opened)), ready))
+        try:
+            await asyncio.wait_for(asyncio.gather(*(ready.wait() for _, ready in streams)), LOAD_REQUEST_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+    samples, errors = [], {}
+    started = time.perf_counter()
+    await asyncio.gather(*(_load_player(port, difficulty, started + seconds, i, samples, errors)
+                           for i in range(players)))
+    wall = time.perf_counter() - started
+    stop.set()
+    for task, _ in streams:
+        task.cancel()
+    await asyncio.gather(*(task for task, _ in streams), return_exceptions=True)
+    samples.sort()
+
+    def pct(q):
+        return round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 1) if samples else None
+
+    return {'requests': len(samples), 'rps': round(len(samples) / wall, 1), 'p50_ms': pct(0.5),
+            'p95_ms': pct(0.95), 'p99_ms': pct(0.99), 'max_ms': pct(1.0),
+            'errors': {str(k): v for k, v in errors.items()}, 'idle_opened': len(opened), 'idle': idle}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _start_server(cmd: str, port: int) -> subprocess.Popen:
+    """启动服务并等到端口可连接（最多 30 秒）。"""
+    proc = subprocess.Popen(shlex.split(cmd.format(port=port)), cwd=os.path.dirname(os.path.abspath(__file__)),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.5).close()
+            return proc
+        except OSError:
+            if proc.poll() is not None:
+                break
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError('server did not start: %s' % cmd.format(port=port))
+
+
+def load_report(servers: dict, players: int, idle: int, seconds: float, difficulty: str) -> List[dict]:
+    """
+    本机压测：逐个启动服务，先只有 players 个玩家并发走子，再在挂住 idle 个事件流连接的同时重跑一遍；
+    每个请求是一次走子加同步等待 AI 应着，比较吞吐（req/s）与延迟分位数。
+    """
+    rows = []
+    print('%-8s %-10s %8s %8s %9s %9s %9s %9s %10s  %s' % (
+        'server', 'phase', 'requests', 'req/s', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms', 'idle', 'errors'))
+    for name, cmd in servers.items():
+        port = _free_port()
+        proc = _start_server(cmd, port)
+        try:
+            # 预热：第一次走子会启动搜索进程
+            asyncio.run(_load_run(port, 1, 0, 1.0, difficulty))
+            for phase, held in (('busy', 0), ('idle+busy', idle)):
+                if phase == 'idle+busy' and not held:
+                    continue
+                row = dict(asyncio.run(_load_run(port, players, held, seconds, difficulty)), server=name, phase=phase)
+                rows.append(row)
+                print('%-8s %-10s %8d %8.1f %9s %9s %9s %9s %10s  %s' % (
+                    name, phase, row['requests'], row['rps'], row['p50_ms'], row['p95_ms'], row['p99_ms'],
+                    row['max_ms'], '%d/%d' % (row['idle_opened'], held), row['errors'] or ''))
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+    return rows
+
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """逐项比较耗时（seconds，HTTP 项另比 p95_ms），返回变慢超过 tolerance 的描述列表；过短的项不比较。"""
+    old = {row['name']: row for section in baseline.get('sections', {}).values() for row in section}
+    regressions = []
+    for section in results['sections'].values():
+        for row in section:
+            prev = old.get(row['name'])
+            if prev is None:
+                continue
+            for key in ('seconds', 'p95_ms'):
+                if key not in row or not prev.get(key):
+                    continue
+                if key == 'seconds' and prev[key] < MIN_COMPARE_SECONDS:
+                    continue
+                ratio = row[key] / prev[key]
+                flag = ''
+                if ratio > 1 + tolerance:
+                    flag = '  REGRESSION'
+                    regressions.append('%s %s %.3f -> %.3f (x%.2f)' % (row['name'], key, prev[key], row[key], ratio))
+                print('%-36s %-8s %10.3f -> %10.3f  x%.2f%s' % (row['name'], key, prev[key], row[key], ratio, flag))
+    return regressions
+
+
+def run_suite(sections: List[str], search_depths: Optional[List[int]], api_moves: int) -> dict:
+    results = {
+        'created_at': datetime.utcnow().isoformat() + 'Z',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'sections': {},
+    }
+    if 'perft' in sections:
+        results['sections']['perft'] = perft_bench()
+    if 'search' in sections:
+        results['sections']['search'] = search_bench(search_depths)
+    if 'api' in sections:
+        results['sections']['api'] = api_bench(api_moves)
+    return results
+
+
+def _single_process_seconds(board: Position, side: str, depth: int) -> float:
+    """基线：在本进程里用与地狱难度相同的配置（置换表、着法排序、选择性搜索技术）迭代加深到 depth 层。"""
+    ctx = SearchContext(tt=TranspositionTable(), budget=SearchBudget(), orderer=MoveOrderer(CODE_VALUES),
+                        features=DEFAULT_FEATURES)
+    start = time.perf_counter()
+    iterative_deepening(board.copy(), side, depth, ctx)
+    return time.perf_counter() - start
+
+
+def parallel_report(depth: int, worker_counts: List[int]) -> List[dict]:
+    """
+    根节点拆分的加速比：不限时搜索到固定深度，比较不同进程数下的耗时（time-to-depth）。
+    步骤1：每个进程数新建一个搜索池并先预热（进程启动不计时）。
+    步骤2：逐个局面计时，第一列为不经搜索池、单进程普通迭代加深的基线，加速比都相对这一列。
+    """
+    rows = []
+    print('%-16s%12s' % ('position', 'single') + ''.join('%12s' % ('%d proc' % n) for n in worker_counts))
+    totals = {n: 0.0 for n in worker_counts}
+    single_total = 0.0
+    pools = {}
+    try:
+        for n in worker_counts:
+            pools[n] = SearchPool(workers=n)
+            pools[n].warm_up()
+        for name, moves in POSITION_SUITE:
+            board, side = load_position(moves)
+            seconds = _single_process_seconds(board, side, depth)
+            single_total += seconds
+            row = {'position': name, 'single': {'seconds': round(seconds, 3), 'depth': depth}}
+            for n in worker_counts:
+                start = time.perf_counter()
+                # time_ms=0 为不限时（None 会取地狱难度的时间预算）
+                _, reached = pools[n].root_split_search(board, side, 'hell', n, time_ms=0, max_depth=depth)
+                seconds = time.perf_counter() - start
+                row[n] = {'seconds': round(seconds, 3), 'depth': reached}
+                totals[n] += seconds
+            rows.append(row)
+            print('%-16s%11.2fs' % (name, row['single']['seconds'])
+                  + ''.join('%11.2fs' % row[n]['seconds'] for n in worker_counts))
+    finally:
+        for pool in pools.values():
+            pool.shutdown()
+    print('%-16s%11.2fs' % ('total', single_total) + ''.join('%11.2fs' % totals[n] for n in worker_counts))
+    print('%-16s%11.2fx' % ('speedup', 1.0) + ''.join('%11.2fx' % (single_total / totals[n]) for n in worker_counts))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='xiangqi search benchmarks')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('suite', help='perft / 固定深度搜索 / HTTP 延迟基准，输出 JSON')
+    p.add_argument('--sections', nargs='+', default=['perft', 'search', 'api'], choices=['perft', 'search', 'api'])
+    p.add_argument('--json', help='结果写入的文件')
+    p.add_argument('--baseline', help='与之比较的历史结果文件')
+    p.add_argument('--tolerance', type=float, default=0.2, help='允许的变慢比例，默认 0.2')
+    p.add_argument('--search-depths', type=int, nargs='+',
+                   help='固定深度搜索的各档深度（与难度无关），默认 %s' % ' '.join(map(str, SEARCH_BENCH_DEPTHS)))
+    p.add_argument('--api-moves', type=int, default=20)
+    p = sub.add_parser('ordering', help='比较着法排序方式的节点数')
+    p.add_argument('--depth', type=int, default=4)
+    p = sub.add_parser('selective', help='比较 PVS / 期望窗口 / 空着裁剪 / LMR 各自的节点数')
+    p.add_argument('--depth', type=int, default=5)
+    p = sub.add_parser('parallel', help='根节点拆分在不同进程数下的 time-to-depth')
+    p.add_argument('--depth', type=int, default=5)
+    p.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    p = sub.add_parser('load', help='本机压测：同步部署与异步服务的吞吐与尾延迟')
+    p.add_argument('--players', type=int, default=50, help='并发走子的玩家数')
+    p.add_argument('--idle', type=int, default=1000, help='第二轮同时挂住的事件流连接数，0 为不跑')
+    p.add_argument('--seconds', type=float, default=20.0, help='每轮时长')
+    p.add_argument('--difficulty', default='normal')
+    p.add_argument('--servers', nargs='+', default=list(LOAD_SERVERS), choices=list(LOAD_SERVERS))
+    p.add_argument('--sync-cmd', default=LOAD_SERVERS['sync'])
+    p.add_argument('--async-cmd', default=LOAD_SERVERS['async'])
+    p.add_argument('--json', help='结果写入的文件')
+    args = parser.parse_args()
+    if args.command == 'suite':
+        results = run_suite(args.sections, args.search_depths, args.api_moves)
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+        failed = [row['name'] for row in results['sections'].get('perft', []) if not row['ok']]
+        if args.baseline:
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                failed += compare_to_baseline(results, json.load(f), args.tolerance)
+        if failed:
+            print('FAILED:\n  ' + '\n  '.join(failed))
+            sys.exit(1)
+    elif args.command == 'ordering':
+        ordering_report(args.depth)
+    elif args.command == 'selective':
+        selective_report(args.depth)
+    elif args.command == 'parallel':
+        parallel_report(args.depth, args.workers)
+    elif args.command == 'load':
+        commands = {'sync': args.sync_cmd, 'async': args.async_cmd}
+        rows = load_report({name: commands[name] for name in args.servers}, args.players, args.idle, args.seconds,
+                           args.difficulty)
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(rows, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,16 @@
 # -*- coding: utf-8 -*-
-"""中国象棋规则引擎：棋盘、走法生成与胜负判定。"""
-
-from copy import deepcopy
+"""中国象棋规则引擎：棋盘、走法生成与胜负判定。
+
+棋盘内部使用紧凑的 Position：90 格 bytearray（格号 sq = r * 9 + c）保存小整数棋子编码，
+并缓存双方将/帅所在格。走子 make_move/unmake_move 原地修改棋盘并返回撤销记录；
+与前端交互的 JSON 结构只在 API 边界通过 board_to_json_serializable 转换。
+"""
+
+import hashlib
+import marshal
+import os
+import random
+import tempfile
 from typing import List, Tuple, Optional
 
 # 棋子类型
@@ -19,26 +28,131 @@ BLACK_PALACE_COLS = (3, 4, 5)
 RIVER_RED_SIDE = 5   # 红方象活动行 >= 5
 RIVER_BLACK_SIDE = 4  # 黑方象活动行 <= 4
 
+# 棋子编码：低 3 位为兵种，BLACK_FLAG 位表示黑方，0 为空格
+EMPTY = 0
+KING, ADVISOR, ELEPHANT, HORSE, ROOK, CANNON, PAWN = range(1, 8)
+BLACK_FLAG = 8
+TYPE_MASK = 7
+PIECE_CODES = {name: code for code, name in enumerate(PIECE_TYPES, start=1)}
+CODE_TYPES = {code: name for name, code in PIECE_CODES.items()}
+COLOR_FLAGS = {RED: 0, BLACK: BLACK_FLAG}
+
+# 走法：(起点格, 终点格)
+Move = Tuple[int, int]
+# 撤销记录：(起点格, 终点格, 被吃棋子编码, 走子前的 Zobrist 键, 走子前的增量评估分)
+Undo = Tuple[int, int, int, int, int]
+
+# Zobrist 随机数：按 棋子编码 * 90 + 格号 索引；固定种子保证跨进程、跨版本一致
+_zobrist_rng = random.Random(0x5A0B1257)
+ZOBRIST_PIECES = [_zobrist_rng.getrandbits(64) for _ in range(16 * 90)]
+ZOBRIST_BLACK_TO_MOVE = _zobrist_rng.getrandbits(64)
+
+# 增量评估表：按 棋子编码 * 90 + 格号 索引的子力+位置分，红方为正、黑方为负；
+# 由 AI 通过 set_score_table 安装，Position.score 随走子增量维护
+_score_table = [0] * (16 * 90)
+
+
+def set_score_table(table: List[int]):
+    """安装增量评估表；只影响之后创建的 Position，已有棋盘的 score 不会重算。"""
+    global _score_table
+    if len(table) != 16 * 90:
+        raise ValueError('score table must have 16 * 90 entries')
+    _score_table = list(table)
+
+
+def get_score_table() -> List[int]:
+    """当前安装的增量评估表（只读；重新安装后返回新的列表对象）。"""
+    return _score_table
+
+
+def square(r: int, c: int) -> int:
+    return r * 9 + c
+
 
-def initial_board() -> List[List[Optional[dict]]]:
+def square_rc(sq: int) -> Tuple[int, int]:
+    return divmod(sq, 9)
+
+
+def opponent(side: str) -> str:
+    return BLACK if side == RED else RED
+
+
+def piece_color(code: int) -> str:
+    return BLACK if code & BLACK_FLAG else RED
+
+
+class Position:
+    """
+    紧凑棋盘：cells 为 90 格棋子编码，king_sq 缓存双方将/帅所在格（被吃为 -1），
+    hash 为随 make_move/unmake_move 增量维护的 Zobrist 键（不含走棋方），
+    score 为按增量评估表累计的子力+位置分（红方视角）。
+    row_occ[r] / col_occ[c] 为每行/每列的占位位图（行内按列编号、列内按行编号），供车、炮查滑动表。
+    """
+
+    __slots__ = ('cells', 'king_sq', 'hash', 'score', 'row_occ', 'col_occ')
+
+    def __init__(self, cells: Optional[bytes] = None):
+        self.cells = bytearray(cells) if cells is not None else bytearray(90)
+        self.king_sq = {RED: -1, BLACK: -1}
+        self.hash = 0
+        self.score = 0
+        self.row_occ = [0] * 10
+        self.col_occ = [0] * 9
+        for sq, p in enumerate(self.cells):
+            if not p:
+                continue
+            self.row_occ[sq // 9] |= 1 << (sq % 9)
+            self.col_occ[sq % 9] |= 1 << (sq // 9)
+            self.hash ^= ZOBRIST_PIECES[p * 90 + sq]
+            self.score += _score_table[p * 90 + sq]
+            if p & TYPE_MASK == KING:
+                self.king_sq[piece_color(p)] = sq
+
+    def copy(self) -> 'Position':
+        return Position(self.cells)
+
+    def piece_at(self, r: int, c: int) -> Optional[dict]:
+        p = self.cells[r * 9 + c]
+        if not p:
+            return None
+        return {'type': CODE_TYPES[p & TYPE_MASK], 'color': piece_color(p)}
+
+    def put(self, r: int, c: int, piece_type: str, color: str):
+        sq = r * 9 + c
+        old = self.cells[sq]
+        if old:
+            self.hash ^= ZOBRIST_PIECES[old * 90 + sq]
+            self.score -= _score_table[old * 90 + sq]
+        else:
+            self.row_occ[r] |= 1 << c
+            self.col_occ[c] |= 1 << r
+        code = PIECE_CODES[piece_type] | COLOR_FLAGS[color]
+        self.cells[sq] = code
+        self.hash ^= ZOBRIST_PIECES[code * 90 + sq]
+        self.score += _score_table[code * 90 + sq]
+        if piece_type == 'king':
+            self.king_sq[color] = sq
+
+
+def initial_board() -> Position:
     """步骤1：创建 9x10 空棋盘。步骤2：摆放初始棋子。"""
-    board = [[None for _ in range(9)] for _ in range(10)]
+    board = Position()
     # 黑方 (row 0-3)
     for col, piece_type in [(0, 'rook'), (1, 'horse'), (2, 'elephant'), (3, 'advisor'),
                             (4, 'king'), (5, 'advisor'), (6, 'elephant'), (7, 'horse'), (8, 'rook')]:
-        board[0][col] = {'type': piece_type, 'color': BLACK}
-    board[2][1] = {'type': 'cannon', 'color': BLACK}
-    board[2][7] = {'type': 'cannon', 'color': BLACK}
+        board.put(0, col, piece_type, BLACK)
+    board.put(2, 1, 'cannon', BLACK)
+    board.put(2, 7, 'cannon', BLACK)
     for col in (0, 2, 4, 6, 8):
-        board[3][col] = {'type': 'pawn', 'color': BLACK}
+        board.put(3, col, 'pawn', BLACK)
     # 红方 (row 6-9)
     for col, piece_type in [(0, 'rook'), (1, 'horse'), (2, 'elephant'), (3, 'advisor'),
                             (4, 'king'), (5, 'advisor'), (6, 'elephant'), (7, 'horse'), (8, 'rook')]:
-        board[9][col] = {'type': piece_type, 'color': RED}
-    board[7][1] = {'type': 'cannon', 'color': RED}
-    board[7][7] = {'type': 'cannon', 'color': RED}
+        board.put(9, col, piece_type, RED)
+    board.put(7, 1, 'cannon', RED)
+    board.put(7, 7, 'cannon', RED)
     for col in (0, 2, 4, 6, 8):
-        board[6][col] = {'type': 'pawn', 'color': RED}
+        board.put(6, col, 'pawn', RED)
     return board
 
 
@@ -46,31 +160,23 @@ def in_bounds(r: int, c: int) -> bool:
     return 0 <= r < 10 and 0 <= c < 9
 
 
-def get_king_pos(board: List[List], color: str) -> Optional[Tuple[int, int]]:
+def get_king_pos(board: Position, color: str) -> Optional[Tuple[int, int]]:
     """获取指定方将/帅的位置。"""
-    for r in range(10):
-        for c in range(9):
-            p = board[r][c]
-            if p and p['type'] == 'king' and p['color'] == color:
-                return (r, c)
-    return None
+    sq = board.king_sq[color]
+    if sq < 0:
+        return None
+    return divmod(sq, 9)
 
 
-def kings_face_each_other(board: List[List], exclude_from: Tuple[int, int] = None) -> bool:
-    """步骤1：找红帅、黑将列。步骤2：若同列，检查中间是否无子（飞将）。"""
-    red_pos = get_king_pos(board, RED)
-    black_pos = get_king_pos(board, BLACK)
-    if not red_pos or not black_pos or red_pos[1] != black_pos[1]:
+def kings_face_each_other(board: Position) -> bool:
+    """步骤1：取红帅、黑将所在格。步骤2：若同列，检查中间是否无子（飞将）。"""
+    red_sq = board.king_sq[RED]
+    black_sq = board.king_sq[BLACK]
+    if red_sq < 0 or black_sq < 0 or red_sq % 9 != black_sq % 9:
         return False
-    c = red_pos[1]
-    low, high = min(red_pos[0], black_pos[0]), max(red_pos[0], black_pos[0])
-    count = 0
-    for r in range(low + 1, high):
-        if board[r][c]:
-            if (r, c) == exclude_from:
-                continue
-            count += 1
-    return count == 0
+    # 两将之间的行在该列占位中全为空
+    between = (1 << (red_sq // 9)) - (1 << (black_sq // 9 + 1))
+    return not board.col_occ[red_sq % 9] & between
 
 
 def is_in_palace(r: int, c: int, color: str) -> bool:
@@ -79,205 +185,411 @@ def is_in_palace(r: int, c: int, color: str) -> bool:
     return r in BLACK_PALACE_ROWS and c in BLACK_PALACE_COLS
 
 
-def generate_king_moves(board: List[List], r: int, c: int, color: str) -> List[Tuple[int, int]]:
-    moves = []
-    for dr, dc in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
-        nr, nc = r + dr, c + dc
-        if not in_bounds(nr, nc) or not is_in_palace(nr, nc, color):
+# 马走日：(行偏移, 列偏移, 马腿行偏移, 马腿列偏移)
+HORSE_STEPS = (
+    (-2, -1, -1, 0), (-2, 1, -1, 0), (2, -1, 1, 0), (2, 1, 1, 0),
+    (-1, -2, 0, -1), (-1, 2, 0, 1), (1, -2, 0, -1), (1, 2, 0, 1),
+)
+
+# ---------- 预计算走法表 ----------
+# 各兵种在每一格的落点（连同马腿、象眼）只与格号和颜色有关，车、炮沿一行/一列的滑动只与该行/列的占位有关，
+# 因此全部预先算好，走法生成只需查表。表由 _build_move_tables 生成，缓存在用户缓存目录（MOVE_TABLES_DIR）中，
+# 之后的进程直接载入。缓存按 MOVE_TABLES_VERSION 与本文件源码的摘要区分，生成逻辑一改就不会读到旧表；
+# 缓存目录不可写时退回系统临时目录，再不行就只在内存中使用。
+
+MOVE_TABLES_DIR = os.environ.get('AI_MOVE_TABLES_DIR') or os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'cc-game')
+MOVE_TABLES_VERSION = 2
+
+# 格号 -> 行、列，以及该格在行占位（按列编号的位）与列占位（按行编号的位）中的位
+SQ_ROW = tuple(sq // 9 for sq in range(90))
+SQ_COL = tuple(sq % 9 for sq in range(90))
+SQ_COL_BIT = tuple(1 << (sq % 9) for sq in range(90))
+SQ_ROW_BIT = tuple(1 << (sq // 9) for sq in range(90))
+
+
+def _line_slides(length: int, i: int, occ: int) -> Tuple[Tuple[int, ...], Tuple[int, ...], Tuple[int, ...]]:
+    """一条长为 length 的线上，位置 i 的子在占位 occ 下向两侧滑动：(空位, 第一个子, 第二个子)。"""
+    empties, first, second = [], [], []
+    for step in (-1, 1):
+        j = i + step
+        screened = False
+        while 0 <= j < length:
+            if occ >> j & 1:
+                if screened:
+                    second.append(j)
+                    break
+                first.append(j)
+                screened = True
+            elif not screened:
+                empties.append(j)
+            j += step
+    return tuple(empties), tuple(first), tuple(second)
+
+
+def _build_move_tables() -> dict:
+    """
+    步骤1：将/仕/相/兵按颜色、马按格号列出落点；相带象眼、马带马腿，兵另列出能吃到该格的来源格（判将用）。
+    步骤2：车/炮按格号与所在行/列的占位列出 (空位, 第一个子, 第二个子)：车走空位或吃第一个子，
+           炮走空位或隔第一个子（炮架）吃第二个子；相同的结果只保存一份。
+    """
+    palace = {flag: [is_in_palace(sq // 9, sq % 9, color) for sq in range(90)] for color, flag in COLOR_FLAGS.items()}
+    king, advisor, elephant, pawn, pawn_from = {}, {}, {}, {}, {}
+    for color, flag in COLOR_FLAGS.items():
+        king[flag], advisor[flag], elephant[flag] = [], [], []
+        pawn[flag], pawn_from[flag] = [], [[] for _ in range(90)]
+        for sq in range(90):
+            r, c = divmod(sq, 9)
+            king[flag].append(tuple(
+                nr * 9 + nc for nr, nc in ((r - 1, c), (r + 1, c), (r, c - 1), (r, c + 1))
+                if palace[flag][sq] and in_bounds(nr, nc) and palace[flag][nr * 9 + nc]))
+            advisor[flag].append(tuple(
+                nr * 9 + nc for nr, nc in ((r - 1, c - 1), (r - 1, c + 1), (r + 1, c - 1), (r + 1, c + 1))
+                if palace[flag][sq] and in_bounds(nr, nc) and palace[flag][nr * 9 + nc]))
+            own_side = (lambda row: row <= RIVER_BLACK_SIDE) if flag else (lambda row: row >= RIVER_RED_SIDE)
+            elephant[flag].append(tuple(
+                ((r + dr) * 9 + c + dc, (r + dr // 2) * 9 + c + dc // 2)
+                for dr, dc in ((-2, -2), (-2, 2), (2, -2), (2, 2))
+                if own_side(r) and in_bounds(r + dr, c + dc) and own_side(r + dr)))
+            forward = 1 if flag else -1
+            crossed = r >= 5 if flag else r <= 4
+            targets = [(r + forward) * 9 + c] if 0 <= r + forward < 10 else []
+            if crossed:
+                targets += [sq + dc for dc in (-1, 1) if 0 <= c + dc < 9]
+            pawn[flag].append(tuple(targets))
+            for t in targets:
+                pawn_from[flag][t].append(sq)
+        pawn_from[flag] = [tuple(s) for s in pawn_from[flag]]
+    horse, horse_from = [], [[] for _ in range(90)]
+    for sq in range(90):
+        r, c = divmod(sq, 9)
+        steps = []
+        for dr, dc, leg_dr, leg_dc in HORSE_STEPS:
+            if in_bounds(r + dr, c + dc):
+                t, leg = (r + dr) * 9 + c + dc, (r + leg_dr) * 9 + c + leg_dc
+                steps.append((t, leg))
+                horse_from[t].append((sq, leg))
+        horse.append(tuple(steps))
+    shared = {}
+    rank, file = [], []
+    for sq in range(90):
+        r, c = divmod(sq, 9)
+        for table, length, i, to_sq in ((rank, 9, c, lambda j: r * 9 + j), (file, 10, r, lambda j: j * 9 + c)):
+            entries = [None] * (1 << length)
+            for occ in range(1 << length):
+                if occ >> i & 1:
+                    slides = tuple(tuple(to_sq(j) for j in part) for part in _line_slides(length, i, occ))
+                    entries[occ] = shared.setdefault(slides, slides)
+            table.append(entries)
+    return {
+        'king': king, 'advisor': advisor, 'elephant': elephant, 'pawn': pawn, 'pawn_from': pawn_from,
+        'horse': horse, 'horse_from': [tuple(s) for s in horse_from], 'rank': rank, 'file': file,
+    }
+
+
+def _move_tables_key() -> str:
+    """缓存键：格式版本 + 本文件源码与 marshal 格式的摘要。"""
+    with open(os.path.abspath(__file__), 'rb') as f:
+        digest = hashlib.sha1(f.read() + b'%d' % marshal.version).hexdigest()[:16]
+    return 'v%d-%s' % (MOVE_TABLES_VERSION, digest)
+
+
+def _load_move_tables() -> dict:
+    """读取缓存的走法表；没有缓存或缓存键不符时重新生成，并依次尝试写入用户缓存目录与系统临时目录。"""
+    key = _move_tables_key()
+    name = 'move_tables-%s.bin' % key
+    dirs = (MOVE_TABLES_DIR, os.path.join(tempfile.gettempdir(), 'cc-game'))
+    for d in dirs:
+        try:
+            with open(os.path.join(d, name), 'rb') as f:
+                cached_key, tables = marshal.load(f)
+            if cached_key == key:
+                return tables
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+    tables = _build_move_tables()
+    for d in dirs:
+        try:
+            os.makedirs(d, exist_ok=True)
+            path = os.path.join(d, name)
+            tmp = '%s.%d.tmp' % (path, os.getpid())
+            with open(tmp, 'wb') as f:
+                marshal.dump((key, tables), f)
+            os.replace(tmp, path)
+            break
+        except OSError:
             continue
-        piece = board[nr][nc]
-        if piece is None or piece['color'] != color:
-            moves.append((nr, nc))
+    return tables
+
+
+_tables = _load_move_tables()
+# 按颜色位（0 / BLACK_FLAG）再按格号索引的落点表；相为 (落点, 象眼)
+KING_TARGETS = _tables['king']
+ADVISOR_TARGETS = _tables['advisor']
+ELEPHANT_TARGETS = _tables['elephant']
+PAWN_TARGETS = _tables['pawn']
+# 能吃到该格的兵所在格（判将用）
+PAWN_SOURCES = _tables['pawn_from']
+# 按格号索引：马的 (落点, 马腿)；能跳到该格的马的 (所在格, 马腿)
+HORSE_TARGETS = _tables['horse']
+HORSE_SOURCES = _tables['horse_from']
+# 按格号、再按所在行（列）的占位索引：(空位, 第一个子, 第二个子)，子所在格须在占位中
+RANK_SLIDES = _tables['rank']
+FILE_SLIDES = _tables['file']
+del _tables
+
+
+def generate_king_moves(board: 'Position', sq: int, flag: int) -> List[int]:
+    cells = board.cells
+    moves = []
+    for t in KING_TARGETS[flag][sq]:
+        p = cells[t]
+        if not p or p & BLACK_FLAG != flag:
+            moves.append(t)
     return moves
 
 
-def generate_advisor_moves(board: List[List], r: int, c: int, color: str) -> List[Tuple[int, int]]:
+def generate_advisor_moves(board: 'Position', sq: int, flag: int) -> List[int]:
+    cells = board.cells
     moves = []
-    for dr, dc in [(-1, -1), (-1, 1), (1, -1), (1, 1)]:
-        nr, nc = r + dr, c + dc
-        if not in_bounds(nr, nc) or not is_in_palace(nr, nc, color):
-            continue
-        piece = board[nr][nc]
-        if piece is None or piece['color'] != color:
-            moves.append((nr, nc))
+    for t in ADVISOR_TARGETS[flag][sq]:
+        p = cells[t]
+        if not p or p & BLACK_FLAG != flag:
+            moves.append(t)
     return moves
 
 
-def generate_elephant_moves(board: List[List], r: int, c: int, color: str) -> List[Tuple[int, int]]:
+def generate_elephant_moves(board: 'Position', sq: int, flag: int) -> List[int]:
+    cells = board.cells
     moves = []
-    for dr, dc in [(-2, -2), (-2, 2), (2, -2), (2, 2)]:
-        nr, nc = r + dr, c + dc
-        if not in_bounds(nr, nc):
-            continue
-        if color == RED and nr < RIVER_RED_SIDE:
+    for t, eye in ELEPHANT_TARGETS[flag][sq]:
+        if cells[eye]:
             continue
-        if color == BLACK and nr > RIVER_BLACK_SIDE:
-            continue
-        # 象眼
-        er, ec = r + dr // 2, c + dc // 2
-        if board[er][ec]:
-            continue
-        piece = board[nr][nc]
-        if piece is None or piece['color'] != color:
-            moves.append((nr, nc))
+        p = cells[t]
+        if not p or p & BLACK_FLAG != flag:
+            moves.append(t)
     return moves
 
 
-def generate_horse_moves(board: List[List], r: int, c: int, color: str) -> List[Tuple[int, int]]:
-    # 8 个方向：马走日，先 2 再 1，检查马腿
-    steps = [
-        (-2, -1, -1, 0), (-2, 1, -1, 0), (2, -1, 1, 0), (2, 1, 1, 0),
-        (-1, -2, 0, -1), (-1, 2, 0, 1), (1, -2, 0, -1), (1, 2, 0, 1),
-    ]
+def generate_horse_moves(board: 'Position', sq: int, flag: int) -> List[int]:
+    cells = board.cells
     moves = []
-    for dr, dc, leg_dr, leg_dc in steps:
-        lr, lc = r + leg_dr, c + leg_dc
-        if not in_bounds(lr, lc) or board[lr][lc]:
-            continue
-        nr, nc = r + dr, c + dc
-        if not in_bounds(nr, nc):
+    for t, leg in HORSE_TARGETS[sq]:
+        if cells[leg]:
             continue
-        piece = board[nr][nc]
-        if piece is None or piece['color'] != color:
-            moves.append((nr, nc))
+        p = cells[t]
+        if not p or p & BLACK_FLAG != flag:
+            moves.append(t)
     return moves
 
 
-def generate_rook_moves(board: List[List], r: int, c: int, color: str) -> List[Tuple[int, int]]:
-    moves = []
-    for dr, dc in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
-        nr, nc = r + dr, c + dc
-        while in_bounds(nr, nc):
-            piece = board[nr][nc]
-            if piece is None:
-                moves.append((nr, nc))
-            else:
-                if piece['color'] != color:
-                    moves.append((nr, nc))
-                break
-            nr, nc = nr + dr, nc + dc
+def generate_rook_moves(board: 'Position', sq: int, flag: int) -> List[int]:
+    cells = board.cells
+    rank_empty, rank_first, _ = RANK_SLIDES[sq][board.row_occ[SQ_ROW[sq]]]
+    file_empty, file_first, _ = FILE_SLIDES[sq][board.col_occ[SQ_COL[sq]]]
+    moves = list(rank_empty + file_empty)
+    for t in rank_first + file_first:
+        if cells[t] & BLACK_FLAG != flag:
+            moves.append(t)
     return moves
 
 
-def generate_cannon_moves(board: List[List], r: int, c: int, color: str) -> List[Tuple[int, int]]:
-    moves = []
-    for dr, dc in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
-        nr, nc = r + dr, c + dc
-        jumped = False
-        while in_bounds(nr, nc):
-            piece = board[nr][nc]
-            if not jumped:
-                if piece is None:
-                    moves.append((nr, nc))
-                else:
-                    jumped = True
-            else:
-                if piece is not None:
-                    if piece['color'] != color:
-                        moves.append((nr, nc))
-                    break
-            nr, nc = nr + dr, nc + dc
+def generate_cannon_moves(board: 'Position', sq: int, flag: int) -> List[int]:
+    cells = board.cells
+    rank_empty, _, rank_second = RANK_SLIDES[sq][board.row_occ[SQ_ROW[sq]]]
+    file_empty, _, file_second = FILE_SLIDES[sq][board.col_occ[SQ_COL[sq]]]
+    moves = list(rank_empty + file_empty)
+    for t in rank_second + file_second:
+        if cells[t] & BLACK_FLAG != flag:
+            moves.append(t)
     return moves
 
 
-def generate_pawn_moves(board: List[List], r: int, c: int, color: str) -> List[Tuple[int, int]]:
+def generate_pawn_moves(board: 'Position', sq: int, flag: int) -> List[int]:
+    cells = board.cells
     moves = []
-    if color == RED:
-        # 红方向上（行减小）
-        if r > 0:
-            nr = r - 1
-            piece = board[nr][c]
-            if piece is None or piece['color'] != color:
-                moves.append((nr, c))
-        if r <= 4:  # 过河后可横走
-            for nc in (c - 1, c + 1):
-                if 0 <= nc < 9:
-                    piece = board[r][nc]
-                    if piece is None or piece['color'] != color:
-                        moves.append((r, nc))
-    else:
-        if r < 9:
-            nr = r + 1
-            piece = board[nr][c]
-            if piece is None or piece['color'] != color:
-                moves.append((nr, c))
-        if r >= 5:
-            for nc in (c - 1, c + 1):
-                if 0 <= nc < 9:
-                    piece = board[r][nc]
-                    if piece is None or piece['color'] != color:
-                        moves.append((r, nc))
+    for t in PAWN_TARGETS[flag][sq]:
+        p = cells[t]
+        if not p or p & BLACK_FLAG != flag:
+            moves.append(t)
     return moves
 
 
-GENERATORS = {
-    'king': generate_king_moves,
-    'advisor': generate_advisor_moves,
-    'elephant': generate_elephant_moves,
-    'horse': generate_horse_moves,
-    'rook': generate_rook_moves,
-    'cannon': generate_cannon_moves,
-    'pawn': generate_pawn_moves,
-}
+# 按兵种编码索引的走法生成器
+GENERATORS = (
+    None,
+    generate_king_moves,
+    generate_advisor_moves,
+    generate_elephant_moves,
+    generate_horse_moves,
+    generate_rook_moves,
+    generate_cannon_moves,
+    generate_pawn_moves,
+)
 
 
-def generate_moves_for_piece(board: List[List], r: int, c: int) -> List[Tuple[int, int]]:
-    piece = board[r][c]
-    if not piece:
-        return []
-    gen = GENERATORS.get(piece['type'])
-    if not gen:
+def generate_moves_for_piece(board: Position, sq: int) -> List[int]:
+    p = board.cells[sq]
+    if not p:
         return []
-    return gen(board, r, c, piece['color'])
+    return GENERATORS[p & TYPE_MASK](board, sq, p & BLACK_FLAG)
 
 
-def all_legal_moves(board: List[List], side: str) -> List[Tuple[Tuple[int, int], Tuple[int, int]]]:
-    """生成一方所有合法着法（移动后不造成己方被将、不造成飞将）。"""
+def pseudo_legal_moves(board: Position, side: str) -> List[Move]:
+    """生成一方所有伪合法着法（不检查走后己方是否被将）。"""
+    cells = board.cells
+    flag = COLOR_FLAGS[side]
     result = []
-    for r in range(10):
-        for c in range(9):
-            piece = board[r][c]
-            if not piece or piece['color'] != side:
-                continue
-            for (nr, nc) in generate_moves_for_piece(board, r, c):
-                new_board = make_move(board, (r, c), (nr, nc))
-                if is_king_attacked(new_board, side):
-                    continue
-                if kings_face_each_other(new_board):
-                    continue
-                result.append(((r, c), (nr, nc)))
+    for sq, p in enumerate(cells):
+        if not p or p & BLACK_FLAG != flag:
+            continue
+        for t in GENERATORS[p & TYPE_MASK](board, sq, flag):
+            result.append((sq, t))
     return result
 
 
-def make_move(board: List[List], from_pos: Tuple[int, int], to_pos: Tuple[int, int]) -> List[List]:
-    """执行一步（不检查合法性），返回新棋盘。"""
-    new_board = deepcopy(board)
-    r0, c0 = from_pos
-    r1, c1 = to_pos
-    new_board[r1][c1] = new_board[r0][c0]
-    new_board[r0][c0] = None
-    return new_board
+def _is_exposure_candidate(from_sq: int, to_sq: int, ksq: int) -> bool:
+    """非将/帅的着法只有以下情况才可能让己方被将或飞将：
+    起点或终点与己方将/帅同行同列（车、炮、对面将的射线及炮架变化），
+    或起点是将/帅的斜邻格（可能是对方马的马腿）。其余着法无需试走检验。"""
+    kr, kc = ksq // 9, ksq % 9
+    fr, fc = from_sq // 9, from_sq % 9
+    if fr == kr or fc == kc or (abs(fr - kr) == 1 and abs(fc - kc) == 1):
+        return True
+    return to_sq // 9 == kr or to_sq % 9 == kc
 
 
-def is_king_attacked(board: List[List], king_color: str) -> bool:
-    """判断 king_color 方的将/帅是否被将军。"""
-    kpos = get_king_pos(board, king_color)
-    if not kpos:
-        return True
-    kr, kc = kpos
-    opponent = BLACK if king_color == RED else RED
-    for r in range(10):
-        for c in range(9):
-            piece = board[r][c]
-            if not piece or piece['color'] != opponent:
-                continue
-            moves = generate_moves_for_piece(board, r, c)
-            if (kr, kc) in moves:
+def all_legal_moves(board: Position, side: str, captures_only: bool = False) -> List[Move]:
+    """
+    生成一方所有合法着法（移动后不造成己方被将、不造成飞将）；captures_only 时只生成吃子着法。
+    步骤1：判断当前是否被将军。
+    步骤2：未被将军时，不可能暴露将/帅的着法直接收下；其余着法试走后用 is_square_attacked 检验。
+    """
+    ksq = board.king_sq[side]
+    if ksq < 0:
+        return []
+    opp = opponent(side)
+    in_check = is_square_attacked(board, ksq, opp)
+    cells = board.cells
+    result = []
+    for move in pseudo_legal_moves(board, side):
+        from_sq, to_sq = move
+        if captures_only and not cells[to_sq]:
+            continue
+        if not in_check and from_sq != ksq and not _is_exposure_candidate(from_sq, to_sq, ksq):
+            result.append(move)
+            continue
+        undo = make_move(board, from_sq, to_sq)
+        if not is_square_attacked(board, board.king_sq[side], opp) and not kings_face_each_other(board):
+            result.append(move)
+        unmake_move(board, undo)
+    return result
+
+
+def make_move(board: Position, from_sq: int, to_sq: int) -> Undo:
+    """原地执行一步（不检查合法性），返回供 unmake_move 使用的撤销记录。"""
+    cells = board.cells
+    piece = cells[from_sq]
+    captured = cells[to_sq]
+    old_hash = board.hash
+    old_score = board.score
+    cells[to_sq] = piece
+    cells[from_sq] = EMPTY
+    table = _score_table
+    h = old_hash ^ ZOBRIST_PIECES[piece * 90 + from_sq] ^ ZOBRIST_PIECES[piece * 90 + to_sq]
+    score = old_score - table[piece * 90 + from_sq] + table[piece * 90 + to_sq]
+    board.row_occ[SQ_ROW[from_sq]] ^= SQ_COL_BIT[from_sq]
+    board.col_occ[SQ_COL[from_sq]] ^= SQ_ROW_BIT[from_sq]
+    if captured:
+        h ^= ZOBRIST_PIECES[captured * 90 + to_sq]
+        score -= table[captured * 90 + to_sq]
+        if captured & TYPE_MASK == KING:
+            board.king_sq[piece_color(captured)] = -1
+    else:
+        board.row_occ[SQ_ROW[to_sq]] ^= SQ_COL_BIT[to_sq]
+        board.col_occ[SQ_COL[to_sq]] ^= SQ_ROW_BIT[to_sq]
+    board.hash = h
+    board.score = score
+    if piece & TYPE_MASK == KING:
+        board.king_sq[piece_color(piece)] = to_sq
+    return (from_sq, to_sq, captured, old_hash, old_score)
+
+
+def unmake_move(board: Position, undo: Undo):
+    """按撤销记录还原 make_move。"""
+    from_sq, to_sq, captured, old_hash, old_score = undo
+    cells = board.cells
+    piece = cells[to_sq]
+    cells[from_sq] = piece
+    cells[to_sq] = captured
+    board.hash = old_hash
+    board.score = old_score
+    board.row_occ[SQ_ROW[from_sq]] ^= SQ_COL_BIT[from_sq]
+    board.col_occ[SQ_COL[from_sq]] ^= SQ_ROW_BIT[from_sq]
+    if not captured:
+        board.row_occ[SQ_ROW[to_sq]] ^= SQ_COL_BIT[to_sq]
+        board.col_occ[SQ_COL[to_sq]] ^= SQ_ROW_BIT[to_sq]
+    if piece & TYPE_MASK == KING:
+        board.king_sq[piece_color(piece)] = from_sq
+    if captured & TYPE_MASK == KING:
+        board.king_sq[piece_color(captured)] = to_sq
+
+
+def position_key(board: Position, side: str) -> int:
+    """局面键：棋子 Zobrist 键再并入走棋方，用于置换表等按局面索引的缓存。"""
+    return board.hash ^ ZOBRIST_BLACK_TO_MOVE if side == BLACK else board.hash
+
+
+def is_square_attacked(board: Position, sq: int, by_side: str) -> bool:
+    """
+    判断 by_side 方是否有棋子能走到（吃到）sq。
+    从 sq 向外反查走法表：车/炮按 sq 所在行、列的滑动表，马、兵按来源表，
+    将/仕/相的走法对称，直接用 sq 处的落点表；不生成任何一方的完整着法。
+    """
+    cells = board.cells
+    flag = COLOR_FLAGS[by_side]
+    # 车：滑动方向上第一个子；炮：隔一个炮架后的第一个子（把 sq 视为有子再查表）
+    rook, cannon = ROOK | flag, CANNON | flag
+    for _, first, second in (RANK_SLIDES[sq][board.row_occ[SQ_ROW[sq]] | SQ_COL_BIT[sq]],
+                             FILE_SLIDES[sq][board.col_occ[SQ_COL[sq]] | SQ_ROW_BIT[sq]]):
+        for t in first:
+            if cells[t] == rook:
+                return True
+        for t in second:
+            if cells[t] == cannon:
                 return True
+    # 马：马腿紧挨马
+    horse = HORSE | flag
+    for hsq, leg in HORSE_SOURCES[sq]:
+        if cells[hsq] == horse and not cells[leg]:
+            return True
+    pawn = PAWN | flag
+    for t in PAWN_SOURCES[flag][sq]:
+        if cells[t] == pawn:
+            return True
+    king, advisor = KING | flag, ADVISOR | flag
+    for t in KING_TARGETS[flag][sq]:
+        if cells[t] == king:
+            return True
+    for t in ADVISOR_TARGETS[flag][sq]:
+        if cells[t] == advisor:
+            return True
+    elephant = ELEPHANT | flag
+    for t, eye in ELEPHANT_TARGETS[flag][sq]:
+        if cells[t] == elephant and not cells[eye]:
+            return True
     return False
 
 
-def is_checkmate_or_stalemate(board: List[List], side: str) -> str:
+def is_king_attacked(board: Position, king_color: str) -> bool:
+    """判断 king_color 方的将/帅是否被将军。"""
+    ksq = board.king_sq[king_color]
+    if ksq < 0:
+        return True
+    return is_square_attacked(board, ksq, opponent(king_color))
+
+
+def is_checkmate_or_stalemate(board: Position, side: str) -> str:
     """
     步骤1：若当前被将军且无合法着法，则将死。
     步骤2：若未被将军且无合法着法，则困毙。
@@ -291,9 +603,124 @@ def is_checkmate_or_stalemate(board: List[List], side: str) -> str:
     return ''
 
 
-def board_to_json_serializable(board: List[List]) -> List[List]:
+def move_to_json(move: Move) -> dict:
+    """将引擎着法转为前端使用的 {'from': [r, c], 'to': [r, c]}。"""
+    return {'from': list(divmod(move[0], 9)), 'to': list(divmod(move[1], 9))}
+
+
+def move_from_json(from_pos, to_pos) -> Optional[Move]:
+    """解析前端传入的 [r, c] 坐标对；格式或范围不对时返回 None。"""
+    try:
+        (r0, c0), (r1, c1) = from_pos, to_pos
+    except (TypeError, ValueError):
+        return None
+    if not all(isinstance(v, int) for v in (r0, c0, r1, c1)):
+        return None
+    if not in_bounds(r0, c0) or not in_bounds(r1, c1):
+        return None
+    return (r0 * 9 + c0, r1 * 9 + c1)
+
+
+def move_to_iccs(move: Move) -> str:
+    """ICCS 记法：列 a-i 从左到右，行 0-9 从红方底线起算，如炮二平五为 h2e2。"""
+    (r0, c0), (r1, c1) = divmod(move[0], 9), divmod(move[1], 9)
+    return '%s%d%s%d' % ('abcdefghi'[c0], 9 - r0, 'abcdefghi'[c1], 9 - r1)
+
+
+def move_from_iccs(text: str) -> Optional[Move]:
+    """解析 ICCS 记法（不区分大小写）；格式不对时返回 None。"""
+    text = text.strip().lower().replace('-', '')
+    if len(text) != 4 or text[0] not in 'abcdefghi' or text[2] not in 'abcdefghi' \
+            or not text[1].isdigit() or not text[3].isdigit():
+        return None
+    c0, r0 = ord(text[0]) - ord('a'), 9 - int(text[1])
+    c1, r1 = ord(text[2]) - ord('a'), 9 - int(text[3])
+    return (r0 * 9 + c0, r1 * 9 + c1)
+
+
+def board_to_json_serializable(board: Position) -> List[List]:
     """将棋盘转为可 JSON 序列化的结构。"""
-    out = []
-    for row in board:
-        out.append([p.copy() if p else None for p in row])
-    return out
+    return [[board.piece_at(r, c) for c in range(9)] for r in range(10)]
+
+
+def board_from_json_serializable(rows: List[List]) -> Position:
+    """board_to_json_serializable 的逆操作：由 10x9 的棋子字典列表还原棋盘。"""
+    board = Position()
+    for r, row in enumerate(rows):
+        for c, p in enumerate(row):
+            if p:
+                board.put(r, c, p['type'], p['color'])
+    return board
+
+
+# FEN 棋子字母（大写红方、小写黑方）；解析时兼容 E/H 写法的象与马
+FEN_LETTERS = {KING: 'k', ADVISOR: 'a', ELEPHANT: 'b', HORSE: 'n', ROOK: 'r', CANNON: 'c', PAWN: 'p'}
+_FEN_CODES = {letter: code for code, letter in FEN_LETTERS.items()}
+_FEN_CODES.update({'e': ELEPHANT, 'h': HORSE})
+INITIAL_FEN = 'rnbakabnr/9/1c5c1/p1p1p1p1p/9/9/P1P1P1P1P/1C5C1/9/RNBAKABNR w'
+
+
+def board_from_fen(fen: str) -> Tuple[Position, str]:
+    """
+    解析 FEN，返回 (棋盘, 走棋方)。第一段为从黑方底线（第 0 行）起的 10 行，数字表示连续空格；
+    第二段 w/r 为红方走、b 为黑方走，缺省为红方。之后的字段（回合数等）忽略。格式错误时抛出 ValueError。
+    """
+    parts = fen.strip().split()
+    if not parts:
+        raise ValueError('empty FEN')
+    rows = parts[0].split('/')
+    if len(rows) != 10:
+        raise ValueError('FEN must have 10 ranks')
+    cells = bytearray(90)
+    for r, row in enumerate(rows):
+        c = 0
+        for ch in row:
+            if ch.isdigit():
+                c += int(ch)
+                continue
+            code = _FEN_CODES.get(ch.lower())
+            if code is None or c >= 9:
+                raise ValueError('bad FEN rank: %s' % row)
+            cells[r * 9 + c] = code | (BLACK_FLAG if ch.islower() else 0)
+            c += 1
+        if c != 9:
+            raise ValueError('bad FEN rank: %s' % row)
+    side = parts[1].lower() if len(parts) > 1 else 'w'
+    if side not in ('w', 'r', 'b'):
+        raise ValueError('bad FEN side to move: %s' % parts[1])
+    return Position(cells), BLACK if side == 'b' else RED
+
+
+def board_to_fen(board: Position, side: str) -> str:
+    """棋盘与走棋方转为 FEN（只含局面与走棋方两段）。"""
+    rows = []
+    for r in range(10):
+        row, empty = '', 0
+        for p in board.cells[r * 9:r * 9 + 9]:
+            if not p:
+                empty += 1
+                continue
+            if empty:
+                row += str(empty)
+                empty = 0
+            letter = FEN_LETTERS[p & TYPE_MASK]
+            row += letter if p & BLACK_FLAG else letter.upper()
+        if empty:
+            row += str(empty)
+        rows.append(row)
+    return '/'.join(rows) + (' b' if side == BLACK else ' w')
+
+
+def position_error(board: Position, side: str) -> Optional[str]:
+    """检查导入的局面能否开局：双方各有一个将/帅且在九宫内、将帅不照面、不走棋的一方未被将军。合法时返回 None。"""
+    for color in (RED, BLACK):
+        kings = [sq for sq, p in enumerate(board.cells) if p == KING | COLOR_FLAGS[color]]
+        if len(kings) != 1:
+            return '%s must have exactly one king' % color
+        if not is_in_palace(kings[0] // 9, kings[0] % 9, color):
+            return '%s king outside palace' % color
+    if kings_face_each_other(board):
+        return 'kings face each other'
+    if is_king_attacked(board, opponent(side)):
+        return 'side not to move is in check'
+    return None
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""对局事件推送：每局一个频道，AI 搜索进度与着法经 Server-Sent Events 推给前端（GET /api/game/<id>/events）。
+
+频道只在当前进程内；多进程部署时事件流与搜索任务须落在同一进程（与长轮询接口相同）。
+"""
+
+import json
+import queue
+import threading
+from typing import Optional
+
+# 每个订阅者最多积压的事件数，超出时丢弃最旧的进度事件（客户端过慢或已断开）
+MAX_PENDING_EVENTS = 64
+# 没有事件时发送心跳注释的间隔（秒），便于及早发现断开的连接
+HEARTBEAT_SECONDS = 15
+
+
+def format_event(event: str, data: dict, event_id: Optional[int] = None) -> str:
+    """按 SSE 文本格式编码一条事件。"""
+    lines = []
+    if event_id is not None:
+        lines.append('id: %d' % event_id)
+    lines.append('event: %s' % event)
+    lines.append('data: %s' % json.dumps(data, separators=(',', ':')))
+    return '\n'.join(lines) + '\n\n'
+
+
+class Subscription:
+    """一个事件流连接的收件队列；compact 为真时收紧凑线格式的数据（见 wire_format.py）。"""
+
+    def __init__(self, game_id: str, compact: bool = False):
+        self.game_id = game_id
+        self.compact = compact
+        # 放入事件后调用的无参函数：异步服务（asgi.py）据此唤醒事件循环，而不是阻塞在 get 上
+        self.waker = None
+        self._queue = queue.Queue(MAX_PENDING_EVENTS)
+
+    def put(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            # 积压过多：丢掉最旧的一条再放入，最终结果事件不会被后续进度挤掉太多
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            self._queue.put_nowait(item)
+        if self.waker is not None:
+            self.waker()
+
+    def get(self, timeout: Optional[float] = HEARTBEAT_SECONDS) -> Optional[str]:
+        """取下一条已编码的事件；超时返回 None（调用方发送心跳），timeout 为 None 时不等待。"""
+        try:
+            if timeout is None:
+                return self._queue.get_nowait()
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventHub:
+    """
+    按 game_id 分发事件。
+    步骤1：subscribe 为一个连接创建收件队列；连接关闭时 unsubscribe。
+    步骤2：publish 给事件编号（每局递增），每种格式只编码一次，放入该局全部订阅者的队列，不阻塞发布方。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}  # game_id -> [Subscription]
+        self._next_id = {}      # game_id -> 下一个事件编号
+
+    def subscribe(self, game_id: str, compact: bool = False) -> Subscription:
+        sub = Subscription(game_id, compact)
+        with self._lock:
+            self._subscribers.setdefault(game_id, []).append(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            subs = self._subscribers.get(sub.game_id)
+            if subs and sub in subs:
+                subs.remove(sub)
+                if not subs:
+                    del self._subscribers[sub.game_id]
+                    self._next_id.pop(sub.game_id, None)
+
+    def publish(self, game_id: str, event: str, data: dict, compact: Optional[dict] = None) -> int:
+        """发布一条事件，返回收到的订阅者数；compact 为紧凑格式订阅者收到的数据（None 时与 data 相同）。"""
+        with self._lock:
+            subs = list(self._subscribers.get(game_id, ()))
+            if not subs:
+                return 0
+            event_id = self._next_id.get(game_id, 1)
+            self._next_id[game_id] = event_id + 1
+        texts = {}
+        for sub in subs:
+            use_compact = sub.compact and compact is not None
+            text = texts.get(use_compact)
+            if text is None:
+                text = texts[use_compact] = format_event(event, compact if use_compact else data, event_id)
+            sub.put(text)
+        return len(subs)
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(subs) for subs in self._subscribers.values())
+
+
+hub = EventHub()
@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""gunicorn 配置（gunicorn 启动时自动读取当前目录下的本文件）：每个 worker 载入应用后先拉起搜索进程。"""
+
+
+def post_worker_init(worker):
+    from app import get_pool
+    get_pool().warm_up()
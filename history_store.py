@@ -1,81 +1,242 @@
 # -*- coding: utf-8 -*-
-"""对战历史存储：JSON 文件持久化。"""
+"""对战历史存储：SQLite（WAL 模式）持久化，按 id 主键查找、按 created_at 索引分页。
+
+每条记录只保存起始局面（90 字节）与着法（每步 2 字节），棋盘通过 replay.Replay 按需重建。
+首次打开默认数据库（HISTORY_DB）时会把旧版 data/game_history.json 导入，导入后原文件改名为 .migrated；
+旧版保存逐步快照的表会被转换成着法列表。写入函数可用 db 参数指定其他数据库（如自对弈库），不做旧文件迁移。
+"""
 
 import json
 import os
+import sqlite3
+import threading
+from collections import OrderedDict
 from datetime import datetime
 from typing import List, Optional
 from uuid import uuid4
 
-HISTORY_FILE = os.path.join(os.path.dirname(__file__), 'data', 'game_history.json')
+from chess_engine import Position, Move
+from replay import Replay, encode_moves, decode_moves, moves_from_snapshots
+
+HISTORY_DB = os.path.join(os.path.dirname(__file__), 'data', 'game_history.db')
+# 旧版整文件 JSON 存储，仅用于一次性迁移
+LEGACY_HISTORY_FILE = os.path.join(os.path.dirname(__file__), 'data', 'game_history.json')
+
+# 多进程同时写入时等待写锁的时间（毫秒）
+BUSY_TIMEOUT_MS = 5000
+# 进程内缓存的回放器数量（记录写入后不再修改，缓存无需失效）
+REPLAY_CACHE_SIZE = 64
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS records (
+    id TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    winner TEXT,
+    difficulty TEXT NOT NULL,
+    moves_count INTEGER NOT NULL,
+    red_is_ai INTEGER NOT NULL,
+    start_cells BLOB NOT NULL,
+    moves BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS records_created_at ON records (created_at);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+_SUMMARY_COLUMNS = 'id, winner, difficulty, moves_count, red_is_ai, created_at'
 
+# 每个线程一个连接（sqlite3 连接不能跨线程共享），按数据库路径区分
+_local = threading.local()
 
-def _ensure_data_dir():
-    d = os.path.dirname(HISTORY_FILE)
+_replay_cache = OrderedDict()
+_replay_lock = threading.Lock()
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat(timespec='microseconds') + 'Z'
+
+
+def _connect(db: Optional[str] = None) -> sqlite3.Connection:
+    """取得当前线程到 db（默认 HISTORY_DB）的连接；首次打开时建表并执行迁移，旧版 JSON 只迁入默认数据库。"""
+    path = db or HISTORY_DB
+    conns = getattr(_local, 'conns', None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(path)
+    if conn is not None:
+        return conn
+    d = os.path.dirname(path)
     if d and not os.path.isdir(d):
-        os.makedirs(d)
+        os.makedirs(d, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000.0, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    _migrate_snapshot_table(conn)
+    _create_schema(conn)
+    if path == HISTORY_DB:
+        _migrate_legacy_json(conn)
+    conns[path] = conn
+    return conn
+
 
+def _create_schema(conn: sqlite3.Connection):
+    # 逐条执行而不用 executescript：后者会先提交当前事务，迁移时需要在同一事务里建表
+    for statement in _SCHEMA.split(';'):
+        if statement.strip():
+            conn.execute(statement)
 
-def _load_all() -> List[dict]:
-    _ensure_data_dir()
-    if not os.path.isfile(HISTORY_FILE):
-        return []
+
+def _snapshot_row(r: dict) -> tuple:
+    """旧版（含 board_snapshots）记录转为新表的一行。"""
+    start, moves = moves_from_snapshots(r.get('board_snapshots') or [])
+    return (
+        r['id'],
+        r.get('created_at') or _now(),
+        r.get('winner'),
+        r.get('difficulty') or 'normal',
+        r.get('moves_count') or 0,
+        1 if r.get('red_is_ai') else 0,
+        bytes(start.cells),
+        encode_moves(moves),
+    )
+
+
+def _migrate_snapshot_table(conn: sqlite3.Connection):
+    """把保存逐步快照的旧表转换为起始局面 + 着法列表；已是新表时直接返回。"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(records)')]
+        if 'board_snapshots' in columns:
+            conn.execute('ALTER TABLE records RENAME TO records_snapshots')
+            conn.execute('DROP INDEX IF EXISTS records_created_at')
+            _create_schema(conn)
+            for row in conn.execute('SELECT * FROM records_snapshots').fetchall():
+                r = dict(row)
+                r['board_snapshots'] = json.loads(r['board_snapshots'])
+                conn.execute('INSERT INTO records VALUES (?, ?, ?, ?, ?, ?, ?, ?)', _snapshot_row(r))
+            conn.execute('DROP TABLE records_snapshots')
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+
+def _migrate_legacy_json(conn: sqlite3.Connection):
+    """
+    一次性迁移旧版 JSON 文件。
+    步骤1：在写事务中检查 meta 标记，多进程同时启动时只有一个会真正导入。
+    步骤2：逐条插入（id 冲突则跳过），写入标记后提交。步骤3：把旧文件改名，避免重复读取。
+    """
+    if not os.path.isfile(LEGACY_HISTORY_FILE):
+        return
+    conn.execute('BEGIN IMMEDIATE')
     try:
-        with open(HISTORY_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        done = conn.execute("SELECT value FROM meta WHERE key = 'legacy_json_migrated'").fetchone()
+        if done is None:
+            try:
+                with open(LEGACY_HISTORY_FILE, 'r', encoding='utf-8') as f:
+                    records = json.load(f)
+            except Exception:
+                records = []
+            for r in records:
+                if not isinstance(r, dict) or not r.get('id'):
+                    continue
+                conn.execute('INSERT OR IGNORE INTO records VALUES (?, ?, ?, ?, ?, ?, ?, ?)', _snapshot_row(r))
+            conn.execute("INSERT INTO meta VALUES ('legacy_json_migrated', ?)", (_now(),))
+        conn.execute('COMMIT')
     except Exception:
-        return []
+        conn.execute('ROLLBACK')
+        raise
+    try:
+        os.replace(LEGACY_HISTORY_FILE, LEGACY_HISTORY_FILE + '.migrated')
+    except OSError:
+        pass
 
 
-def _save_all(records: List[dict]):
-    _ensure_data_dir()
-    with open(HISTORY_FILE, 'w', encoding='utf-8') as f:
-        json.dump(records, f, ensure_ascii=False, indent=2)
+def _summary(row: sqlite3.Row) -> dict:
+    return {
+        'id': row['id'],
+        'winner': row['winner'],
+        'difficulty': row['difficulty'],
+        'moves_count': row['moves_count'],
+        'red_is_ai': bool(row['red_is_ai']),
+        'created_at': row['created_at'],
+    }
 
 
 def add_record(
     winner: Optional[str],
     difficulty: str,
     moves_count: int,
-    board_snapshots: List[List],
+    start: Position,
+    moves: List[Move],
     red_is_ai: bool,
+    db: Optional[str] = None,
 ) -> str:
-    """步骤1：生成 id 与时间。步骤2：追加记录并保存。"""
+    """步骤1：生成 id 与时间。步骤2：插入一行（单条 INSERT，不读已有记录）；db 为目标数据库，默认 HISTORY_DB。"""
     record_id = str(uuid4())
-    records = _load_all()
-    records.append({
-        'id': record_id,
-        'winner': winner,
-        'difficulty': difficulty,
-        'moves_count': moves_count,
-        'board_snapshots': board_snapshots,
-        'red_is_ai': red_is_ai,
-        'created_at': datetime.utcnow().isoformat() + 'Z',
-    })
-    _save_all(records)
+    _connect(db).execute(
+        'INSERT INTO records VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        (
+            record_id,
+            _now(),
+            winner,
+            difficulty,
+            moves_count,
+            1 if red_is_ai else 0,
+            bytes(start.cells),
+            encode_moves(moves),
+        ),
+    )
     return record_id
 
 
-def list_records(limit: int = 50) -> List[dict]:
-    """返回最近 limit 条记录（不含完整棋盘快照以减小体积）。"""
-    records = _load_all()
-    result = []
-    for r in reversed(records[-limit:]):
-        result.append({
-            'id': r['id'],
-            'winner': r.get('winner'),
-            'difficulty': r.get('difficulty', 'normal'),
-            'moves_count': r.get('moves_count', 0),
-            'red_is_ai': r.get('red_is_ai', False),
-            'created_at': r.get('created_at', ''),
-        })
-    return result
+def list_records(limit: int = 50, before: Optional[str] = None) -> List[dict]:
+    """
+    按 created_at 倒序返回最多 limit 条记录（不含完整棋盘快照以减小体积）。
+    before 为上一页最后一条的 created_at，用于翻页。
+    """
+    limit = max(0, min(limit, 500))
+    if before:
+        rows = _connect().execute(
+            'SELECT %s FROM records WHERE created_at < ? ORDER BY created_at DESC LIMIT ?' % _SUMMARY_COLUMNS,
+            (before, limit),
+        )
+    else:
+        rows = _connect().execute(
+            'SELECT %s FROM records ORDER BY created_at DESC LIMIT ?' % _SUMMARY_COLUMNS,
+            (limit,),
+        )
+    return [_summary(row) for row in rows]
 
 
 def get_record(record_id: str) -> Optional[dict]:
-    """根据 id 获取单条记录（含棋盘快照）。"""
-    records = _load_all()
-    for r in records:
-        if r.get('id') == record_id:
-            return r
-    return None
+    """根据 id 获取单条记录：摘要字段加 start（起始局面 Position）与 moves（着法列表）。"""
+    row = _connect().execute('SELECT * FROM records WHERE id = ?', (record_id,)).fetchone()
+    if row is None:
+        return None
+    record = _summary(row)
+    record['start'] = Position(row['start_cells'])
+    record['moves'] = decode_moves(row['moves'])
+    return record
+
+
+def get_replay(record_id: str) -> Optional[Replay]:
+    """取得记录的回放器（带关键帧），按 id 缓存最近 REPLAY_CACHE_SIZE 个。"""
+    with _replay_lock:
+        replay = _replay_cache.get(record_id)
+        if replay is not None:
+            _replay_cache.move_to_end(record_id)
+            return replay
+    record = get_record(record_id)
+    if record is None:
+        return None
+    replay = Replay(record['start'], record['moves'])
+    with _replay_lock:
+        _replay_cache[record_id] = replay
+        while len(_replay_cache) > REPLAY_CACHE_SIZE:
+            _replay_cache.popitem(last=False)
+    return replay
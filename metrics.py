@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""进程内指标：计数器、直方图与回调式仪表，按 Prometheus 文本格式输出（GET /api/metrics）。
+
+指标只在当前进程内累计；多个 gunicorn worker 时每个 worker 各自暴露一份。
+"""
+
+import threading
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# 时延直方图的桶上界（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEPTH_BUCKETS = (1, 2, 3, 4, 5, 6, 7, 8, 10, 12)
+
+_lock = threading.Lock()
+_registry = []
+
+
+def _label_text(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    parts = ['%s="%s"' % (n, str(v).replace('\\', '\\\\').replace('"', '\\"')) for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{%s}' % ','.join(parts) if parts else ''
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.values = {}
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(n, '') for n in self.labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s counter' % self.name]
+        for key, value in sorted(self.values.items()):
+            lines.append('%s%s %s' % (self.name, _label_text(self.labels, key), _number(value)))
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values = {}  # 标签值 -> [各桶计数..., 总和, 总数]
+        _registry.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(n, '') for n in self.labels)
+        with _lock:
+            row = self.values.get(key)
+            if row is None:
+                row = self.values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s histogram' % self.name]
+        for key, row in sorted(self.values.items()):
+            for i, bound in enumerate(self.buckets):
+                lines.append('%s_bucket%s %d' % (
+                    self.name, _label_text(self.labels, key, 'le="%s"' % _number(bound)), row[i]))
+            lines.append('%s_bucket%s %d' % (self.name, _label_text(self.labels, key, 'le="+Inf"'), row[-1]))
+            lines.append('%s_sum%s %s' % (self.name, _label_text(self.labels, key), _number(row[-2])))
+            lines.append('%s_count%s %d' % (self.name, _label_text(self.labels, key), row[-1]))
+        return lines
+
+
+class Gauge:
+    """回调式仪表：输出时调用 fn，返回 {标签值元组: 数值}。"""
+
+    def __init__(self, name: str, help_text: str, fn: Callable[[], Dict[tuple, float]], labels: Iterable[str] = (),
+                 kind: str = 'gauge'):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.labels = tuple(labels)
+        self.kind = kind
+        _registry.append(self)
+
+    def render(self) -> List[str]:
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s %s' % (self.name, self.kind)]
+        for key, value in sorted(self.fn().items()):
+            lines.append('%s%s %s' % (self.name, _label_text(self.labels, key), _number(value)))
+        return lines
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+HTTP_REQUESTS = Counter(
+    'xiangqi_http_requests_total', 'HTTP requests by endpoint, method and status.',
+    ('endpoint', 'method', 'status'))
+HTTP_LATENCY = Histogram(
+    'xiangqi_http_request_duration_seconds', 'HTTP request latency by endpoint and game difficulty.',
+    ('endpoint', 'method', 'difficulty'))
+SEARCHES = Counter('xiangqi_ai_searches_total', 'AI searches by difficulty and final status.', ('difficulty', 'status'))
+SEARCH_LATENCY = Histogram(
+    'xiangqi_ai_search_duration_seconds', 'Time spent searching, per difficulty.', ('difficulty',))
+SEARCH_WAIT = Histogram(
+    'xiangqi_ai_search_total_seconds', 'Time from job submission to result, including queueing.', ('difficulty',))
+SEARCH_DEPTH = Histogram(
+    'xiangqi_ai_search_depth', 'Deepest completed iteration per search.', ('difficulty',), DEPTH_BUCKETS)
+SEARCH_NODES = Counter('xiangqi_ai_search_nodes_total', 'Nodes visited, including quiescence.', ('difficulty',))
+SEARCH_QNODES = Counter('xiangqi_ai_search_qnodes_total', 'Quiescence nodes visited.', ('difficulty',))
+SEARCH_CUTOFFS = Counter('xiangqi_ai_search_cutoffs_total', 'Beta cutoffs in the main search.', ('difficulty',))
+SEARCH_TT_PROBES = Counter('xiangqi_ai_search_tt_probes_total', 'Transposition table probes.', ('difficulty',))
+SEARCH_TT_HITS = Counter('xiangqi_ai_search_tt_hits_total', 'Transposition table hits.', ('difficulty',))
+MOVE_CACHE = Counter('xiangqi_ai_move_cache_total', 'Best-move cache lookups by result (hit/miss).', ('result',))
+PONDER = Counter(
+    'xiangqi_ai_ponder_total',
+    'Ponder outcomes: hit/continued/miss when the real move arrives, skipped at the concurrency cap.', ('result',))
+
+
+def observe_search(difficulty: str, status: str, total_seconds: float, stats: dict = None):
+    """记录一次搜索任务的结果；stats 为 SearchStats.to_json() 的输出（取消或失败时可能没有）。"""
+    SEARCHES.inc(difficulty=difficulty, status=status)
+    SEARCH_WAIT.observe(total_seconds, difficulty=difficulty)
+    if not stats:
+        return
+    SEARCH_LATENCY.observe(stats['elapsed_ms'] / 1000.0, difficulty=difficulty)
+    SEARCH_DEPTH.observe(stats['depth'], difficulty=difficulty)
+    SEARCH_NODES.inc(stats['nodes'], difficulty=difficulty)
+    SEARCH_QNODES.inc(stats['qnodes'], difficulty=difficulty)
+    SEARCH_CUTOFFS.inc(stats['cutoffs'], difficulty=difficulty)
+    SEARCH_TT_PROBES.inc(stats['tt_probes'], difficulty=difficulty)
+    SEARCH_TT_HITS.inc(stats['tt_hits'], difficulty=difficulty)
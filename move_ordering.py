@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""着法排序：让 alpha-beta 尽早搜到好棋，从而剪掉更多分支。"""
+
+from typing import List, Optional
+
+from chess_engine import Position, Move, TYPE_MASK
+
+# 排序分段：置换表着法 > 吃子（MVV-LVA）> 杀手着法 > 历史表得分
+_CAPTURE_BASE = 1 << 42
+_KILLER_BASE = 1 << 41
+
+
+class MoveOrderer:
+    """
+    一次搜索内的着法排序器。
+    步骤1：置换表或上一轮的最佳着法排第一。
+    步骤2：吃子按“最有价值的被吃子 / 最便宜的吃子方”（MVV-LVA）排序。
+    步骤3：本层的两个杀手着法（曾引发剪枝的非吃子着法）。
+    步骤4：其余着法按历史表得分（引发剪枝时按 depth^2 累加）排序。
+    """
+
+    def __init__(self, piece_values: List[int], max_ply: int = 64):
+        # piece_values 按兵种编码索引，即 ai_engine.CODE_VALUES
+        self.piece_values = piece_values
+        self.killers = [[None, None] for _ in range(max_ply)]
+        self.history = [0] * (90 * 90)
+
+    def order(self, board: Position, moves: List[Move], ply: int, tt_move: Optional[Move] = None) -> List[Move]:
+        cells = board.cells
+        values = self.piece_values
+        history = self.history
+        killers = self.killers[ply] if ply < len(self.killers) else (None, None)
+
+        def score(move):
+            if move == tt_move:
+                return _CAPTURE_BASE * 2
+            victim = cells[move[1]]
+            if victim:
+                return _CAPTURE_BASE + values[victim & TYPE_MASK] * 100000 - values[cells[move[0]] & TYPE_MASK]
+            if move == killers[0]:
+                return _KILLER_BASE + 1
+            if move == killers[1]:
+                return _KILLER_BASE
+            return history[move[0] * 90 + move[1]]
+
+        return sorted(moves, key=score, reverse=True)
+
+    def record_cutoff(self, board: Position, move: Move, depth: int, ply: int):
+        """move 在本层引发剪枝：非吃子着法记为杀手并累加历史得分。调用时棋盘应已还原。"""
+        if board.cells[move[1]]:
+            return
+        if ply < len(self.killers):
+            killers = self.killers[ply]
+            if killers[0] != move:
+                killers[1] = killers[0]
+                killers[0] = move
+        self.history[move[0] * 90 + move[1]] += depth * depth
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""开局库：按局面 Zobrist 键排序的紧凑二进制文件，mmap 后二分查找，查到即走，不必搜索。
+
+文件格式（小端）：
+    头部 16 字节：魔数 b'XQBK'、版本 u16、保留 u16、条目数 u32、初始局面键的低 32 位 u32（用于发现 Zobrist 表变化）
+    条目 12 字节：局面键 u64（position_key，含走棋方）、起点格 u8、终点格 u8、权重 u16
+同一局面的多个着法相邻存放，按权重随机选择。
+
+用法：python opening_book.py build --plies 8 --out data/opening_book.bin
+      python opening_book.py build --import games.txt --out data/opening_book.bin
+      python opening_book.py probe "h2e2 h9g7"
+"""
+
+import argparse
+import mmap
+import os
+import random
+import struct
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from chess_engine import (
+    Position,
+    Move,
+    initial_board,
+    all_legal_moves,
+    make_move,
+    unmake_move,
+    move_from_iccs,
+    move_to_iccs,
+    position_key,
+    opponent,
+    RED,
+)
+
+BOOK_FILE = os.environ.get(
+    'AI_OPENING_BOOK', os.path.join(os.path.dirname(__file__), 'data', 'opening_book.bin'))
+
+_MAGIC = b'XQBK'
+_VERSION = 1
+_HEADER = struct.Struct('<4sHHII')
+_ENTRY = struct.Struct('<QBBH')
+
+
+def _initial_key_check() -> int:
+    return position_key(initial_board(), RED) & 0xFFFFFFFF
+
+
+class OpeningBook:
+    """只读开局库：构造时 mmap 文件，probe 二分查找，不把文件读入内存。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, count, check = _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError('not an opening book: %s' % path)
+        if check != _initial_key_check():
+            raise ValueError('opening book was built with different Zobrist keys: %s' % path)
+        if _HEADER.size + count * _ENTRY.size > len(self._mm):
+            raise ValueError('truncated opening book: %s' % path)
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _key_at(self, i: int) -> int:
+        return struct.unpack_from('<Q', self._mm, _HEADER.size + i * _ENTRY.size)[0]
+
+    def probe(self, board: Position, side: str) -> List[Tuple[Move, int]]:
+        """返回该局面的 (着法, 权重) 列表，未收录时为空列表。"""
+        key = position_key(board, side)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        result = []
+        mm = self._mm
+        while lo < self.count:
+            k, from_sq, to_sq, weight = _ENTRY.unpack_from(mm, _HEADER.size + lo * _ENTRY.size)
+            if k != key:
+                break
+            result.append(((from_sq, to_sq), weight))
+            lo += 1
+        return result
+
+    def choose(self, board: Position, side: str, rng: random.Random = random) -> Optional[Move]:
+        """按权重随机选一个合法的库着法；未收录或库着法都不合法时返回 None。"""
+        entries = self.probe(board, side)
+        if not entries:
+            return None
+        legal = set(all_legal_moves(board, side))
+        entries = [(m, w) for m, w in entries if m in legal and w > 0]
+        if not entries:
+            return None
+        return rng.choices([m for m, _ in entries], weights=[w for _, w in entries])[0]
+
+    def close(self):
+        self._mm.close()
+
+
+_book = None
+_book_loaded = False
+
+
+def get_book() -> Optional[OpeningBook]:
+    """进程内共享的开局库；BOOK_FILE 不存在或无效时返回 None（只尝试打开一次）。"""
+    global _book, _book_loaded
+    if not _book_loaded:
+        _book_loaded = True
+        if os.path.isfile(BOOK_FILE):
+            try:
+                _book = OpeningBook(BOOK_FILE)
+            except (ValueError, OSError):
+                _book = None
+    return _book
+
+
+def write_book(path: str, book: Dict[int, Dict[Move, int]]):
+    """把 {局面键: {着法: 权重}} 按键排序写成二进制文件；权重截断到 u16。"""
+    rows = []
+    for key, moves in book.items():
+        for move, weight in moves.items():
+            rows.append((key, move[0], move[1], max(1, min(int(weight), 0xFFFF))))
+    rows.sort()
+    d = os.path.dirname(path)
+    if d and not os.path.isdir(d):
+        os.makedirs(d, exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, 0, len(rows), _initial_key_check()))
+        for row in rows:
+            f.write(_ENTRY.pack(*row))
+    os.replace(tmp, path)
+    return len(rows)
+
+
+def import_games(lines: List[str], max_plies: int) -> Dict[int, Dict[Move, int]]:
+    """
+    从对局文本导入：每行一局 ICCS 着法（空格分隔），取前 max_plies 步，
+    同一局面下每个着法的出现次数即权重；遇到非法着法时跳过该局余下部分。
+    """
+    book = defaultdict(lambda: defaultdict(int))
+    for line in lines:
+        board, side = initial_board(), RED
+        for text in line.split()[:max_plies]:
+            move = move_from_iccs(text)
+            if move is None or move not in all_legal_moves(board, side):
+                break
+            book[position_key(board, side)][move] += 1
+            make_move(board, move[0], move[1])
+            side = opponent(side)
+    return book
+
+
+def generate_book(plies: int, depth: int, width: int, margin: int) -> Dict[int, Dict[Move, int]]:
+    """
+    用引擎自行生成开局库。
+    步骤1：从初始局面起按层展开，每个局面用固定深度搜索给根着法打分；
+           窗口下限取当前最佳分减 margin，落在下限以下的着法只需证明“不够好”，不求精确分。
+    步骤2：保留与最佳分相差不超过 margin 的前 width 个着法，分差越小权重越大。
+    步骤3：对保留的着法继续展开，直到 plies 步；相同局面只搜索一次。
+    """
+    # ai_engine 在导入时引用本模块，这里延迟导入以免循环引用
+    from ai_engine import SearchContext, SearchBudget, CODE_VALUES, negamax, iterative_deepening
+    from move_ordering import MoveOrderer
+    from transposition import TranspositionTable
+
+    book = {}
+    tt = TranspositionTable(size_bits=18)
+    frontier = [(initial_board(), RED)]
+    for ply in range(plies):
+        next_frontier = []
+        start = time.perf_counter()
+        for board, side in frontier:
+            key = position_key(board, side)
+            if key in book:
+                continue
+            moves = all_legal_moves(board, side)
+            if not moves:
+                continue
+            ctx = SearchContext(tt=tt, budget=SearchBudget(), orderer=MoveOrderer(CODE_VALUES))
+            # 先做一次普通的迭代加深，填好置换表与排序信息，逐着法打分时大部分子树可直接剪掉
+            iterative_deepening(board, side, depth - 1, ctx)
+            scored, best = [], -1e9
+            for move in ctx.orderer.order(board, moves, 0):
+                floor = best - margin - 1 if scored else -1e9
+                undo = make_move(board, move[0], move[1])
+                val = -negamax(board, depth - 1, opponent(side), -1e9, -floor, ctx, 1)[0]
+                unmake_move(board, undo)
+                if val > floor:
+                    scored.append((val, move))
+                    best = max(best, val)
+            scored.sort(key=lambda x: -x[0])
+            kept = [(v, m) for v, m in scored[:width] if best - v <= margin]
+            book[key] = {m: margin + 1 - (best - v) for v, m in kept}
+            for _, m in kept:
+                child = board.copy()
+                make_move(child, m[0], m[1])
+                next_frontier.append((child, opponent(side)))
+        print('ply %d: %d positions, %.1fs' % (ply + 1, len(frontier), time.perf_counter() - start))
+        frontier = next_frontier
+    return book
+
+
+def main():
+    parser = argparse.ArgumentParser(description='xiangqi opening book')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('build', help='生成或导入开局库')
+    p.add_argument('--out', default=BOOK_FILE)
+    p.add_argument('--plies', type=int, default=8, help='收录的最大步数')
+    p.add_argument('--depth', type=int, default=4, help='生成时每个局面的搜索深度')
+    p.add_argument('--width', type=int, default=2, help='每个局面最多保留的着法数')
+    p.add_argument('--margin', type=int, default=15, help='与最佳着法的最大分差')
+    p.add_argument('--import', dest='import_file', help='从每行一局 ICCS 着法的文本文件导入，而不是自行生成')
+    p = sub.add_parser('probe', help='查询某个着法序列之后的库着法')
+    p.add_argument('moves', nargs='?', default='')
+    p.add_argument('--book', default=BOOK_FILE)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        if args.import_file:
+            with open(args.import_file, 'r', encoding='utf-8') as f:
+                book = import_games(f.readlines(), args.plies)
+        else:
+            book = generate_book(args.plies, args.depth, args.width, args.margin)
+        n = write_book(args.out, book)
+        print('%d positions, %d entries -> %s (%d bytes)' % (len(book), n, args.out, os.path.getsize(args.out)))
+    else:
+        book = OpeningBook(args.book)
+        board, side = initial_board(), RED
+        for text in args.moves.split():
+            move = move_from_iccs(text)
+            make_move(board, move[0], move[1])
+            side = opponent(side)
+        start = time.perf_counter()
+        entries = book.probe(board, side)
+        elapsed_us = (time.perf_counter() - start) * 1e6
+        for move, weight in sorted(entries, key=lambda x: -x[1]):
+            print(move_to_iccs(move), weight)
+        print('%d entries, probe %.1fus' % (len(entries), elapsed_us))
+
+
+if __name__ == '__main__':
+    main()
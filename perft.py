@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""走法生成自检：perft 节点计数，并可与参考实现逐节点对照。
+
+参考实现与引擎的快速路径完全独立：直接在 90 格数组上按射线、马腿、象眼逐步走出每个子的着法（不用预计算的走法表、
+行列占位与 make_move），试走每一步后生成对方全部着法，看能否吃到将/帅或是否将帅照面。
+用法：python perft.py 3 --check
+      python perft.py 4 --fen "3ak4/4a4/4b4/9/9/9/9/4B4/4A4/3AKR3 w"
+"""
+
+import argparse
+import time
+from typing import List
+
+from chess_engine import (
+    Position,
+    Move,
+    initial_board,
+    board_from_fen,
+    all_legal_moves,
+    make_move,
+    unmake_move,
+    move_to_json,
+    opponent,
+    COLOR_FLAGS,
+    BLACK_FLAG,
+    TYPE_MASK,
+    KING,
+    ADVISOR,
+    ELEPHANT,
+    HORSE,
+    ROOK,
+    CANNON,
+    PAWN,
+    RED,
+)
+
+# 初始局面（红先）的公认 perft 结果
+INITIAL_PERFT = {1: 44, 2: 1920, 3: 79666, 4: 3290240}
+
+
+def _reference_piece_moves(cells: bytearray, sq: int) -> List[int]:
+    """参考走法：按行列坐标逐格检查，车/炮沿四个方向走到底，马看马腿，相看象眼，将/仕限九宫，兵过河可横走。"""
+    p = cells[sq]
+    flag = p & BLACK_FLAG
+    t = p & TYPE_MASK
+    r, c = divmod(sq, 9)
+
+    def on_board(nr, nc):
+        return 0 <= nr < 10 and 0 <= nc < 9
+
+    def enterable(nr, nc):
+        q = cells[nr * 9 + nc]
+        return not q or q & BLACK_FLAG != flag
+
+    def in_palace(nr, nc):
+        return 3 <= nc <= 5 and (nr <= 2 if flag else nr >= 7)
+
+    targets = []
+    if t in (KING, ADVISOR):
+        steps = ((-1, 0), (1, 0), (0, -1), (0, 1)) if t == KING else ((-1, -1), (-1, 1), (1, -1), (1, 1))
+        for dr, dc in steps:
+            nr, nc = r + dr, c + dc
+            if on_board(nr, nc) and in_palace(nr, nc) and enterable(nr, nc):
+                targets.append((nr, nc))
+    elif t == ELEPHANT:
+        for dr, dc in ((-2, -2), (-2, 2), (2, -2), (2, 2)):
+            nr, nc = r + dr, c + dc
+            if on_board(nr, nc) and (nr <= 4 if flag else nr >= 5) \
+                    and not cells[(r + dr // 2) * 9 + c + dc // 2] and enterable(nr, nc):
+                targets.append((nr, nc))
+    elif t == HORSE:
+        for dr, dc in ((-2, -1), (-2, 1), (2, -1), (2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2)):
+            nr, nc = r + dr, c + dc
+            leg = (r + dr // 2, c) if abs(dr) == 2 else (r, c + dc // 2)
+            if on_board(nr, nc) and not cells[leg[0] * 9 + leg[1]] and enterable(nr, nc):
+                targets.append((nr, nc))
+    elif t in (ROOK, CANNON):
+        for dr, dc in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+            nr, nc = r + dr, c + dc
+            screened = False
+            while on_board(nr, nc):
+                q = cells[nr * 9 + nc]
+                if not screened:
+                    if not q:
+                        targets.append((nr, nc))
+                    elif t == ROOK:
+                        if q & BLACK_FLAG != flag:
+                            targets.append((nr, nc))
+                        break
+                    else:
+                        screened = True
+                elif q:
+                    if q & BLACK_FLAG != flag:
+                        targets.append((nr, nc))
+                    break
+                nr, nc = nr + dr, nc + dc
+    elif t == PAWN:
+        forward = 1 if flag else -1
+        steps = [(forward, 0)]
+        if r >= 5 if flag else r <= 4:
+            steps += [(0, -1), (0, 1)]
+        for dr, dc in steps:
+            nr, nc = r + dr, c + dc
+            if on_board(nr, nc) and enterable(nr, nc):
+                targets.append((nr, nc))
+    return [nr * 9 + nc for nr, nc in targets]
+
+
+def _reference_king_exposed(cells: bytearray, flag: int) -> bool:
+    """flag 方的将/帅不在、被对方任一子的参考走法吃到，或与对方将帅同列且中间无子。"""
+    own_king, opp_king = KING | flag, KING | (BLACK_FLAG - flag)
+    if own_king not in cells:
+        return True
+    ksq = cells.index(own_king)
+    opp_flag = BLACK_FLAG - flag
+    for sq, p in enumerate(cells):
+        if p and p & BLACK_FLAG == opp_flag and ksq in _reference_piece_moves(cells, sq):
+            return True
+    if opp_king in cells:
+        osq = cells.index(opp_king)
+        if osq % 9 == ksq % 9 and not any(cells[s] for s in range(min(ksq, osq) + 9, max(ksq, osq), 9)):
+            return True
+    return False
+
+
+def reference_is_king_attacked(board: Position, king_color: str) -> bool:
+    """参考实现：生成对方每个棋子的参考着法，看是否包含己方将/帅所在格。"""
+    return _reference_king_exposed(bytearray(board.cells), COLOR_FLAGS[king_color])
+
+
+def reference_legal_moves(board: Position, side: str) -> List[Move]:
+    """参考实现：每个子的参考着法都在棋盘副本上试走，走后己方将/帅被攻击或将帅照面的去掉。"""
+    flag = COLOR_FLAGS[side]
+    cells = bytearray(board.cells)
+    result = []
+    for sq, p in enumerate(cells):
+        if not p or p & BLACK_FLAG != flag:
+            continue
+        for to_sq in _reference_piece_moves(cells, sq):
+            captured = cells[to_sq]
+            cells[to_sq], cells[sq] = p, 0
+            if not _reference_king_exposed(cells, flag):
+                result.append((sq, to_sq))
+            cells[sq], cells[to_sq] = p, captured
+    return result
+
+
+def perft(board: Position, side: str, depth: int) -> int:
+    """统计 depth 层内的叶子节点数（最后一层直接计数着法）。"""
+    moves = all_legal_moves(board, side)
+    if depth <= 1:
+        return len(moves) if depth == 1 else 1
+    opp = opponent(side)
+    total = 0
+    for move in moves:
+        undo = make_move(board, move[0], move[1])
+        total += perft(board, opp, depth - 1)
+        unmake_move(board, undo)
+    return total
+
+
+def perft_checked(board: Position, side: str, depth: int, path: List[Move] = None) -> int:
+    """与 perft 相同，但每个节点都与 reference_legal_moves 对照，不一致时抛出 AssertionError。"""
+    path = path or []
+    moves = all_legal_moves(board, side)
+    expected = reference_legal_moves(board, side)
+    if sorted(moves) != sorted(expected):
+        raise AssertionError('legal moves differ after %s: missing %s, extra %s' % (
+            [move_to_json(m) for m in path],
+            [move_to_json(m) for m in set(expected) - set(moves)],
+            [move_to_json(m) for m in set(moves) - set(expected)],
+        ))
+    if depth <= 1:
+        return len(moves) if depth == 1 else 1
+    opp = opponent(side)
+    total = 0
+    for move in moves:
+        undo = make_move(board, move[0], move[1])
+        total += perft_checked(board, opp, depth - 1, path + [move])
+        unmake_move(board, undo)
+    return total
+
+
+def divide(board: Position, side: str, depth: int) -> dict:
+    """按根着法拆分 perft 结果，便于定位出错的分支。"""
+    result = {}
+    opp = opponent(side)
+    for move in all_legal_moves(board, side):
+        undo = make_move(board, move[0], move[1])
+        result[move] = perft(board, opp, depth - 1)
+        unmake_move(board, undo)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='xiangqi perft')
+    parser.add_argument('depth', type=int, nargs='?', default=3)
+    parser.add_argument('--check', action='store_true', help='与参考实现逐节点对照')
+    parser.add_argument('--divide', action='store_true', help='按根着法输出节点数')
+    parser.add_argument('--fen', help='起始局面，默认为初始局面')
+    args = parser.parse_args()
+
+    if args.fen:
+        board, side = board_from_fen(args.fen)
+    else:
+        board, side = initial_board(), RED
+    if args.divide:
+        for move, count in sorted(divide(board, side, args.depth).items()):
+            print(move_to_json(move), count)
+    for depth in range(1, args.depth + 1):
+        start = time.perf_counter()
+        if args.check:
+            nodes = perft_checked(board, side, depth)
+        else:
+            nodes = perft(board, side, depth)
+        elapsed = time.perf_counter() - start
+        expected = None if args.fen else INITIAL_PERFT.get(depth)
+        status = '' if expected is None else ('ok' if nodes == expected else 'MISMATCH (expected %d)' % expected)
+        print('perft(%d) = %d  %.2fs  %.0f nodes/s  %s' % (
+            depth, nodes, elapsed, nodes / elapsed if elapsed else 0, status))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""对局回放：由起始局面与着法列表按需重建任意一步的棋盘。
+
+对局记录只保存起始局面（90 字节）与着法（每步 2 字节：起点格、终点格），
+回放时每隔 KEYFRAME_INTERVAL 步缓存一个关键帧，跳到第 k 步最多重走 KEYFRAME_INTERVAL - 1 步。
+"""
+
+from typing import List, Tuple
+
+from chess_engine import Position, Move, make_move, initial_board, board_from_json_serializable
+
+KEYFRAME_INTERVAL = 16
+
+
+def encode_moves(moves: List[Move]) -> bytes:
+    """着法列表编码为每步 2 字节。"""
+    out = bytearray()
+    for from_sq, to_sq in moves:
+        out.append(from_sq)
+        out.append(to_sq)
+    return bytes(out)
+
+
+def decode_moves(data: bytes) -> List[Move]:
+    return [(data[i], data[i + 1]) for i in range(0, len(data) - 1, 2)]
+
+
+def moves_from_snapshots(snapshots: List[List]) -> Tuple[Position, List[Move]]:
+    """
+    把旧版逐步快照（board_to_json_serializable 的列表）还原成起始局面与着法列表。
+    相邻两帧中变空的格为起点、另一变化格为终点；遇到无法识别的变化时截断。
+    """
+    if not snapshots:
+        return initial_board(), []
+    boards = [board_from_json_serializable(s).cells for s in snapshots]
+    moves = []
+    for prev, cur in zip(boards, boards[1:]):
+        changed = [sq for sq in range(90) if prev[sq] != cur[sq]]
+        if len(changed) != 2:
+            break
+        a, b = changed
+        if not cur[a] and prev[a] == cur[b]:
+            moves.append((a, b))
+        elif not cur[b] and prev[b] == cur[a]:
+            moves.append((b, a))
+        else:
+            break
+    return Position(boards[0]), moves
+
+
+class Replay:
+    """
+    一局棋的回放器。
+    步骤1：构造时从起始局面顺序走完全部着法，每 KEYFRAME_INTERVAL 步记一个关键帧。
+    步骤2：board_at(ply) 从不晚于 ply 的最近关键帧复制棋盘，再补走剩余着法。
+    """
+
+    def __init__(self, start: Position, moves: List[Move], keyframe_interval: int = KEYFRAME_INTERVAL):
+        self.moves = moves
+        self.interval = keyframe_interval
+        board = start.copy()
+        self.keyframes = [bytes(board.cells)]
+        for i, (from_sq, to_sq) in enumerate(moves, 1):
+            make_move(board, from_sq, to_sq)
+            if i % keyframe_interval == 0:
+                self.keyframes.append(bytes(board.cells))
+
+    def __len__(self) -> int:
+        return len(self.moves)
+
+    def board_at(self, ply: int) -> Position:
+        """第 ply 步走完后的棋盘（0 为起始局面）；越界抛出 IndexError。"""
+        if ply < 0 or ply > len(self.moves):
+            raise IndexError('ply out of range')
+        k = ply // self.interval
+        board = Position(self.keyframes[k])
+        for from_sq, to_sq in self.moves[k * self.interval:ply]:
+            make_move(board, from_sq, to_sq)
+        return board
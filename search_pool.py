@@ -0,0 +1,705 @@
+# -*- coding: utf-8 -*-
+"""AI 搜索执行器：ai_choose_move 在进程池中运行，Flask 请求线程只负责提交任务、查询结果与取消。
+
+每个任务占用一个取消标志槽（进程间共享的字节数组），取消时置位，搜索在下一次预算检查时中止。
+各进程按 (game_id, AI 颜色) 缓存置换表，同一局的后续搜索落到同一进程时可复用。
+开启根节点拆分的难度由协调线程逐层把根着法分给多个进程并行搜索，进程间通过共享数组交换当前最好分。
+迭代加深每完成一层，工作进程经进度队列报告深度与当前最佳着法，由读取线程转给任务的 on_progress。
+AI 走完后可在对方思考时预搜索（ponder）对方最可能的应着之后的局面，猜中时直接取结果或接着等这次搜索。
+"""
+
+import multiprocessing
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Callable, List, Optional, Tuple
+
+from chess_engine import (
+    Position,
+    Move,
+    all_legal_moves,
+    make_move,
+    unmake_move,
+    opponent,
+    move_to_iccs,
+    move_to_json,
+    position_key,
+)
+from ai_engine import (
+    ai_choose_move,
+    search_root_moves,
+    principal_variation,
+    SearchAborted,
+    SearchBudget,
+    SearchContext,
+    SearchStats,
+    SEARCH_LIMITS_BY_DIFFICULTY,
+    CODE_VALUES,
+    DEFAULT_FEATURES,
+)
+from move_ordering import MoveOrderer
+from transposition import TranspositionTable
+import metrics
+
+# 搜索进程数；0 表示不启进程，在一个后台线程里搜索（开发或单核环境）
+POOL_WORKERS = int(os.environ.get('AI_POOL_WORKERS', str(os.cpu_count() or 1)))
+# 各难度同时存在（排队中 + 搜索中）的任务数上限
+MAX_JOBS_BY_DIFFICULTY = {
+    'normal': 64,
+    'hard': 16,
+    'hell': 4,
+}
+# 所有难度合计的任务数上限，超出即拒绝（背压）
+MAX_QUEUE_DEPTH = int(os.environ.get('AI_MAX_QUEUE_DEPTH', '64'))
+# 已结束任务保留多久（秒）供客户端取结果
+JOB_RESULT_TTL = 300
+# 取消标志槽数量，须大于 MAX_QUEUE_DEPTH，槽位轮转使用
+CANCEL_SLOTS = 1024
+# 每个进程缓存的置换表数量
+TT_CACHE_SIZE = 32
+# 各难度的根节点拆分份数：大于 1 时一次搜索同时占用这么多个进程，1 为单进程搜索。
+# 默认不拆分：目前只在单核机器上测过（benchmark.py parallel），拆分比单进程迭代加深慢；多核上测出加速后再调大
+ROOT_SPLIT_BY_DIFFICULTY = {
+    'normal': 1,
+    'hard': 1,
+    'hell': int(os.environ.get('AI_HELL_SPLIT', '1')),
+}
+# 最佳着法缓存容量（按局面 + 走棋方 + 难度，所有对局共享），0 为关闭
+MOVE_CACHE_SIZE = int(os.environ.get('AI_MOVE_CACHE_SIZE', '4096'))
+# 普通难度在同分着法中随机选择，缓存会让它变得固定，因此不缓存
+UNCACHED_DIFFICULTIES = ('normal',)
+# 在对方思考时预搜索的难度（预搜索结果经最佳着法缓存交付，缓存关闭时不预搜索）
+PONDER_DIFFICULTIES = ('hard', 'hell')
+# 所有对局合计同时进行的预搜索数上限，只占一部分进程；0 为关闭（单进程/线程模式默认关闭，免得挡住真正的搜索）
+MAX_PONDER_JOBS = int(os.environ.get('AI_MAX_PONDER_JOBS', str(POOL_WORKERS // 2)))
+# 单次预搜索的时间预算（毫秒）；0 为与正常搜索相同
+PONDER_TIME_MS = int(os.environ.get('AI_PONDER_TIME_MS', '0')) or None
+
+PENDING, DONE, CANCELLED, FAILED = 'pending', 'done', 'cancelled', 'failed'
+
+
+class PoolBusy(Exception):
+    """该难度或全局的任务数已达上限，调用方应返回 429。"""
+
+
+# ---------- 工作进程侧 ----------
+
+_cancel_flags = None
+_shared_alpha = None
+_progress_queue = None
+_tt_cache = OrderedDict()
+
+
+def _init_worker(cancel_flags, shared_alpha=None, progress_queue=None):
+    global _cancel_flags, _shared_alpha, _progress_queue
+    _cancel_flags = cancel_flags
+    _shared_alpha = shared_alpha
+    _progress_queue = progress_queue
+
+
+def _warm_up_worker() -> int:
+    return os.getpid()
+
+
+def _table_for(game_key) -> TranspositionTable:
+    tt = _tt_cache.pop(game_key, None)
+    if tt is None:
+        tt = TranspositionTable()
+    _tt_cache[game_key] = tt
+    while len(_tt_cache) > TT_CACHE_SIZE:
+        _tt_cache.popitem(last=False)
+    return tt
+
+
+def _cancel_checker(slot: int) -> Optional[Callable[[], bool]]:
+    flags = _cancel_flags
+    if flags is None or slot < 0:
+        return None
+    return lambda: flags[slot] != 0
+
+
+def _progress_reporter(slot: int) -> Optional[Callable[[int, float, Move, int], None]]:
+    q = _progress_queue
+    if q is None or slot < 0:
+        return None
+    return lambda depth, score, move, nodes: q.put((slot, depth, score, move, nodes))
+
+
+def run_search(cells: bytes, ai_color: str, difficulty: str, time_ms: Optional[int], game_key,
+               slot: int, moves: Optional[List[Move]] = None) -> Tuple[Optional[Move], dict]:
+    """在工作进程中执行一次 ai_choose_move；cells 为棋盘字节串，moves 为调用方已生成的合法着法。返回 (着法, 搜索统计)。"""
+    stats = SearchStats()
+    move = ai_choose_move(Position(cells), ai_color, difficulty, _table_for(game_key),
+                          time_ms=time_ms, should_stop=_cancel_checker(slot), stats=stats, moves=moves,
+                          on_progress=_progress_reporter(slot))
+    return move, stats.to_json()
+
+
+def run_root_split(cells: bytes, side: str, depth: int, moves: List[Move], time_ms: Optional[int],
+                   game_key, slot: int) -> Tuple[Optional[List[Tuple[float, Move]]], dict]:
+    """
+    在工作进程中搜索一份根着法，返回 (各着法得分, 搜索统计)；超时或被取消时得分为 None。
+    统计中的 replies 为各根着法之后置换表里对方的最佳应着（ICCS），供协调线程拼出主变例的前两步。
+    """
+    ctx = SearchContext(
+        tt=_table_for(game_key),
+        budget=SearchBudget(time_ms, should_stop=_cancel_checker(slot)),
+        orderer=MoveOrderer(CODE_VALUES),
+        stats=SearchStats(),
+        features=DEFAULT_FEATURES,
+    )
+    # 深度 1 必须完成，保证协调线程总有着法可选
+    ctx.budget.enforced = depth > 1
+    shared = _shared_alpha
+
+    def write_alpha(value):
+        # 非原子的读-改-写：并发时可能写入较小值，只会让剪枝变弱，不影响结果正确性
+        if value > shared[slot]:
+            shared[slot] = value
+
+    try:
+        results = search_root_moves(Position(cells), side, depth, moves, ctx,
+                                    (lambda: shared[slot], write_alpha) if shared is not None else None)
+    except SearchAborted:
+        results = None
+    ctx.stats.nodes = ctx.budget.nodes
+    out = ctx.stats.to_json()
+    if results is not None:
+        board = Position(cells)
+        out['replies'] = {}
+        for _, move in results:
+            undo = make_move(board, move[0], move[1])
+            reply = principal_variation(board, opponent(side), ctx.tt, 1)
+            unmake_move(board, undo)
+            if reply:
+                out['replies'][move_to_iccs(move)] = move_to_iccs(reply[0])
+    return results, out
+
+
+# ---------- 请求进程侧 ----------
+
+class BestMoveCache:
+    """已算出的最佳着法的 LRU 缓存：键为 (Zobrist 键（含走棋方）, 难度)，值为 (着法, 完成深度, 主变例 ICCS)。"""
+
+    def __init__(self, size: int = MOVE_CACHE_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key) -> Optional[Tuple[Move, int, Tuple[str, ...]]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, move: Move, depth: int, pv: Tuple[str, ...] = ()):
+        if self.size <= 0:
+            return
+        with self._lock:
+            old = self._entries.get(key)
+            # 同一局面保留更深的结果
+            if old is not None and old[1] > depth:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = (move, depth, tuple(pv))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SearchJob:
+    """一次 AI 搜索任务；result 为完成回调生成的响应内容，ponder 为取自预搜索时的方式（hit/continued）。"""
+
+    def __init__(self, game_id: str, difficulty: str, slot: int):
+        self.id = uuid.uuid4().hex
+        self.game_id = game_id
+        self.difficulty = difficulty
+        self.slot = slot
+        self.status = PENDING
+        self.move = None
+        self.stats = None
+        self.cache_key = None
+        self.result = None
+        self.error = None
+        self.progress = None
+        self.on_progress = None
+        self.ponder = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.future = None
+        self._done = threading.Event()
+        self._finished_callbacks = []
+        self._callbacks_lock = threading.Lock()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """等待任务结束；返回是否已结束。"""
+        return self._done.wait(timeout)
+
+    def add_finished_callback(self, fn: Callable[['SearchJob'], None]):
+        """任务结束（完成、取消或失败）后调用 fn(job)；已结束时立即调用。"""
+        with self._callbacks_lock:
+            if not self._done.is_set():
+                self._finished_callbacks.append(fn)
+                return
+        fn(self)
+
+    def _report_progress(self, depth: int, score: float, move: Move, nodes: int):
+        self.progress = {
+            'depth': depth,
+            'score': score,
+            'move': move_to_json(move) if move else None,
+            'nodes': nodes,
+            'elapsed_ms': round((time.time() - self.created_at) * 1000.0, 1),
+        }
+        if self.on_progress is not None:
+            self.on_progress(self, self.progress)
+
+    def _mark_finished(self):
+        with self._callbacks_lock:
+            self._done.set()
+            callbacks, self._finished_callbacks = self._finished_callbacks, []
+        for fn in callbacks:
+            fn(self)
+
+    def to_json(self, debug: bool = False) -> dict:
+        """debug 为真时附带 debug 块：搜索统计与排队/总耗时。"""
+        out = {'job_id': self.id, 'status': self.status}
+        if self.status == PENDING and self.progress:
+            out['progress'] = self.progress
+        if self.status == DONE and self.result:
+            out.update(self.result)
+        if self.error:
+            out['error'] = self.error
+        if debug and self.stats is not None and self.finished_at is not None:
+            out['debug'] = dict(self.stats, difficulty=self.difficulty,
+                                total_ms=round((self.finished_at - self.created_at) * 1000.0, 1))
+        return out
+
+
+class SearchPool:
+    """
+    步骤1：submit 检查该难度与全局的任务数，超限抛出 PoolBusy。
+    步骤2：把棋盘字节串交给进程池，完成后在回调线程里调用 on_done 生成结果。
+    步骤3：get/cancel 供轮询与取消；结束超过 JOB_RESULT_TTL 的任务会被清理。
+    """
+
+    def __init__(self, workers: int = POOL_WORKERS, limits: dict = None, max_queue: int = MAX_QUEUE_DEPTH):
+        self.workers = workers
+        self.limits = limits or MAX_JOBS_BY_DIFFICULTY
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._active = {}
+        self._next_slot = 0
+        self._executor = None
+        self._coordinator = None
+        self._cancel_flags = None
+        self._shared_alpha = None
+        self._progress_queue = None
+        self._slot_jobs = {}
+        self._ponders = {}  # game_id -> 本局最近一次预搜索（SearchJob，不对客户端可见）
+        self.move_cache = BestMoveCache()
+
+    def _ensure_executor(self):
+        if self._executor is not None:
+            return
+        if self.workers > 0:
+            ctx = multiprocessing.get_context('spawn')
+            self._cancel_flags = ctx.Array('b', CANCEL_SLOTS, lock=False)
+            self._shared_alpha = ctx.Array('d', CANCEL_SLOTS, lock=False)
+            self._progress_queue = ctx.Queue()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=ctx,
+                initializer=_init_worker, initargs=(self._cancel_flags, self._shared_alpha, self._progress_queue),
+            )
+            # 根节点拆分的协调线程：只做分发与汇总，不占 CPU
+            self._coordinator = ThreadPoolExecutor(max_workers=max(self.limits.values()))
+        else:
+            self._cancel_flags = bytearray(CANCEL_SLOTS)
+            self._progress_queue = queue.Queue()
+            _init_worker(self._cancel_flags, None, self._progress_queue)
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        threading.Thread(target=self._read_progress, args=(self._progress_queue,), daemon=True).start()
+
+    def warm_up(self):
+        """服务启动时调用：先拉起全部工作进程并等它们完成导入，进程启动不再占用第一步棋的思考时间。"""
+        with self._lock:
+            self._ensure_executor()
+        wait([self._executor.submit(_warm_up_worker) for _ in range(max(self.workers, 1))])
+
+    def _read_progress(self, progress_queue):
+        """读取线程：把各进程报告的进度交给对应槽位上仍在进行的任务；收到 None 时退出。"""
+        while True:
+            item = progress_queue.get()
+            if item is None:
+                return
+            slot, depth, score, move, nodes = item
+            job = self._slot_jobs.get(slot)
+            if job is None or job.status != PENDING:
+                continue
+            try:
+                job._report_progress(depth, score, move, nodes)
+            except Exception:  # 推送失败不影响搜索
+                pass
+
+    def _allocate_slot(self) -> int:
+        slot = self._next_slot
+        self._next_slot = (slot + 1) % CANCEL_SLOTS
+        self._cancel_flags[slot] = 0
+        return slot
+
+    def ponder_count(self) -> int:
+        """正在进行的预搜索数。"""
+        with self._lock:
+            return sum(1 for j in self._ponders.values() if j.status == PENDING)
+
+    def active_count(self, difficulty: str = None) -> int:
+        with self._lock:
+            if difficulty is None:
+                return sum(self._active.values())
+            return self._active.get(difficulty, 0)
+
+    def submit(
+        self,
+        game_id: str,
+        board: Position,
+        ai_color: str,
+        difficulty: str,
+        time_ms: Optional[int] = None,
+        on_done: Optional[Callable[[SearchJob], dict]] = None,
+        moves: Optional[List[Move]] = None,
+        on_progress: Optional[Callable[[SearchJob, dict], None]] = None,
+    ) -> SearchJob:
+        """
+        提交一次搜索。最佳着法缓存命中时不占用进程池、不受并发上限约束，任务立即完成
+        （on_done 会在当前线程中同步执行）。moves 为调用方已生成的合法着法，传入时不再重复生成；
+        on_progress(job, progress) 在读取线程中调用，每完成一层迭代加深一次。
+        """
+        if moves is None:
+            moves = all_legal_moves(board, ai_color)
+        cache_key = None
+        if difficulty not in UNCACHED_DIFFICULTIES and self.move_cache.size > 0:
+            cache_key = (position_key(board, ai_color), difficulty)
+        with self._lock:
+            pondered = self._ponders.pop(game_id, None)
+        ponder_hit = False
+        if pondered is not None and (pondered.status != PENDING or pondered.cache_key != cache_key):
+            # 猜错则停掉预搜索；猜中且已算完时结果已在最佳着法缓存里，下面直接命中
+            ponder_hit = pondered.status == DONE and pondered.cache_key == cache_key
+            metrics.PONDER.inc(result='hit' if ponder_hit else 'miss')
+            self._stop_ponder(pondered)
+            pondered = None
+        if cache_key is not None:
+            cached = self.move_cache.get(cache_key)
+            metrics.MOVE_CACHE.inc(result='hit' if cached else 'miss')
+            if cached is not None and cached[0] in moves:
+                return self._cached_job(game_id, difficulty, cached, on_done, 'hit' if ponder_hit else None)
+        with self._lock:
+            self._ensure_executor()
+            self._purge()
+            running = self._active.get(difficulty, 0)
+            if running >= self.limits.get(difficulty, self.max_queue) or sum(self._active.values()) >= self.max_queue:
+                if pondered is not None:
+                    self._stop_ponder(pondered)
+                raise PoolBusy(difficulty)
+            # 猜中且仍在搜索：接管这次预搜索（沿用其槽位与 future），进度从此转给新任务
+            slot = pondered.slot if pondered is not None else self._allocate_slot()
+            job = SearchJob(game_id, difficulty, slot)
+            job.cache_key = cache_key
+            job.on_progress = on_progress
+            self._jobs[job.id] = job
+            self._slot_jobs[slot] = job
+            self._active[difficulty] = running + 1
+            split = ROOT_SPLIT_BY_DIFFICULTY.get(difficulty, 1)
+            if pondered is not None:
+                metrics.PONDER.inc(result='continued')
+                job.ponder = 'continued'
+                job.future = pondered.future
+            elif split > 1 and self._coordinator is not None:
+                job.future = self._coordinator.submit(
+                    self._root_split_move, board.copy(), ai_color, difficulty, split, time_ms, (game_id, ai_color), slot,
+                    moves)
+            else:
+                job.future = self._executor.submit(
+                    run_search, bytes(board.cells), ai_color, difficulty, time_ms, (game_id, ai_color), slot, moves)
+        job.future.add_done_callback(lambda f: self._finish(job, f, on_done))
+        return job
+
+    def _cached_job(self, game_id: str, difficulty: str, cached: Tuple[Move, int, Tuple[str, ...]], on_done,
+                    ponder: Optional[str] = None) -> SearchJob:
+        with self._lock:
+            self._ensure_executor()
+            self._purge()
+            job = SearchJob(game_id, difficulty, self._allocate_slot())
+            job.ponder = ponder
+            self._jobs[job.id] = job
+            self._active[difficulty] = self._active.get(difficulty, 0) + 1
+        stats = SearchStats()
+        stats.depth = cached[1]
+        job.future = Future()
+        job.future.add_done_callback(lambda f: self._finish(job, f, on_done))
+        # 带上缓存的主变例，命中后仍能预搜索对方的应着
+        job.future.set_result((cached[0], dict(stats.to_json(), cache_hit=True, pv=list(cached[2]))))
+        return job
+
+    def _root_split_move(self, board, ai_color, difficulty, split, time_ms, game_key, slot,
+                         moves=None) -> Tuple[Optional[Move], dict]:
+        stats = SearchStats()
+        move, _ = self.root_split_search(board, ai_color, difficulty, split, time_ms, game_key=game_key, slot=slot,
+                                         stats=stats, moves=moves)
+        return move, dict(stats.to_json(), root_split=split)
+
+    def root_split_search(
+        self,
+        board: Position,
+        ai_color: str,
+        difficulty: str,
+        split: int,
+        time_ms: Optional[int] = None,
+        max_depth: Optional[int] = None,
+        game_key=None,
+        slot: Optional[int] = None,
+        stats: Optional[SearchStats] = None,
+        moves: Optional[List[Move]] = None,
+    ) -> Tuple[Optional[Move], int]:
+        """
+        根节点拆分的迭代加深（在协调线程中运行）。
+        步骤1：每轮把按上一轮得分排好序的根着法轮流分成 split 份，交给不同进程搜索。
+        步骤2：全部完成则按得分重排根着法并记下最佳着法；超时或被取消则放弃本轮。
+        步骤3：返回最后一个完整轮次的最佳着法与深度。
+        传入 stats 时累加各进程的计数（含被放弃的轮次），每轮的主变例只有根着法与对方的应着。moves 为已生成的合法着法。
+        """
+        with self._lock:
+            self._ensure_executor()
+            if slot is None:
+                slot = self._allocate_slot()
+        limits = SEARCH_LIMITS_BY_DIFFICULTY.get(difficulty, SEARCH_LIMITS_BY_DIFFICULTY['normal'])
+        if time_ms is None:
+            time_ms = limits['time_ms']
+        if max_depth is None:
+            max_depth = limits['max_depth']
+        if game_key is None:
+            game_key = uuid.uuid4().hex
+        order = list(moves) if moves is not None else all_legal_moves(board, ai_color)
+        if not order:
+            return None, 0
+        cells = bytes(board.cells)
+        start = time.time()
+        deadline = start + time_ms / 1000.0 if time_ms else None
+        best, completed = None, 0
+        for depth in range(1, max_depth + 1):
+            if self._cancel_flags[slot]:
+                break
+            self._shared_alpha[slot] = -1e9
+            remaining_ms = None
+            if deadline is not None and depth > 1:
+                remaining_ms = max(1, int((deadline - time.time()) * 1000))
+            futures = [
+                self._executor.submit(run_root_split, cells, ai_color, depth, order[i::split], remaining_ms, game_key, slot)
+                for i in range(min(split, len(order)))
+            ]
+            iteration_start = time.time()
+            done, not_done = wait(futures, timeout=remaining_ms / 1000.0 + 0.05 if remaining_ms else None)
+            outputs = [f.result() for f in done if not f.cancelled() and f.exception() is None]
+            iteration_nodes = 0
+            replies = {}
+            for _, part in outputs:
+                replies.update(part.get('replies') or {})
+            if stats is not None:
+                for _, part in outputs:
+                    iteration_nodes += part['nodes']
+                    stats.nodes += part['nodes']
+                    stats.qnodes += part['qnodes']
+                    stats.cutoffs += part['cutoffs']
+                    stats.tt_probes += part['tt_probes']
+                    stats.tt_hits += part['tt_hits']
+                    stats.null_cutoffs += part['null_cutoffs']
+                    stats.reductions += part['reductions']
+                    stats.researches += part['researches']
+            results = [r for r, _ in outputs]
+            if not_done or len(results) < len(futures) or any(r is None for r in results):
+                # 本轮未完成：让仍在搜索的进程尽快停下
+                self._cancel_flags[slot] = 1
+                for f in not_done:
+                    f.cancel()
+                break
+            scored = sorted((item for r in results for item in r), key=lambda x: -x[0])
+            order = [m for _, m in scored]
+            best, completed = order[0], depth
+            if self._progress_queue is not None:
+                self._progress_queue.put((slot, depth, scored[0][0], best, iteration_nodes))
+            if stats is not None:
+                pv = [move_to_iccs(best)]
+                if pv[0] in replies:
+                    pv.append(replies[pv[0]])
+                stats.depth = depth
+                stats.iterations.append({
+                    'depth': depth,
+                    'score': scored[0][0],
+                    'nodes': iteration_nodes,
+                    'ms': round((time.time() - iteration_start) * 1000.0, 1),
+                    'pv': pv,
+                })
+            if deadline is not None and (time.time() - start) * 2 >= deadline - start:
+                break
+        if best is None:
+            best = random.choice(order)
+        if stats is not None:
+            stats.elapsed_ms = (time.time() - start) * 1000.0
+        return best, completed
+
+    def _finish(self, job: SearchJob, future: Future, on_done):
+        with self._lock:
+            self._active[job.difficulty] -= 1
+            if self._slot_jobs.get(job.slot) is job:
+                del self._slot_jobs[job.slot]
+        if job.status != CANCELLED and not future.cancelled():
+            try:
+                job.move, job.stats = future.result()
+                if job.ponder:
+                    job.stats = dict(job.stats, ponder=job.ponder)
+                if job.cache_key is not None and job.move is not None and job.stats.get('depth'):
+                    self.move_cache.put(job.cache_key, job.move, job.stats['depth'], job.stats.get('pv', ()))
+                if on_done is not None:
+                    job.result = on_done(job)
+                job.status = DONE
+            except Exception as e:  # 搜索进程崩溃或结果无法应用
+                job.status = FAILED
+                job.error = str(e)
+        else:
+            job.status = CANCELLED
+        job.finished_at = time.time()
+        metrics.observe_search(job.difficulty, job.status, job.finished_at - job.created_at, job.stats)
+        job._mark_finished()
+
+    def ponder(
+        self,
+        game_id: str,
+        board: Position,
+        reply: Move,
+        ai_color: str,
+        difficulty: str,
+        time_ms: Optional[int] = None,
+    ) -> Optional[SearchJob]:
+        """
+        对方思考期间的预搜索：假定对方走 reply，在后台搜索之后的局面，结果写入最佳着法缓存。
+        步骤1：难度不预搜索、缓存关闭、reply 不合法、局面已有缓存或预搜索数已达 MAX_PONDER_JOBS 时放弃，返回 None。
+        步骤2：停掉本局之前的预搜索，提交一次单进程搜索（不计入各难度的任务上限，时间预算见 PONDER_TIME_MS）。
+        真正的着法到来时由 submit 处理：猜中且已算完则命中缓存，猜中但仍在搜索则接管这次搜索，猜错则停掉。
+        """
+        if difficulty not in PONDER_DIFFICULTIES or self.move_cache.size <= 0 or MAX_PONDER_JOBS <= 0:
+            return None
+        if reply not in all_legal_moves(board, opponent(ai_color)):
+            return None
+        after = board.copy()
+        make_move(after, reply[0], reply[1])
+        moves = all_legal_moves(after, ai_color)
+        cache_key = (position_key(after, ai_color), difficulty)
+        if not moves or self.move_cache.get(cache_key) is not None:
+            return None
+        with self._lock:
+            previous = self._ponders.pop(game_id, None)
+        if previous is not None:
+            self._stop_ponder(previous)
+        with self._lock:
+            self._ensure_executor()
+            self._purge()
+            if sum(1 for j in self._ponders.values() if j.status == PENDING) >= MAX_PONDER_JOBS:
+                metrics.PONDER.inc(result='skipped')
+                return None
+            slot = self._allocate_slot()
+            job = SearchJob(game_id, difficulty, slot)
+            job.cache_key = cache_key
+            self._ponders[game_id] = job
+            self._slot_jobs[slot] = job
+            job.future = self._executor.submit(
+                run_search, bytes(after.cells), ai_color, difficulty, PONDER_TIME_MS or time_ms, (game_id, ai_color),
+                slot, moves)
+        job.future.add_done_callback(lambda f: self._finish_ponder(job, f))
+        return job
+
+    def _finish_ponder(self, job: SearchJob, future: Future):
+        with self._lock:
+            if self._slot_jobs.get(job.slot) is job:
+                del self._slot_jobs[job.slot]
+        if job.status == CANCELLED or future.cancelled():
+            job.status = CANCELLED
+        elif future.exception() is not None:
+            job.status = FAILED
+            job.error = str(future.exception())
+        else:
+            job.move, job.stats = future.result()
+            if job.move is not None and job.stats.get('depth'):
+                self.move_cache.put(job.cache_key, job.move, job.stats['depth'], job.stats.get('pv', ()))
+            job.status = DONE
+        job.finished_at = time.time()
+        job._mark_finished()
+
+    def _stop_ponder(self, job: SearchJob):
+        if job.status == PENDING:
+            job.status = CANCELLED
+            self._cancel_flags[job.slot] = 1
+            job.future.cancel()
+
+    def cancel_ponder(self, game_id: str):
+        """停掉本局的预搜索（对局结束或不再轮到 AI 时）。"""
+        with self._lock:
+            job = self._ponders.pop(game_id, None)
+        if job is not None:
+            self._stop_ponder(job)
+
+    def get(self, job_id: str) -> Optional[SearchJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[SearchJob]:
+        """取消任务：未开始的直接撤出队列，已开始的置位取消标志。"""
+        job = self.get(job_id)
+        if job is None or job.status != PENDING:
+            return job
+        job.status = CANCELLED
+        self._cancel_flags[job.slot] = 1
+        job.future.cancel()
+        return job
+
+    def _purge(self):
+        now = time.time()
+        for job_id in [j.id for j in self._jobs.values()
+                       if j.finished_at is not None and now - j.finished_at > JOB_RESULT_TTL]:
+            del self._jobs[job_id]
+        for game_id in [g for g, j in self._ponders.items()
+                        if j.finished_at is not None and now - j.finished_at > JOB_RESULT_TTL]:
+            del self._ponders[game_id]
+
+    def shutdown(self):
+        if self._coordinator is not None:
+            self._coordinator.shutdown(wait=False, cancel_futures=True)
+            self._coordinator = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self._progress_queue is not None:
+            self._progress_queue.put(None)
+            self._progress_queue = None
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> SearchPool:
+    """进程内共享的搜索池，第一次使用时才创建工作进程。"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SearchPool()
+        return _pool
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""批量自对弈：两套 AI 配置（难度、思考时间、棋子价值）在多个进程中并行对局，用于调参与产生负载。
+
+每局结束后以历史记录的紧凑格式（起始局面 + 着法）写入单独的数据库，最后汇总 A 方的胜/和/负率与 Elo 差（95% 置信区间）。
+两方轮流执红；开局先随机走若干步，避免同样的配置反复下出同一盘棋。
+
+用法：python selfplay.py --games 200 --a hard --b hell --time-ms 200 --workers 4
+      python selfplay.py --games 400 --a hard --b hard --a-values rook=100,cannon=48 --json result.json
+      python selfplay.py --games 400 --a hell --b hell --time-ms 500 --a-features -lmr
+"""
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+
+from chess_engine import (
+    Position,
+    all_legal_moves,
+    make_move,
+    is_king_attacked,
+    board_from_fen,
+    opponent,
+    set_score_table,
+    INITIAL_FEN,
+    RED,
+    BLACK,
+)
+from ai_engine import ai_choose_move, build_score_table, parse_features, PIECE_VALUES, DEFAULT_FEATURES
+from transposition import TranspositionTable
+
+SELFPLAY_DB = os.path.join(os.path.dirname(__file__), 'data', 'selfplay.db')
+
+# 超过该步数仍未分胜负的对局判和（引擎不检测重复局面）
+DEFAULT_MAX_PLIES = 300
+
+
+class EngineConfig:
+    """一方 AI 的配置：难度、单步思考时间（毫秒，None 为难度默认值）、棋子价值覆盖与启用的选择性搜索技术。"""
+
+    def __init__(self, name: str, difficulty: str, time_ms: Optional[int] = None,
+                 piece_values: Optional[Dict[str, int]] = None, features: Optional[Tuple[str, ...]] = None):
+        self.name = name
+        self.difficulty = difficulty
+        self.time_ms = time_ms
+        self.features = DEFAULT_FEATURES if features is None else tuple(features)
+        self.piece_values = dict(PIECE_VALUES, **(piece_values or {}))
+        self.score_table = build_score_table(self.piece_values)
+
+    def to_json(self) -> dict:
+        return {'name': self.name, 'difficulty': self.difficulty, 'time_ms': self.time_ms,
+                'piece_values': self.piece_values, 'features': list(self.features)}
+
+
+def parse_piece_values(text: str) -> Dict[str, int]:
+    """'rook=100,cannon=48' -> {'rook': 100, 'cannon': 48}。"""
+    values = {}
+    for part in filter(None, (p.strip() for p in (text or '').split(','))):
+        name, _, value = part.partition('=')
+        if name not in PIECE_VALUES:
+            raise ValueError('unknown piece: %s' % name)
+        values[name] = int(value)
+    return values
+
+
+def play_game(a: EngineConfig, b: EngineConfig, a_color: str, seed: int, random_plies: int,
+              max_plies: int, fen: str = INITIAL_FEN) -> dict:
+    """
+    下一局。
+    步骤1：从 fen 开局，先随机走 random_plies 步。
+    步骤2：双方各用自己的置换表与评估表轮流调用 ai_choose_move；评估表是进程级的，每步前切换并在新棋盘上重算评估分。
+    步骤3：无着可走时按将死/困毙判定，超过 max_plies 判和。结束后恢复默认评估表。
+    """
+    rng = random.Random(seed)
+    random.seed(seed)  # ai_choose_move 在同分着法与兜底时使用全局随机数
+    board, side = board_from_fen(fen)
+    start = board.copy()
+    moves = []
+    engines = {a_color: a, opponent(a_color): b}
+    tables = {RED: TranspositionTable(), BLACK: TranspositionTable()}
+    winner, reason = None, 'max_plies'
+    started = time.perf_counter()
+    try:
+        while len(moves) < max_plies:
+            legal = all_legal_moves(board, side)
+            if not legal:
+                if is_king_attacked(board, side):
+                    winner, reason = opponent(side), 'checkmate'
+                else:
+                    winner, reason = 'draw', 'stalemate'
+                break
+            if len(moves) < random_plies:
+                move = rng.choice(legal)
+            else:
+                engine = engines[side]
+                set_score_table(engine.score_table)
+                move = ai_choose_move(Position(board.cells), side, engine.difficulty, tables[side],
+                                      time_ms=engine.time_ms, moves=legal, features=engine.features)
+            make_move(board, move[0], move[1])
+            moves.append(move)
+            side = opponent(side)
+    finally:
+        set_score_table(build_score_table())
+    if winner is None:
+        winner = 'draw'
+    return {
+        'seed': seed,
+        'a_color': a_color,
+        'winner': winner,
+        'reason': reason,
+        'plies': len(moves),
+        'seconds': round(time.perf_counter() - started, 2),
+        'start': bytes(start.cells),
+        'moves': moves,
+    }
+
+
+def _play_game_task(args) -> dict:
+    return play_game(*args)
+
+
+def a_score(result: dict) -> float:
+    """A 方本局得分：胜 1、和 0.5、负 0。"""
+    if result['winner'] == 'draw':
+        return 0.5
+    return 1.0 if result['winner'] == result['a_color'] else 0.0
+
+
+def elo_from_score(score: float) -> float:
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400.0 * math.log10(1.0 / score - 1.0) + 0.0
+
+
+def summarize(results: List[dict]) -> dict:
+    """
+    A 方视角的胜/和/负与 Elo 差。
+    步骤1：平均得分 s 换算 Elo：-400·log10(1/s - 1)。
+    步骤2：每局得分的样本方差给出 s 的标准误，s ± 1.96·标准误 换算出 95% 置信区间。
+    """
+    n = len(results)
+    if not n:
+        return {'games': 0}
+    scores = [a_score(r) for r in results]
+    wins = scores.count(1.0)
+    draws = scores.count(0.5)
+    losses = n - wins - draws
+    mean = sum(scores) / n
+    stderr = math.sqrt(sum((s - mean) ** 2 for s in scores) / n / n)
+    reasons = {}
+    for r in results:
+        reasons[r['reason']] = reasons.get(r['reason'], 0) + 1
+    return {
+        'games': n,
+        'wins': wins,
+        'draws': draws,
+        'losses': losses,
+        'win_rate': round(wins / n, 4),
+        'draw_rate': round(draws / n, 4),
+        'loss_rate': round(losses / n, 4),
+        'score': round(mean, 4),
+        'elo': round(elo_from_score(mean), 1),
+        'elo_95': [round(elo_from_score(mean - 1.96 * stderr), 1), round(elo_from_score(mean + 1.96 * stderr), 1)],
+        'reasons': reasons,
+        'avg_plies': round(sum(r['plies'] for r in results) / n, 1),
+        'avg_seconds': round(sum(r['seconds'] for r in results) / n, 2),
+    }
+
+
+def run_match(a: EngineConfig, b: EngineConfig, games: int, workers: int, seed: int = 0,
+              random_plies: int = 4, max_plies: int = DEFAULT_MAX_PLIES, fen: str = INITIAL_FEN,
+              db: Optional[str] = SELFPLAY_DB, log=print) -> Tuple[List[dict], dict]:
+    """
+    并行下 games 局，A 方在偶数局执红、奇数局执黑；每局结束即写入 db（None 为不保存）。
+    workers 为 0 时在当前进程内逐局下（调试用）。返回 (各局结果, 汇总)。
+    """
+    tasks = [(a, b, RED if i % 2 == 0 else BLACK, seed + i, random_plies, max_plies, fen) for i in range(games)]
+    if db:
+        from history_store import add_record
+    results = []
+    started = time.perf_counter()
+    pool = None
+    if workers > 0:
+        pool = multiprocessing.get_context('spawn').Pool(workers)
+        iterator = pool.imap_unordered(_play_game_task, tasks)
+    else:
+        iterator = map(_play_game_task, tasks)
+    try:
+        for result in iterator:
+            results.append(result)
+            if db:
+                add_record(
+                    winner=result['winner'],
+                    difficulty='%s/%s' % ((a.name, b.name) if result['a_color'] == RED else (b.name, a.name)),
+                    moves_count=result['plies'],
+                    start=Position(result['start']),
+                    moves=result['moves'],
+                    red_is_ai=True,
+                    db=db,
+                )
+            if log:
+                log('game %d/%d: A as %s, %s by %s in %d plies (%.1fs)' % (
+                    len(results), games, result['a_color'], result['winner'], result['reason'],
+                    result['plies'], result['seconds']))
+    finally:
+        if pool is not None:
+            pool.terminate()
+    summary = summarize(results)
+    wall = time.perf_counter() - started
+    summary['wall_seconds'] = round(wall, 1)
+    summary['games_per_minute'] = round(len(results) * 60.0 / wall, 1)
+    return results, summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='xiangqi batch self-play')
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--a', default='hard', help='A 方难度')
+    parser.add_argument('--b', default='hard', help='B 方难度')
+    parser.add_argument('--time-ms', type=int, help='双方单步思考时间（毫秒），默认按难度')
+    parser.add_argument('--a-time-ms', type=int, help='只覆盖 A 方的思考时间')
+    parser.add_argument('--b-time-ms', type=int, help='只覆盖 B 方的思考时间')
+    parser.add_argument('--a-values', default='', help='A 方棋子价值覆盖，如 rook=100,cannon=48')
+    parser.add_argument('--b-values', default='', help='B 方棋子价值覆盖')
+    parser.add_argument('--a-features', default='all', help='A 方启用的选择性搜索技术，如 none、pvs,lmr、-null_move')
+    parser.add_argument('--b-features', default='all', help='B 方启用的选择性搜索技术')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='对局进程数，0 为当前进程')
+    parser.add_argument('--random-plies', type=int, default=4, help='开局随机走的步数')
+    parser.add_argument('--max-plies', type=int, default=DEFAULT_MAX_PLIES)
+    parser.add_argument('--fen', default=INITIAL_FEN, help='起始局面')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--db', default=SELFPLAY_DB, help='对局写入的数据库，"" 为不保存')
+    parser.add_argument('--json', help='汇总写入的文件')
+    args = parser.parse_args()
+
+    a = EngineConfig('A:' + args.a, args.a, args.a_time_ms or args.time_ms, parse_piece_values(args.a_values),
+                     parse_features(args.a_features))
+    b = EngineConfig('B:' + args.b, args.b, args.b_time_ms or args.time_ms, parse_piece_values(args.b_values),
+                     parse_features(args.b_features))
+    _, summary = run_match(a, b, args.games, args.workers, args.seed, args.random_plies, args.max_plies, args.fen,
+                           args.db or None)
+    summary['a'], summary['b'] = a.to_json(), b.to_json()
+    print('A %s vs B %s: +%d =%d -%d, score %.3f, Elo %+.1f [%+.1f, %+.1f], %.1f games/min' % (
+        args.a, args.b, summary['wins'], summary['draws'], summary['losses'], summary['score'],
+        summary['elo'], summary['elo_95'][0], summary['elo_95'][1], summary['games_per_minute']))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""对局会话存储：进程内 LRU/TTL 或多进程共享的 SQLite。
+
+对局字典（见 app.games）序列化为紧凑 JSON：棋盘与起始局面各 90 字节、着法每步 2 字节、被吃棋子每步 1 字节，均以 base64 保存；
+当前走棋方的合法着法缓存（legal）一并保存，共享后端取出对局后不必重新生成。
+由环境变量 GAME_STORE 选择后端：memory（默认）或 sqlite:<路径>。
+SQLite 后端按版本号乐观写回：get 把读到的版本记在对局的 rev 中，put 只在库中版本未变时写入，否则抛出 SessionConflict。
+AI 任务与事件流只存在于创建它们的进程中，多个进程共享 SQLite 后端时须按对局 id 做粘性路由。
+"""
+
+import base64
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from chess_engine import Position
+from replay import encode_moves, decode_moves
+from wire_format import replay_captures
+
+# 对局闲置多久后过期（秒）
+SESSION_TTL = int(os.environ.get('GAME_SESSION_TTL', str(6 * 3600)))
+# 进程内后端最多保留的对局数，超出时淘汰最久未访问的
+MAX_SESSIONS = int(os.environ.get('GAME_MAX_SESSIONS', '10000'))
+# SQLite 后端两次清理过期对局的最短间隔（秒）
+PURGE_INTERVAL = 60
+# SQLite 后端读取时，过期时间比“现在 + TTL”早至少这么多秒才顺延，避免每次读取都写库
+TOUCH_INTERVAL = 300
+
+
+class SessionConflict(Exception):
+    """共享后端写回时对局已被其他请求或进程改过（或已过期清除），调用方应返回 409。"""
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode('ascii')
+
+
+def dump_game(g: dict) -> bytes:
+    """对局字典序列化为紧凑字节串。"""
+    legal = g.get('legal')
+    return json.dumps({
+        'b': _b64(bytes(g['board'].cells)),
+        's': _b64(bytes(g['start'].cells)),
+        'm': _b64(encode_moves(g['move_list'])),
+        'c': _b64(bytes(g['captures'])),
+        't': g['turn'],
+        'd': g['difficulty'],
+        'r': g['red_is_ai'],
+        'n': g['moves_count'],
+        'j': g.get('ai_job'),
+        'l': [legal['ply'], _b64(encode_moves(legal['moves'])), legal['in_check'], legal['key']] if legal else None,
+    }, separators=(',', ':')).encode('utf-8')
+
+
+def _b64_len(n: int) -> int:
+    return (n + 2) // 3 * 4
+
+
+# dump_game 中除 base64 字段外的固定部分（键名、走棋方、难度、步数、任务 id、局面键等）的大致字节数
+_DUMP_OVERHEAD = 145
+
+
+def estimate_dump_size(g: dict) -> int:
+    """dump_game 结果长度的 O(1) 估计（不实际序列化）：两个棋盘、每步 2 字节着法与 1 字节吃子、合法着法缓存。"""
+    plies = len(g['move_list'])
+    legal = g.get('legal')
+    size = _DUMP_OVERHEAD + 2 * _b64_len(90) + _b64_len(2 * plies) + _b64_len(plies)
+    if legal:
+        size += _b64_len(2 * len(legal['moves']))
+    return size
+
+
+def load_game(data: bytes) -> dict:
+    """dump_game 的逆操作；没有吃子记录的旧会话从起始局面重走补全。"""
+    d = json.loads(data)
+    legal = d.get('l')
+    start = Position(base64.b64decode(d['s']))
+    move_list = decode_moves(base64.b64decode(d['m']))
+    return {
+        'board': Position(base64.b64decode(d['b'])),
+        'turn': d['t'],
+        'difficulty': d['d'],
+        'red_is_ai': d['r'],
+        'moves_count': d['n'],
+        'start': start,
+        'move_list': move_list,
+        'captures': list(base64.b64decode(d['c'])) if 'c' in d else replay_captures(start, move_list),
+        'ai_job': d.get('j'),
+        'legal': {
+            'ply': legal[0],
+            'moves': decode_moves(base64.b64decode(legal[1])),
+            'in_check': legal[2],
+            'key': legal[3],
+        } if legal else None,
+    }
+
+
+class MemorySessionStore:
+    """
+    进程内后端：直接保存对局字典（get 返回同一对象，原地修改后 put 只刷新访问时间）。
+    步骤1：按访问顺序维护 OrderedDict，最久未访问的在最前。
+    步骤2：每次访问时从最前端淘汰过期对局；数量超过 max_sessions 时淘汰最前端的。
+    """
+
+    shared = False
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, ttl: int = SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.evictions = 0
+        self._sessions = OrderedDict()  # game_id -> (game, last_access, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _evict_expired(self, now: float):
+        while self._sessions:
+            game_id, (_, last_access, size) = next(iter(self._sessions.items()))
+            if now - last_access < self.ttl and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[game_id]
+            self._bytes -= size
+            self.evictions += 1
+
+    def get(self, game_id: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            self._evict_expired(now)
+            entry = self._sessions.get(game_id)
+            if entry is None:
+                return None
+            self._sessions[game_id] = (entry[0], now, entry[2])
+            self._sessions.move_to_end(game_id)
+            return entry[0]
+
+    def put(self, game_id: str, g: dict):
+        # 大小按序列化后的字节数估算（与共享后端的口径一致），不在每次走子时真的序列化
+        size = estimate_dump_size(g)
+        now = time.time()
+        with self._lock:
+            old = self._sessions.pop(game_id, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._sessions[game_id] = (g, now, size)
+            self._bytes += size
+            self._evict_expired(now)
+
+    def delete(self, game_id: str):
+        with self._lock:
+            old = self._sessions.pop(game_id, None)
+            if old is not None:
+                self._bytes -= old[2]
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                'backend': 'memory',
+                'live_sessions': len(self._sessions),
+                'evictions': self.evictions,
+                'bytes_held': self._bytes,
+            }
+
+
+class SQLiteSessionStore:
+    """
+    共享后端：多个服务进程读写同一个 SQLite 文件（WAL 模式），任一进程创建的对局在其他进程也能取到。
+    get 每次从库中反序列化出新的字典（rev 为读到的版本），修改后必须 put 写回；读取时过期时间落后 TOUCH_INTERVAL 以上才顺延。
+    同一进程内 app.games_lock 串行化读改写，跨进程靠版本号：两个进程基于同一版本各自写回时，后写的得到 SessionConflict。
+    AI 任务与事件流仍只在创建它们的进程里，负载均衡须按对局 id 粘性路由。
+    """
+
+    shared = True
+
+    def __init__(self, path: str, ttl: int = SESSION_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.evictions = 0
+        self._local = threading.local()
+        self._last_purge = 0.0
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            d = os.path.dirname(self.path)
+            if d and not os.path.isdir(d):
+                os.makedirs(d, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS sessions ('
+                'id TEXT PRIMARY KEY, data BLOB NOT NULL, expires_at REAL NOT NULL, rev INTEGER NOT NULL DEFAULT 0)'
+            )
+            if 'rev' not in [row[1] for row in conn.execute('PRAGMA table_info(sessions)')]:
+                try:
+                    conn.execute('ALTER TABLE sessions ADD COLUMN rev INTEGER NOT NULL DEFAULT 0')
+                except sqlite3.OperationalError:  # 另一个进程刚加上
+                    pass
+            conn.execute('CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at)')
+            self._local.conn = conn
+        return conn
+
+    def _purge(self, now: float):
+        if now - self._last_purge < PURGE_INTERVAL:
+            return
+        self._last_purge = now
+        cur = self._conn().execute('DELETE FROM sessions WHERE expires_at < ?', (now,))
+        self.evictions += cur.rowcount
+
+    def get(self, game_id: str) -> Optional[dict]:
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute(
+            'SELECT data, rev, expires_at FROM sessions WHERE id = ? AND expires_at >= ?', (game_id, now)).fetchone()
+        if row is None:
+            return None
+        data, rev, expires_at = row
+        if now + self.ttl - expires_at >= TOUCH_INTERVAL:
+            conn.execute('UPDATE sessions SET expires_at = ? WHERE id = ?', (now + self.ttl, game_id))
+        g = load_game(data)
+        g['rev'] = rev
+        return g
+
+    def put(self, game_id: str, g: dict):
+        """
+        步骤1：新对局（没有 rev）直接插入。
+        步骤2：否则只在库中版本仍是读到的 rev 时写入并把版本加一；没有更新任何行即抛出 SessionConflict。
+        """
+        now = time.time()
+        conn = self._conn()
+        rev = g.get('rev')
+        if rev is None:
+            conn.execute('INSERT INTO sessions (id, data, expires_at, rev) VALUES (?, ?, ?, 0)',
+                         (game_id, dump_game(g), now + self.ttl))
+            g['rev'] = 0
+        else:
+            cur = conn.execute('UPDATE sessions SET data = ?, expires_at = ?, rev = rev + 1 WHERE id = ? AND rev = ?',
+                               (dump_game(g), now + self.ttl, game_id, rev))
+            if cur.rowcount == 0:
+                raise SessionConflict(game_id)
+            g['rev'] = rev + 1
+        self._purge(now)
+
+    def delete(self, game_id: str):
+        self._conn().execute('DELETE FROM sessions WHERE id = ?', (game_id,))
+
+    def metrics(self) -> dict:
+        count, size = self._conn().execute(
+            'SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM sessions WHERE expires_at >= ?',
+            (time.time(),)).fetchone()
+        return {
+            'backend': 'sqlite',
+            'live_sessions': count,
+            'evictions': self.evictions,
+            'bytes_held': size,
+        }
+
+
+def create_store(spec: Optional[str] = None):
+    """按 spec（默认取环境变量 GAME_STORE）创建会话存储：'memory' 或 'sqlite:<路径>'。"""
+    spec = spec or os.environ.get('GAME_STORE', 'memory')
+    if spec == 'memory':
+        return MemorySessionStore()
+    if spec.startswith('sqlite:'):
+        return SQLiteSessionStore(spec[len('sqlite:'):])
+    raise ValueError('unknown GAME_STORE: %s' % spec)
@@ -5,6 +5,9 @@
   const API_BASE = '';
   const RED = 'red';
   const BLACK = 'black';
+  // 紧凑线格式：全量为 FEN，之后每步只收增量 [ICCS, 走动棋子, 被吃棋子, 局面键]
+  const COMPACT = 'application/vnd.xiangqi.v1+json';
+  const FEN_TYPES = { k: 'king', a: 'advisor', b: 'elephant', e: 'elephant', n: 'horse', h: 'horse', r: 'rook', c: 'cannon', p: 'pawn' };
 
   const PIECE_CHAR = {
     red: { king: '帅', advisor: '仕', elephant: '相', horse: '马', rook: '车', cannon: '炮', pawn: '兵' },
@@ -19,6 +22,9 @@
     redIsAi: false,
     selected: null,
     legalMoves: [],
+    serverMoves: null,
+    movesCount: 0,
+    events: null,
     gameOver: false,
     winner: null,
   };
@@ -39,6 +45,77 @@
     } catch (_) {}
   }
 
+  function api(path, options) {
+    const opts = Object.assign({}, options);
+    opts.headers = Object.assign({ Accept: COMPACT }, opts.headers);
+    return fetch(API_BASE + path, opts);
+  }
+
+  function pieceFromLetter(ch) {
+    const lower = ch.toLowerCase();
+    return { type: FEN_TYPES[lower], color: ch === lower ? BLACK : RED };
+  }
+
+  function parseFen(fen) {
+    const [placement, side] = fen.split(' ');
+    const board = placement.split('/').map(row => {
+      const cells = [];
+      for (const ch of row) {
+        if (ch >= '1' && ch <= '9') for (let i = 0; i < +ch; i++) cells.push(null);
+        else cells.push(pieceFromLetter(ch));
+      }
+      return cells;
+    });
+    return { board, turn: side === 'b' ? BLACK : RED };
+  }
+
+  // ICCS 着法（如 h2e2）转为 [行, 列] 的起点与终点
+  function parseIccs(text) {
+    const sq = i => [9 - (+text[i + 1]), text.charCodeAt(i) - 97];
+    return [sq(0), sq(2)];
+  }
+
+  // 应用一条紧凑状态消息；返回是否推进了棋盘。增量与本地步数接不上时改取全量
+  function applyWire(msg) {
+    if (msg.fen) {
+      if (msg.ply < state.movesCount) return false;
+      state.board = parseFen(msg.fen).board;
+    } else {
+      if (msg.since > state.movesCount) {
+        refreshGame(state.gameId);
+        return false;
+      }
+      if (msg.ply <= state.movesCount) return false;
+      msg.d.forEach(([iccs, piece], k) => {
+        if (msg.since + k + 1 <= state.movesCount) return;
+        const [[fr, fc], [tr, tc]] = parseIccs(iccs);
+        state.board[tr][tc] = pieceFromLetter(piece);
+        state.board[fr][fc] = null;
+      });
+    }
+    state.turn = msg.turn;
+    state.movesCount = msg.ply;
+    if (msg.game_over) {
+      state.gameOver = true;
+      state.winner = msg.winner;
+    }
+    return true;
+  }
+
+  // 取全量局面（断线后步数对不上时）；服务端带 ETag，未变化时浏览器缓存直接返回
+  function refreshGame(gameId) {
+    api('/api/game/' + gameId)
+      .then(res => res.json())
+      .then(data => {
+        if (gameId !== state.gameId || data.error) return;
+        state.movesCount = -1;
+        applyWire(data);
+        renderBoard();
+        getLegalMovesFromServer();
+      })
+      .catch(() => {});
+  }
+
   const boardEl = document.getElementById('board');
   const statusEl = document.getElementById('status');
   const difficultyEl = document.getElementById('difficulty');
@@ -49,21 +126,25 @@
   const historyList = document.getElementById('historyList');
   const btnCloseHistory = document.getElementById('btnCloseHistory');
 
+  // 取当前走棋方的全部合法着法（服务端按步缓存），用于高亮；取到之前退回本地的粗略走法
   function getLegalMovesFromServer() {
-    if (!state.gameId || !state.board || state.gameOver) return [];
-    const side = state.turn;
-    const moves = [];
-    for (let r = 0; r < 10; r++) {
-      for (let c = 0; c < 9; c++) {
-        const p = state.board[r][c];
-        if (!p || p.color !== side) continue;
-        const cellMoves = getMovesForPiece(state.board, r, c);
-        for (const [nr, nc] of cellMoves) {
-          moves.push({ from: [r, c], to: [nr, nc] });
-        }
-      }
+    state.serverMoves = null;
+    if (!state.gameId || state.gameOver) return;
+    const gameId = state.gameId;
+    fetch(API_BASE + '/api/game/' + gameId + '/legal_moves')
+      .then(res => res.json())
+      .then(data => {
+        if (gameId !== state.gameId || data.turn !== state.turn) return;
+        state.serverMoves = data.moves;
+      })
+      .catch(() => {});
+  }
+
+  function movesForSelection(r, c) {
+    if (state.serverMoves) {
+      return state.serverMoves.filter(m => m.from[0] === r && m.from[1] === c).map(m => m.to);
     }
-    return moves;
+    return getMovesForPiece(state.board, r, c);
   }
 
   function getMovesForPiece(board, r, c) {
@@ -241,7 +322,7 @@
       }
       if (piece && piece.color === state.turn) {
         state.selected = [r, c];
-        state.legalMoves = getMovesForPiece(state.board, r, c);
+        state.legalMoves = movesForSelection(r, c);
       } else {
         state.selected = null;
         state.legalMoves = [];
@@ -249,17 +330,97 @@
     } else {
       if (piece && piece.color === state.turn) {
         state.selected = [r, c];
-        state.legalMoves = getMovesForPiece(state.board, r, c);
+        state.legalMoves = movesForSelection(r, c);
       }
     }
     renderBoard();
   }
 
+  function applyAiResult(data) {
+    // 同一着法可能经事件流与轮询各到一次，applyWire 按步数去重
+    if (!applyWire(data)) return;
+    playMoveSound();
+    renderBoard();
+    getLegalMovesFromServer();
+  }
+
+  // 订阅本局事件流：AI 着法与搜索进度由服务端推送，不再占用请求等待搜索
+  function openEvents(gameId) {
+    if (state.events) state.events.close();
+    state.events = null;
+    if (typeof EventSource === 'undefined') return;
+    const es = new EventSource(API_BASE + '/api/game/' + gameId + '/events?format=compact&since=' + state.movesCount);
+    state.events = es;
+    const handle = (name, fn) => es.addEventListener(name, e => {
+      if (gameId !== state.gameId) return;
+      fn(JSON.parse(e.data));
+    });
+    // 连接或重连时收到当前局面，补上断线期间错过的着法
+    handle('state', applyAiResult);
+    handle('ai_progress', data => {
+      if (!state.gameOver) statusEl.textContent = 'AI 思考中… 深度 ' + data.depth;
+    });
+    handle('ai_move', applyAiResult);
+    handle('ai_error', data => {
+      statusEl.textContent = data.error || 'AI 搜索失败';
+    });
+  }
+
+  // 等待 AI 着法：有事件流时等推送，否则长轮询
+  function waitForAi(gameId, jobId) {
+    if (state.events && state.events.readyState !== EventSource.CLOSED) return;
+    pollAiJob(gameId, jobId);
+  }
+
+  // 长轮询 AI 任务，直到搜索结束
+  function pollAiJob(gameId, jobId) {
+    api('/api/game/' + gameId + '/ai_job/' + jobId + '?wait=25000&since=' + state.movesCount)
+      .then(res => res.json())
+      .then(job => {
+        if (gameId !== state.gameId) return;
+        if (job.status === 'pending') {
+          pollAiJob(gameId, jobId);
+        } else if (job.status === 'done') {
+          applyAiResult(job);
+        } else {
+          statusEl.textContent = job.error || 'AI 搜索失败';
+        }
+      })
+      .catch(() => {
+        statusEl.textContent = '请求失败';
+      });
+  }
+
+  // 提交 AI 任务；服务器繁忙 (429) 时稍后重试
+  function startAiJob(gameId) {
+    api('/api/game/' + gameId + '/ai_job?since=' + state.movesCount, { method: 'POST' })
+      .then(res => {
+        if (res.status === 429) {
+          statusEl.textContent = '服务器繁忙，稍后重试…';
+          setTimeout(() => startAiJob(gameId), 1000);
+          return null;
+        }
+        return res.json();
+      })
+      .then(job => {
+        if (!job || gameId !== state.gameId) return;
+        if (job.error) {
+          statusEl.textContent = job.error;
+        } else if (job.status === 'done') {
+          applyAiResult(job);
+        } else {
+          waitForAi(gameId, job.job_id);
+        }
+      })
+      .catch(() => {});
+  }
+
   function submitMove(fromR, fromC, toR, toC) {
-    fetch(API_BASE + '/api/game/' + state.gameId + '/move', {
+    const gameId = state.gameId;
+    api('/api/game/' + gameId + '/move', {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ from: [fromR, fromC], to: [toR, toC] }),
+      body: JSON.stringify({ from: [fromR, fromC], to: [toR, toC], async_ai: true, since: state.movesCount }),
     })
       .then(res => res.json())
       .then(data => {
@@ -267,25 +428,19 @@
           statusEl.textContent = data.error;
           return;
         }
-        playMoveSound();
-        state.board = data.board;
-        state.turn = data.turn;
         state.selected = null;
         state.legalMoves = [];
-        if (data.game_over) {
-          state.gameOver = true;
-          state.winner = data.winner;
-        }
-        if (data.ai_move) {
-          state.board = data.board;
-          state.turn = data.turn;
-          if (data.game_over) {
-            state.gameOver = true;
-            state.winner = data.winner;
-          }
-          playMoveSound();
-        }
+        // AI 着法经事件流先到时，applyWire 按步数忽略较旧的走子响应
+        if (applyWire(data)) playMoveSound();
         renderBoard();
+        getLegalMovesFromServer();
+        if (data.ai_job) {
+          if (data.ai_job.status === 'done') applyAiResult(data.ai_job);
+          else waitForAi(gameId, data.ai_job.job_id);
+        } else if (data.ai_pending) {
+          // 走子已生效但搜索池满，改由 /ai_job 提交（429 时自动重试）
+          startAiJob(gameId);
+        }
       })
       .catch(() => {
         statusEl.textContent = '请求失败';
@@ -296,7 +451,7 @@
     const difficulty = difficultyEl.value;
     const blackIsAi = blackIsAiEl.checked;
     const redIsAi = !blackIsAi;
-    fetch(API_BASE + '/api/game/new', {
+    api('/api/game/new', {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
       body: JSON.stringify({ difficulty, red_is_ai: redIsAi }),
@@ -304,28 +459,19 @@
       .then(res => res.json())
       .then(data => {
         state.gameId = data.game_id;
-        state.board = data.board;
-        state.turn = data.turn;
         state.difficulty = data.difficulty;
         state.redIsAi = data.red_is_ai;
+        state.movesCount = 0;
         state.selected = null;
         state.legalMoves = [];
         state.gameOver = false;
         state.winner = null;
+        applyWire(data);
         renderBoard();
+        getLegalMovesFromServer();
+        openEvents(state.gameId);
         if (state.redIsAi && state.turn === RED) {
-          fetch(API_BASE + '/api/game/' + state.gameId + '/ai_move', { method: 'POST' })
-            .then(r => r.json())
-            .then(d => {
-              if (d.board) {
-                playMoveSound();
-                state.board = d.board;
-                state.turn = d.turn;
-                if (d.game_over) { state.gameOver = true; state.winner = d.winner; }
-                renderBoard();
-              }
-            })
-            .catch(() => {});
+          startAiJob(state.gameId);
         }
       })
       .catch(() => {
@@ -354,13 +500,14 @@
   }
 
   function showHistoryDetail(id) {
-    fetch(API_BASE + '/api/history/' + id)
+    fetch(API_BASE + '/api/history/' + id + '?ply=-1')
       .then(res => res.json())
       .then(data => {
         if (data.error) return;
-        const snapshots = data.board_snapshots || [];
-        state.board = snapshots.length ? snapshots[snapshots.length - 1] : null;
+        state.board = data.board || null;
         state.gameId = null;
+        if (state.events) state.events.close();
+        state.events = null;
         state.gameOver = true;
         state.winner = data.winner || null;
         state.selected = null;
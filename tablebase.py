@@ -0,0 +1,433 @@
+# -*- coding: utf-8 -*-
+"""残局库：对少子残局做逆向分析，得到每个局面的胜负与到将死的步数（DTM），AI 查表即可走出最优着法。
+
+生成：按子力组合（如 KR_KAA 表示红方帅车、黑方将双士）枚举全部合法局面，以 chess_engine 的走法生成建立
+父子关系，从将死局面出发逐层倒推。困毙按本项目规则记为和棋；吃子后离开本组合的局面查更小的残局库。
+文件格式（小端）：头部 16 字节（魔数 b'XQTB'、版本 u16、保留 u16、条目数 u32、初始局面键低 32 位 u32），
+之后每条 10 字节：局面键 u64（position_key，含走棋方）、值 i16（正数 v 为 v 步内胜，负数 v 为 -v-1 步后负）。
+和棋不入表：表存在而查不到即为和棋。
+
+用法：python tablebase.py build                 # 生成默认的全部残局
+      python tablebase.py build KR_K KR_KA       # 只生成指定组合（依赖的小组合须已生成）
+      python tablebase.py probe "3k5/9/9/9/9/9/9/9/4R4/5K3 w"
+"""
+
+import argparse
+import itertools
+import mmap
+import os
+import struct
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from chess_engine import (
+    Position,
+    Move,
+    initial_board,
+    all_legal_moves,
+    make_move,
+    unmake_move,
+    is_king_attacked,
+    kings_face_each_other,
+    position_key,
+    board_from_fen,
+    move_to_iccs,
+    opponent,
+    FEN_LETTERS,
+    KING,
+    ADVISOR,
+    ELEPHANT,
+    HORSE,
+    ROOK,
+    CANNON,
+    PAWN,
+    BLACK_FLAG,
+    TYPE_MASK,
+    RED,
+    BLACK,
+)
+
+TABLEBASE_DIR = os.environ.get('AI_TABLEBASE_DIR', os.path.join(os.path.dirname(__file__), 'data', 'tablebase'))
+
+# 默认生成的残局（按依赖顺序：吃子后的小组合排在前面）。单马、单兵对光将因困毙记和，
+# 表为空，但马兵对光将（KNP_K，约 50 万局面）吃子后要查它们，一并生成
+DEFAULT_SIGNATURES = ['KR_K', 'KR_KA', 'KR_KB', 'KR_KAA', 'KR_KAB', 'KR_KBB', 'KN_K', 'KP_K', 'KNP_K']
+
+WIN, LOSS, DRAW = 'win', 'loss', 'draw'
+
+_MAGIC = b'XQTB'
+_VERSION = 1
+_HEADER = struct.Struct('<4sHHII')
+_ENTRY = struct.Struct('<Qh')
+
+_LETTER_CODES = {letter.upper(): code for code, letter in FEN_LETTERS.items()}
+# 能够将死对方的子；双方都没有时必为和棋
+_ATTACKERS = (ROOK, HORSE, CANNON, PAWN)
+
+
+def _initial_key_check() -> int:
+    return position_key(initial_board(), RED) & 0xFFFFFFFF
+
+
+def material_signature(board: Position) -> Tuple[str, str]:
+    """双方子力的字母串，如 ('KR', 'KAA')；字母按 FEN 大写，帅/将在前，其余按兵种编码排序。"""
+    red, black = [], []
+    for p in board.cells:
+        if p:
+            (black if p & BLACK_FLAG else red).append(p & TYPE_MASK)
+    return (''.join(FEN_LETTERS[c].upper() for c in sorted(red)),
+            ''.join(FEN_LETTERS[c].upper() for c in sorted(black)))
+
+
+def _has_attackers(sig: str) -> bool:
+    return any(_LETTER_CODES[ch] in _ATTACKERS for ch in sig)
+
+
+def flip_board(board: Position) -> Position:
+    """上下翻转棋盘并交换红黑，用于把“黑方占优”的局面换成表中的“红方占优”方向。"""
+    cells = bytearray(90)
+    for sq, p in enumerate(board.cells):
+        if p:
+            r, c = divmod(sq, 9)
+            cells[(9 - r) * 9 + c] = p ^ BLACK_FLAG
+    return Position(cells)
+
+
+def _flip_sq(sq: int) -> int:
+    r, c = divmod(sq, 9)
+    return (9 - r) * 9 + c
+
+
+class Tablebase:
+    """单个残局文件：mmap 后按局面键二分查找，与开局库相同的查找方式。"""
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, count, check = _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError('not a tablebase file: %s' % path)
+        if check != _initial_key_check():
+            raise ValueError('tablebase was built with different Zobrist keys: %s' % path)
+        if _HEADER.size + count * _ENTRY.size > len(self._mm):
+            raise ValueError('truncated tablebase: %s' % path)
+        self.count = count
+
+    def probe_key(self, key: int) -> int:
+        """返回编码后的值；查不到（和棋）时返回 0。"""
+        lo, hi = 0, self.count
+        mm = self._mm
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if struct.unpack_from('<Q', mm, _HEADER.size + mid * _ENTRY.size)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count:
+            k, value = _ENTRY.unpack_from(mm, _HEADER.size + lo * _ENTRY.size)
+            if k == key:
+                return value
+        return 0
+
+
+def _decode(value: int) -> Tuple[str, int]:
+    if value > 0:
+        return WIN, value
+    if value < 0:
+        return LOSS, -value - 1
+    return DRAW, 0
+
+
+class TablebaseSet:
+    """
+    目录下全部残局文件的查询入口。
+    步骤1：按双方子力找到对应的表；只有黑方占优方向的表时把局面翻转后再查。
+    步骤2：双方都没有进攻子力的局面直接判和；没有对应表时返回 None，由调用方继续搜索。
+    """
+
+    def __init__(self, directory: str = TABLEBASE_DIR):
+        self.directory = directory
+        self._tables = {}
+
+    def table(self, signature: str) -> Optional[Tablebase]:
+        if signature not in self._tables:
+            path = os.path.join(self.directory, signature + '.xtb')
+            table = None
+            if os.path.isfile(path):
+                try:
+                    table = Tablebase(path)
+                except (ValueError, OSError):
+                    table = None
+            self._tables[signature] = table
+        return self._tables[signature]
+
+    def probe(self, board: Position, side: str) -> Optional[Tuple[str, int]]:
+        """返回 side 方视角的 (胜负, 到将死的步数)；不在残局库范围内时返回 None。"""
+        red, black = material_signature(board)
+        if not _has_attackers(red) and not _has_attackers(black):
+            return DRAW, 0
+        table = self.table(red + '_' + black)
+        if table is not None:
+            return _decode(table.probe_key(position_key(board, side)))
+        table = self.table(black + '_' + red)
+        if table is not None:
+            return _decode(table.probe_key(position_key(flip_board(board), opponent(side))))
+        return None
+
+    def best_move(self, board: Position, side: str) -> Optional[Tuple[Move, str, int]]:
+        """
+        按残局库选着：能赢选最快将死的着法，不能赢则保和，必输则拖到最久。
+        返回 (着法, 走后 side 方的胜负, 步数)；当前局面或某个走后局面不在库中时返回 None。
+        """
+        red, black = material_signature(board)
+        if not _has_attackers(red) and not _has_attackers(black):
+            # 双方都无进攻子力：必和，着法交给搜索按评估选择
+            return None
+        if self.probe(board, side) is None:
+            return None
+        best, best_rank = None, None
+        for move in all_legal_moves(board, side):
+            undo = make_move(board, move[0], move[1])
+            result = self.probe(board, opponent(side))
+            unmake_move(board, undo)
+            if result is None:
+                return None
+            outcome, dtm = result
+            # 对方输 = 我方赢：步数越少越好；和棋其次；对方赢：步数越多越好
+            if outcome == LOSS:
+                rank, mine = (0, dtm), (WIN, dtm + 1)
+            elif outcome == DRAW:
+                rank, mine = (1, 0), (DRAW, 0)
+            else:
+                rank, mine = (2, -dtm), (LOSS, dtm + 1)
+            if best_rank is None or rank < best_rank:
+                best, best_rank = (move,) + mine, rank
+        return best
+
+
+_tablebases = None
+
+
+def get_tablebases() -> TablebaseSet:
+    """进程内共享的残局库；目录不存在时所有查询都返回 None。"""
+    global _tablebases
+    if _tablebases is None:
+        _tablebases = TablebaseSet()
+    return _tablebases
+
+
+# ---------- 生成 ----------
+
+_RED_PALACE = [r * 9 + c for r in (7, 8, 9) for c in (3, 4, 5)]
+_RED_ADVISOR = [9 * 9 + 3, 9 * 9 + 5, 8 * 9 + 4, 7 * 9 + 3, 7 * 9 + 5]
+_RED_ELEPHANT = [9 * 9 + 2, 9 * 9 + 6, 7 * 9 + 0, 7 * 9 + 4, 7 * 9 + 8, 5 * 9 + 2, 5 * 9 + 6]
+_RED_PAWN = [r * 9 + c for r in (5, 6) for c in (0, 2, 4, 6, 8)] + list(range(45))
+
+
+def _allowed_squares(code: int, color: str) -> List[int]:
+    """某方某兵种可能出现的格（按红方定义，黑方上下翻转）。"""
+    if code == KING:
+        squares = _RED_PALACE
+    elif code == ADVISOR:
+        squares = _RED_ADVISOR
+    elif code == ELEPHANT:
+        squares = _RED_ELEPHANT
+    elif code == PAWN:
+        squares = _RED_PAWN
+    else:
+        squares = list(range(90))
+    squares = sorted(squares)
+    return squares if color == RED else sorted(_flip_sq(sq) for sq in squares)
+
+
+class _Layout:
+    """
+    一个子力组合的局面编号：index = side + 2 * Σ(各子在其可达格表中的序号 × 位权)。
+    同兵种同色的多个子按序号升序排列，其余排列视为无效编号。
+    """
+
+    def __init__(self, signature: str):
+        red, black = signature.split('_')
+        self.pieces = [(_LETTER_CODES[ch], RED) for ch in red] + [(_LETTER_CODES[ch], BLACK) for ch in black]
+        self.codes = [code | (BLACK_FLAG if color == BLACK else 0) for code, color in self.pieces]
+        self.squares = [_allowed_squares(code, color) for code, color in self.pieces]
+        self.slot_of = [{sq: i for i, sq in enumerate(s)} for s in self.squares]
+        self.weights = []
+        w = 2
+        for s in self.squares:
+            self.weights.append(w)
+            w *= len(s)
+        self.size = w
+        # 同兵种同色的子分组，用于规范化顺序
+        self.groups = [[i for i, c in enumerate(self.codes) if c == code] for code in sorted(set(self.codes))]
+        self.groups = [g for g in self.groups if len(g) > 1]
+
+    def index(self, slots: List[int], side: str) -> int:
+        for g in self.groups:
+            ordered = sorted(slots[i] for i in g)
+            for i, s in zip(g, ordered):
+                slots[i] = s
+        return (1 if side == BLACK else 0) + sum(s * w for s, w in zip(slots, self.weights))
+
+    def canonical(self, slots) -> bool:
+        for g in self.groups:
+            values = [slots[i] for i in g]
+            if any(a >= b for a, b in zip(values, values[1:])):
+                return False
+        return True
+
+    def squares_of(self, slots) -> List[int]:
+        return [self.squares[i][s] for i, s in enumerate(slots)]
+
+
+def generate(signature: str, tables: TablebaseSet, log=print) -> Dict[int, int]:
+    """
+    逆向分析一个子力组合，返回 {局面键: 编码值}（只含胜负局面）。
+    步骤1：枚举全部合法局面，记录每个局面的子局面编号；吃子导致子力变化的走法直接查更小的残局库，
+           作为“在第 d 层发生”的外部事件。
+    步骤2：无着法且被将军的局面为第 0 层负局面；困毙为和。
+    步骤3：逐层处理：子局面在第 d 层判负 → 父局面第 d+1 层判胜；
+           子局面判胜使父局面的未决子数减一，减到 0 → 父局面第 d+1 层判负。其余局面为和。
+    """
+    layout = _Layout(signature)
+    n = layout.size
+    edge_parent, edge_child = array('l'), array('l')
+    remaining = array('H', [0]) * n
+    external = {}   # 层 -> [(父局面编号, 子局面的胜负)]
+    status = bytearray(n)   # 0 未决 1 胜 2 负
+    dtm = array('H', [0]) * n
+    keys = {}
+    level0 = []
+    start = time.perf_counter()
+
+    for slots in itertools.product(*[range(len(s)) for s in layout.squares]):
+        if not layout.canonical(slots):
+            continue
+        squares = layout.squares_of(slots)
+        if len(set(squares)) != len(squares):
+            continue
+        cells = bytearray(90)
+        for sq, code in zip(squares, layout.codes):
+            cells[sq] = code
+        board = Position(cells)
+        if kings_face_each_other(board):
+            continue
+        for side in (RED, BLACK):
+            if is_king_attacked(board, opponent(side)):
+                continue
+            idx = layout.index(list(slots), side)
+            keys[idx] = position_key(board, side)
+            moves = all_legal_moves(board, side)
+            if not moves:
+                if is_king_attacked(board, side):
+                    status[idx] = 2
+                    level0.append(idx)
+                continue
+            # 和棋的子局面不会产生事件，计数永远不会归零，父局面自然不会被判负
+            remaining[idx] = len(moves)
+            for move in moves:
+                if board.cells[move[1]]:
+                    undo = make_move(board, move[0], move[1])
+                    result = tables.probe(board, opponent(side))
+                    sig = material_signature(board)
+                    unmake_move(board, undo)
+                    if result is None:
+                        raise RuntimeError('%s needs the tablebase for %s_%s first' % ((signature,) + sig))
+                    if result[0] != DRAW:
+                        external.setdefault(result[1], []).append((idx, result[0]))
+                    continue
+                moved = squares.index(move[0])
+                child_slots = list(slots)
+                child_slots[moved] = layout.slot_of[moved][move[1]]
+                edge_parent.append(idx)
+                edge_child.append(layout.index(child_slots, opponent(side)))
+    log('%s: %d positions enumerated in %.1fs' % (signature, len(keys), time.perf_counter() - start))
+
+    # 按子局面编号把边排成 CSR：parent_start[c]..parent_start[c+1] 为 c 的全部父局面
+    parent_start = array('l', [0]) * (n + 1)
+    for c in edge_child:
+        parent_start[c + 1] += 1
+    for i in range(n):
+        parent_start[i + 1] += parent_start[i]
+    fill = array('l', parent_start)
+    parents = array('l', [0]) * len(edge_child)
+    for p, c in zip(edge_parent, edge_child):
+        parents[fill[c]] = p
+        fill[c] += 1
+    del edge_parent, edge_child, fill
+
+    frontier = level0
+    d = 0
+    max_level = max(external) if external else 0
+    while frontier or d <= max_level:
+        events = [(p, status[c]) for c in frontier for p in parents[parent_start[c]:parent_start[c + 1]]]
+        events += [(p, 1 if outcome == WIN else 2) for p, outcome in external.get(d, ())]
+        frontier = []
+        for p, child_status in events:
+            if status[p]:
+                continue
+            if child_status == 2:
+                status[p], dtm[p] = 1, d + 1
+                frontier.append(p)
+            else:
+                remaining[p] -= 1
+                if remaining[p] == 0:
+                    status[p], dtm[p] = 2, d + 1
+                    frontier.append(p)
+        d += 1
+    result = {}
+    for idx, key in keys.items():
+        if status[idx] == 1:
+            result[key] = dtm[idx]
+        elif status[idx] == 2:
+            result[key] = -dtm[idx] - 1
+    wins = sum(1 for v in result.values() if v > 0)
+    log('%s: %d wins, %d losses, %d draws, longest mate %d plies, %.1fs' % (
+        signature, wins, len(result) - wins, len(keys) - len(result),
+        max((abs(v) for v in result.values()), default=0), time.perf_counter() - start))
+    return result
+
+
+def write_table(path: str, entries: Dict[int, int]) -> int:
+    d = os.path.dirname(path)
+    if d and not os.path.isdir(d):
+        os.makedirs(d, exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, 0, len(entries), _initial_key_check()))
+        for key in sorted(entries):
+            f.write(_ENTRY.pack(key, entries[key]))
+    os.replace(tmp, path)
+    return len(entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='xiangqi endgame tablebases')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('build', help='逆向分析生成残局库')
+    p.add_argument('signatures', nargs='*', default=DEFAULT_SIGNATURES)
+    p.add_argument('--out', default=TABLEBASE_DIR)
+    p = sub.add_parser('probe', help='查询一个局面')
+    p.add_argument('fen')
+    p.add_argument('--dir', default=TABLEBASE_DIR)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        tables = TablebaseSet(args.out)
+        for signature in args.signatures:
+            entries = generate(signature, tables)
+            path = os.path.join(args.out, signature + '.xtb')
+            write_table(path, entries)
+            print('%s -> %s (%d bytes)' % (signature, path, os.path.getsize(path)))
+    else:
+        tables = TablebaseSet(args.dir)
+        board, side = board_from_fen(args.fen)
+        print('probe:', tables.probe(board, side))
+        best = tables.best_move(board, side)
+        if best is not None:
+            print('best: %s (%s in %d plies)' % (move_to_iccs(best[0]), best[1], best[2]))
+
+
+if __name__ == '__main__':
+    main()
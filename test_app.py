@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""接口回归测试：python -m pytest -q test_app.py（搜索池用线程模式，不起工作进程）。"""
+
+import pytest
+
+import app as app_module
+import search_pool
+from search_pool import SearchPool, MAX_JOBS_BY_DIFFICULTY
+from session_store import SQLiteSessionStore, SessionConflict
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(search_pool, '_pool', SearchPool(workers=0))
+    yield app_module.app.test_client()
+    search_pool._pool.shutdown()
+
+
+def _full_pool():
+    return SearchPool(workers=0, limits={d: 0 for d in MAX_JOBS_BY_DIFFICULTY}, max_queue=0)
+
+
+def test_move_when_pool_full_keeps_move_and_allows_retry(client, monkeypatch):
+    game_id = client.post('/api/game/new', json={'difficulty': 'normal'}).get_json()['game_id']
+    move = client.get('/api/game/%s/legal_moves' % game_id).get_json()['moves'][0]
+
+    monkeypatch.setattr(search_pool, '_pool', _full_pool())
+    resp = client.post('/api/game/%s/move' % game_id, json=dict(move, async_ai=True))
+    # 走子已生效：返回 202 与新局面，标明 AI 待提交而不是 429
+    assert resp.status_code == 202
+    data = resp.get_json()
+    assert data['ai_pending'] is True and 'ai_job' not in data
+    assert data['moves_count'] == 1 and data['turn'] == 'black'
+    assert resp.headers['Retry-After'] == '1'
+    # 池仍满时补提交得到 429，客户端据此重试
+    assert client.post('/api/game/%s/ai_job' % game_id).status_code == 429
+
+    monkeypatch.setattr(search_pool, '_pool', SearchPool(workers=0))
+    job = client.post('/api/game/%s/ai_job' % game_id).get_json()
+    done = client.get('/api/game/%s/ai_job/%s?wait=5000' % (game_id, job['job_id'])).get_json()
+    assert done['status'] == 'done'
+    state = client.get('/api/game/%s' % game_id).get_json()
+    assert state['moves_count'] == 2 and state['turn'] == 'red'
+
+
+def test_sqlite_store_rejects_stale_write(client, monkeypatch, tmp_path):
+    path = str(tmp_path / 'sessions.db')
+    monkeypatch.setattr(app_module, 'games', SQLiteSessionStore(path))
+    other = SQLiteSessionStore(path)  # 另一个服务进程
+    game_id = client.post('/api/game/new', json={'difficulty': 'normal'}).get_json()['game_id']
+    move = client.get('/api/game/%s/legal_moves' % game_id).get_json()['moves'][0]
+
+    stale = other.get(game_id)
+    changes = other._conn().total_changes
+    other.get(game_id)
+    # 刚顺延过的对局再次读取不写库
+    assert other._conn().total_changes == changes
+
+    assert client.post('/api/game/%s/move' % game_id, json=move).status_code == 200
+    with pytest.raises(SessionConflict):
+        other.put(game_id, stale)
+
+    # 本进程读到对局之后、写回之前另一个进程先写了：这步不落库，返回 409
+    play_move = app_module._play_move
+
+    def racing_play_move(g, m):
+        other.put(game_id, other.get(game_id))
+        return play_move(g, m)
+
+    monkeypatch.setattr(app_module, '_play_move', racing_play_move)
+    state = client.get('/api/game/%s' % game_id).get_json()
+    move = client.get('/api/game/%s/legal_moves' % game_id).get_json()['moves'][0]
+    assert client.post('/api/game/%s/move' % game_id, json=move).status_code == 409
+    assert client.get('/api/game/%s' % game_id).get_json()['moves_count'] == state['moves_count']
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""置换表：按局面键缓存搜索结果，供 negamax 在兄弟子树之间、相邻两步之间复用。"""
+
+from typing import Optional, Tuple
+
+# 边界类型
+EXACT, LOWER, UPPER = 0, 1, 2
+
+# 表项：(局面键, 深度, 边界类型, 分数, 最佳着法, 搜索代数)
+Entry = Tuple[int, int, int, float, Optional[Tuple[int, int]], int]
+
+
+class TranspositionTable:
+    """
+    固定大小的置换表，共 2 ** size_bits 个桶，每桶两格：
+    深度格只被更深的结果（或上一次搜索留下的旧结果）替换，近期格总是被替换。
+    分数以该局面走棋方的视角保存（局面键含走棋方），双方可以共用一张表。
+    """
+
+    def __init__(self, size_bits: int = 14):
+        self.mask = (1 << size_bits) - 1
+        self.deep = [None] * (1 << size_bits)
+        self.recent = [None] * (1 << size_bits)
+        self.generation = 0
+
+    def new_search(self):
+        """每次 ai_choose_move 开始时调用，使上一步留下的深结果可以被替换。"""
+        self.generation += 1
+
+    def clear(self):
+        self.deep = [None] * len(self.deep)
+        self.recent = [None] * len(self.recent)
+
+    def probe(self, key: int) -> Optional[Entry]:
+        i = key & self.mask
+        e = self.deep[i]
+        if e is not None and e[0] == key:
+            return e
+        e = self.recent[i]
+        if e is not None and e[0] == key:
+            return e
+        return None
+
+    def store(self, key: int, depth: int, bound: int, score: float, move: Optional[Tuple[int, int]]):
+        i = key & self.mask
+        entry = (key, depth, bound, score, move, self.generation)
+        e = self.deep[i]
+        if e is None or e[0] == key or depth >= e[1] or e[5] != self.generation:
+            self.deep[i] = entry
+        else:
+            self.recent[i] = entry
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""紧凑线格式：对局状态用 FEN 全量下发，之后每步只发增量，代替每次重发 10x9 的棋子字典。
+
+协议版本 1（媒体类型 COMPACT_MEDIA_TYPE），消息为 JSON 对象：
+  全量：{"v": 1, "ply": 步数, "turn": 走棋方, "key": 局面键, "fen": FEN}
+  增量：{"v": 1, "ply": 步数, "turn": 走棋方, "key": 局面键, "since": 起始步数, "d": [[ICCS, 走动棋子, 被吃棋子, 走后局面键], ...]}
+棋子用 FEN 字母（大写红方、小写黑方），没有吃子为 ""；局面键为 position_key 的 16 位十六进制，客户端据此核对。
+增量第 k 条（从 0 起）是第 since + k + 1 步；客户端的步数与 since 对不上时应改取全量。
+"""
+
+from typing import List, Optional, Sequence
+
+from chess_engine import (
+    Position,
+    make_move,
+    board_to_fen,
+    move_to_iccs,
+    position_key,
+    ZOBRIST_PIECES,
+    ZOBRIST_BLACK_TO_MOVE,
+    FEN_LETTERS,
+    TYPE_MASK,
+    BLACK_FLAG,
+    BLACK,
+)
+
+WIRE_VERSION = 1
+COMPACT_MEDIA_TYPE = 'application/vnd.xiangqi.v1+json'
+# 客户端落后超过这么多步时直接发全量（增量已不比 FEN 小）
+MAX_DELTA_PLIES = 32
+
+
+def piece_letter(p: int) -> str:
+    if not p:
+        return ''
+    letter = FEN_LETTERS[p & TYPE_MASK]
+    return letter if p & BLACK_FLAG else letter.upper()
+
+
+def replay_captures(start: Position, moves: Sequence) -> List[int]:
+    """从起始局面重走一遍，得到每步被吃的棋子编码（0 为未吃子）；用于补全没有记录吃子的旧会话。"""
+    board = start.copy()
+    captures = []
+    for move in moves:
+        captures.append(board.cells[move[1]])
+        make_move(board, move[0], move[1])
+    return captures
+
+
+def ply_deltas(board: Position, side: str, moves: Sequence, captures: Sequence[int], since: int) -> List[list]:
+    """
+    board/side 为走完 moves 后的局面与走棋方，返回第 since 步之后各步的增量。
+    步骤1：从当前局面往回撤：走动的棋子就在落点上，被吃的棋子取自 captures，局面键按 Zobrist 反向异或。
+    步骤2：撤的同时记下每步走后的局面键（走棋方逐步交替），最后按先后顺序返回。
+    """
+    cells = bytearray(board.cells)
+    h = board.hash
+    black_to_move = side == BLACK
+    out = []
+    for i in range(len(moves) - 1, since - 1, -1):
+        from_sq, to_sq = moves[i]
+        piece, captured = cells[to_sq], captures[i]
+        key = h ^ ZOBRIST_BLACK_TO_MOVE if black_to_move else h
+        out.append([move_to_iccs(moves[i]), piece_letter(piece), piece_letter(captured), '%016x' % key])
+        h ^= ZOBRIST_PIECES[piece * 90 + to_sq] ^ ZOBRIST_PIECES[piece * 90 + from_sq]
+        if captured:
+            h ^= ZOBRIST_PIECES[captured * 90 + to_sq]
+        cells[from_sq], cells[to_sq] = piece, captured
+        black_to_move = not black_to_move
+    out.reverse()
+    return out
+
+
+def state_message(board: Position, side: str, moves: Sequence, captures: Sequence[int],
+                  since: Optional[int] = None) -> dict:
+    """since 有效（不超过当前步数且落后不超过 MAX_DELTA_PLIES）时返回增量消息，否则返回全量。"""
+    ply = len(moves)
+    out = {'v': WIRE_VERSION, 'ply': ply, 'turn': side, 'key': '%016x' % position_key(board, side)}
+    if since is not None and 0 <= since <= ply and ply - since <= MAX_DELTA_PLIES:
+        out['since'] = since
+        out['d'] = ply_deltas(board, side, moves, captures, since)
+    else:
+        out['fen'] = board_to_fen(board, side)
+    return out
+
+
+def state_etag(board: Position, side: str, ply: int, compact: bool) -> str:
+    """对局状态的 ETag：步数 + 局面键；两种格式的表示不同，各用各的标签。"""
+    return '%s%d-%016x' % ('v%d-' % WIRE_VERSION if compact else '', ply, position_key(board, side))
+